@@ -0,0 +1,73 @@
+"""
+Construye el índice offline y lo guarda como artefacto versionado.
+
+    python -m app.build_index --csv data/documentos.csv --salida data/indice --workers 8
+    python -m app.build_index --streaming --tam-lote 20000   # corpus mayor que la RAM
+    python -m app.build_index --verificar
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from .indexador import construir_indice, K_VECINOS
+from .preprocesamiento import TAM_FRAGMENTO
+from .ingesta_streaming import construir_indice_streaming, limpiar_trabajo, TAM_LOTE
+from .indice import guardar_indice, ruta_actual, verificar_indice
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Construye el índice de UPSCHOLAR")
+    parser.add_argument("--csv", default="data/documentos.csv", help="CSV del corpus")
+    parser.add_argument("--salida", default="data/indice", help="Directorio base del índice")
+    parser.add_argument("--k-vecinos", type=int, default=K_VECINOS, help="Vecinos por documento")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos para tokenizar y stemmizar")
+    parser.add_argument("--tam-fragmento", type=int, default=TAM_FRAGMENTO, help="Documentos por fragmento")
+    parser.add_argument("--streaming", action="store_true", help="Leer el CSV por lotes con memoria acotada")
+    parser.add_argument("--tam-lote", type=int, default=TAM_LOTE, help="Filas del CSV por lote (--streaming)")
+    parser.add_argument("--conservar", type=int, default=2, help="Versiones antiguas a conservar")
+    parser.add_argument("--verificar", action="store_true", help="Solo verificar checksums del índice actual")
+    args = parser.parse_args(argv)
+
+    if args.verificar:
+        ruta = ruta_actual(args.salida)
+        if ruta is None:
+            print(f"No hay índice en {args.salida}")
+            return 1
+        fallidos = verificar_indice(ruta)
+        if fallidos:
+            print(f"✗ Checksums inválidos en {ruta}: {', '.join(fallidos)}")
+            return 1
+        print(f"✓ Índice {ruta} verificado")
+        return 0
+
+    inicio = time.perf_counter()
+    if args.streaming:
+        dir_trabajo = tempfile.mkdtemp(prefix=".trabajo-", dir=os.path.dirname(os.path.abspath(args.salida)) or None)
+        try:
+            indice = construir_indice_streaming(
+                args.csv,
+                dir_trabajo=dir_trabajo,
+                tam_lote=args.tam_lote,
+                k_vecinos=args.k_vecinos,
+                workers=args.workers,
+                tam_fragmento=args.tam_fragmento
+            )
+            guardar_indice(indice, args.salida, args.csv, conservar=args.conservar)
+        finally:
+            limpiar_trabajo(dir_trabajo)
+    else:
+        indice = construir_indice(
+            args.csv,
+            k_vecinos=args.k_vecinos,
+            workers=args.workers,
+            tam_fragmento=args.tam_fragmento
+        )
+        guardar_indice(indice, args.salida, args.csv, conservar=args.conservar)
+    print(f"✓ Índice construido en {time.perf_counter() - inicio:.2f} segundos")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Caché de embeddings de consultas (RETRIEVAL_QUERY) en dos niveles:
+LRU en memoria + SQLite en disco, con clave hash(modelo, texto normalizado).
+Las peticiones idénticas en vuelo se agrupan (single-flight): solo la
+primera llama a la API y las demás esperan su resultado. En el camino
+asíncrono, SQLite (lectura, marca de uso y commit) se consulta en un hilo:
+en el event loop solo queda la búsqueda en memoria y la espera de la API.
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+# Entradas en memoria y tamaño máximo de la tabla en disco
+MAX_EN_MEMORIA = 1024
+MAX_BYTES_DISCO = 256 * 1024 * 1024
+# Cada cuántas inserciones se comprueba el tamaño en disco
+INTERVALO_RECORTE = 64
+
+
+def normalizar_consulta(texto: str) -> str:
+    """
+    Forma canónica del texto de la consulta: NFC, minúsculas y espacios colapsados.
+    """
+    return " ".join(unicodedata.normalize("NFC", texto).casefold().split())
+
+
+class CacheEmbeddingsConsulta:
+    """
+    - obtener / guardar: acceso directo a los dos niveles
+    - obtener_o_calcular(_async): caché + single-flight alrededor de `calcular`
+    Los resultados None (errores de la API) no se guardan.
+    """
+
+    def __init__(self, modelo: str, ruta_db: Optional[str] = "data/embeddings/consultas.sqlite",
+                 max_en_memoria: int = MAX_EN_MEMORIA, max_bytes_disco: int = MAX_BYTES_DISCO):
+        self.modelo = modelo
+        self.max_en_memoria = max_en_memoria
+        self.max_bytes_disco = max_bytes_disco
+
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+        self._en_vuelo_async = {}
+        self._insertados = 0
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self.agrupadas = 0
+
+        self._db = None
+        if ruta_db:
+            try:
+                Path(ruta_db).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(ruta_db, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    " clave TEXT PRIMARY KEY, modelo TEXT NOT NULL, dtype TEXT NOT NULL,"
+                    " vector BLOB NOT NULL, ultimo_uso REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_uso ON embeddings (ultimo_uso)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠ Caché de consultas solo en memoria ({ruta_db}): {e}")
+                self._db = None
+
+    def clave(self, texto: str) -> str:
+        return hashlib.sha256(f"{self.modelo}\0{normalizar_consulta(texto)}".encode("utf-8")).hexdigest()
+
+    # ---------- niveles ----------
+    def obtener(self, clave: str) -> Optional[np.ndarray]:
+        vector = self._obtener_memoria(clave)
+        return vector if vector is not None else self._obtener_disco(clave)
+
+    def _obtener_memoria(self, clave: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._memoria.get(clave)
+            if vector is not None:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+            return vector
+
+    def _obtener_disco(self, clave: str) -> Optional[np.ndarray]:
+        with self._lock:
+            if self._db is not None:
+                fila = self._db.execute(
+                    "SELECT dtype, vector FROM embeddings WHERE clave = ?", (clave,)
+                ).fetchone()
+                if fila is not None:
+                    self._db.execute("UPDATE embeddings SET ultimo_uso = ? WHERE clave = ?", (time.time(), clave))
+                    self._db.commit()
+                    vector = np.frombuffer(fila[1], dtype=fila[0])
+                    vector.flags.writeable = False
+                    self._en_memoria(clave, vector)
+                    self.aciertos_disco += 1
+                    return vector
+
+            return None
+
+    def guardar(self, clave: str, vector: np.ndarray):
+        vector = np.array(vector)
+        vector.flags.writeable = False
+        with self._lock:
+            self._en_memoria(clave, vector)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (clave, modelo, dtype, vector, ultimo_uso) VALUES (?, ?, ?, ?, ?)",
+                    (clave, self.modelo, vector.dtype.str, vector.tobytes(), time.time())
+                )
+                self._db.commit()
+                self._insertados += 1
+                if self._insertados % INTERVALO_RECORTE == 0:
+                    self._recortar_disco()
+            except sqlite3.Error as e:
+                print(f"⚠ No se pudo guardar el embedding de la consulta: {e}")
+
+    def _en_memoria(self, clave: str, vector: np.ndarray):
+        self._memoria[clave] = vector
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_en_memoria:
+            self._memoria.popitem(last=False)
+
+    def _recortar_disco(self):
+        """
+        Borra las entradas usadas hace más tiempo hasta quedar por debajo de max_bytes_disco.
+        """
+        total = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes_disco:
+            return
+        exceso = total - self.max_bytes_disco
+        borrar = []
+        for clave, tam in self._db.execute("SELECT clave, LENGTH(vector) FROM embeddings ORDER BY ultimo_uso"):
+            if exceso <= 0:
+                break
+            borrar.append((clave,))
+            exceso -= tam
+        self._db.executemany("DELETE FROM embeddings WHERE clave = ?", borrar)
+        self._db.commit()
+
+    # ---------- single-flight ----------
+    def obtener_o_calcular(self, texto: str, calcular: Callable[[str], Optional[np.ndarray]]) -> Optional[np.ndarray]:
+        clave = self.clave(texto)
+        vector = self.obtener(clave)
+        if vector is not None:
+            return vector
+
+        with self._lock:
+            futuro = self._en_vuelo.get(clave)
+            propio = futuro is None
+            if propio:
+                futuro = self._en_vuelo[clave] = Future()
+                self.fallos += 1
+            else:
+                self.agrupadas += 1
+        if not propio:
+            return futuro.result()
+
+        try:
+            vector = calcular(texto)
+            if vector is not None:
+                self.guardar(clave, vector)
+            futuro.set_result(vector)
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+        return vector
+
+    async def obtener_o_calcular_async(self, texto: str,
+                                       calcular: Callable[[str], Awaitable[Optional[np.ndarray]]]) -> Optional[np.ndarray]:
+        clave = self.clave(texto)
+        vector = self._obtener_memoria(clave)
+        if vector is not None:
+            return vector
+
+        tarea = self._en_vuelo_async.get(clave)
+        if tarea is not None:
+            self.agrupadas += 1
+            # shield: si esta petición se cancela no se cancela la de las demás
+            return await asyncio.shield(tarea)
+
+        async def _calcular():
+            try:
+                resultado = None
+                if self._db is not None:
+                    resultado = await asyncio.to_thread(self._obtener_disco, clave)
+                if resultado is not None:
+                    return resultado
+                self.fallos += 1
+                resultado = await calcular(texto)
+                if resultado is not None:
+                    await asyncio.to_thread(self.guardar, clave, resultado)
+                return resultado
+            finally:
+                self._en_vuelo_async.pop(clave, None)
+
+        tarea = self._en_vuelo_async[clave] = asyncio.ensure_future(_calcular())
+        return await asyncio.shield(tarea)
+
+    def cerrar(self):
+        """
+        Cierra la conexión SQLite; si aún se usa, la caché sigue solo en memoria.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def estadisticas(self) -> dict:
+        entradas_disco = 0
+        with self._lock:
+            if self._db is not None:
+                entradas_disco = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "aciertos_memoria": self.aciertos_memoria,
+            "aciertos_disco": self.aciertos_disco,
+            "fallos": self.fallos,
+            "agrupadas": self.agrupadas,
+            "entradas_memoria": len(self._memoria),
+            "entradas_disco": entradas_disco,
+        }
@@ -0,0 +1,115 @@
+"""
+Caché en memoria de resultados de búsqueda: LRU acotada con caducidad (TTL),
+marcada con la versión del índice. La primera consulta con una versión nueva
+vacía la caché de una vez, así nunca se sirve un resultado de un índice
+anterior; las que aún llegan con una versión ya reemplazada (peticiones en
+curso durante una recarga) son fallos sin más y no vacían nada.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# Entradas máximas y segundos de vida de cada una
+MAX_RESULTADOS = int(os.getenv("UPSCHOLAR_CACHE_RESULTADOS", "2048"))
+TTL_RESULTADOS = float(os.getenv("UPSCHOLAR_CACHE_RESULTADOS_TTL", "900"))
+
+
+class CacheResultados:
+    """
+    - obtener / guardar: acceso con la versión del índice vigente
+    - obtener_o_calcular: caché alrededor de `calcular`
+    Contadores: aciertos, fallos, expulsiones (LRU), caducadas (TTL) e
+    invalidaciones (cambio de versión).
+    """
+
+    def __init__(self, max_entradas: int = MAX_RESULTADOS, ttl: float = TTL_RESULTADOS):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.version = None
+        # Versiones ya reemplazadas: no vuelven a ser la vigente
+        self._retiradas = set()
+
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.caducadas = 0
+        self.invalidaciones = 0
+
+    def _comprobar_version(self, version: Hashable) -> bool:
+        """
+        True si `version` es la vigente (pasando a ella si es nueva); False si
+        es una ya reemplazada.
+        """
+        if version == self.version:
+            return True
+        if version in self._retiradas:
+            return False
+        if self.version is not None:
+            self._retiradas.add(self.version)
+        if self._entradas:
+            self.invalidaciones += 1
+        self._entradas.clear()
+        self.version = version
+        return True
+
+    def obtener(self, clave: Hashable, version: Hashable) -> Optional[Any]:
+        with self._lock:
+            entrada = self._entradas.get(clave) if self._comprobar_version(version) else None
+            if entrada is None:
+                self.fallos += 1
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._entradas[clave]
+                self.caducadas += 1
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave: Hashable, version: Hashable, valor: Any):
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            if not self._comprobar_version(version):
+                # Calculado con un índice que ya no es el vigente
+                return
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+
+    def obtener_o_calcular(self, clave: Hashable, version: Hashable, calcular: Callable[[], Any]) -> Any:
+        valor = self.obtener(clave, version)
+        if valor is None:
+            valor = calcular()
+            self.guardar(clave, version, valor)
+        return valor
+
+    def invalidar(self):
+        with self._lock:
+            if self._entradas:
+                self.invalidaciones += 1
+            self._entradas.clear()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "version_indice": self.version,
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "expulsiones": self.expulsiones,
+                "caducadas": self.caducadas,
+                "invalidaciones": self.invalidaciones
+            }
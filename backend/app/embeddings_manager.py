@@ -1,14 +1,131 @@
 import numpy as np
+import hashlib
+import json
 import os
 import pickle
+import shutil
 import time
-from typing import List, Optional
+from typing import List, Optional, Sequence
 from pathlib import Path
 
+from .grafo_vecinos import GrafoVecinos, tam_bloque_para
+from .indice_ann import BusquedaCompacta, IndiceIVF, COMPACTO_INT8, DIMENSION_COMPACTA, NPROBE
+
+# Documentos añadidos a una versión del almacén (anexos) que se sirven sin
+# reescribirla, como fracción de sus filas; por encima se escribe una nueva
+MAX_FRACCION_ANEXOS = float(os.getenv("UPSCHOLAR_MAX_FRACCION_ANEXOS", "0.25"))
+
+
+def huella_textos(textos: Sequence[str], modelo: str, task_type: str) -> str:
+    """
+    Identifica un trabajo de embeddings: mismo modelo, tipo de tarea y textos (en orden).
+    """
+    h = hashlib.sha256(f"{modelo}\0{task_type}\0{len(textos)}".encode("utf-8"))
+    for texto in textos:
+        h.update(b"\0")
+        h.update(str(texto).encode("utf-8"))
+    return h.hexdigest()
+
+
+class CheckpointEmbeddings:
+    """
+    Progreso de una generación de embeddings por lotes:
+    - vectores.npy: matriz N x D, escrita in situ (memmap)
+    - hechos.npy: máscara de documentos ya embebidos
+    - estado.json: huella del trabajo, dimensión y documentos fallidos
+    Si la huella guardada no coincide (otro corpus u otro modelo) se empieza
+    de cero. Con directorio=None todo queda en memoria.
+    """
+
+    def __init__(self, directorio: Optional[str], huella: str, num_docs: int):
+        self.directorio = Path(directorio) if directorio else None
+        self.huella = huella
+        self.num_docs = num_docs
+        self.vectores = None
+        self.hechos = np.zeros(num_docs, dtype=bool)
+        self.fallidos: List[int] = []
+
+        if self.directorio is None:
+            return
+        try:
+            with open(self.directorio / "estado.json", encoding="utf-8") as f:
+                estado = json.load(f)
+            if estado["huella"] != huella or estado["num_docs"] != num_docs:
+                print("⚠ Checkpoint de embeddings de otro corpus/modelo, se descarta")
+                self.limpiar()
+                return
+            self.hechos = np.load(self.directorio / "hechos.npy")
+            self.vectores = np.load(self.directorio / "vectores.npy", mmap_mode="r+")
+            self.fallidos = estado.get("fallidos", [])
+            print(f"✓ Reanudando embeddings: {int(self.hechos.sum())}/{num_docs} hechos, "
+                  f"{len(self.fallidos)} por reintentar")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠ Checkpoint de embeddings ilegible ({e}), se empieza de cero")
+            self.limpiar()
+
+    def pendientes(self) -> np.ndarray:
+        return np.flatnonzero(~self.hechos)
+
+    def escribir(self, indices: np.ndarray, vectores: np.ndarray):
+        if self.vectores is None:
+            forma = (self.num_docs, vectores.shape[1])
+            if self.directorio is None:
+                self.vectores = np.zeros(forma, dtype=vectores.dtype)
+            else:
+                self.directorio.mkdir(parents=True, exist_ok=True)
+                self.vectores = np.lib.format.open_memmap(
+                    self.directorio / "vectores.npy", mode="w+", dtype=vectores.dtype, shape=forma
+                )
+        self.vectores[indices] = vectores
+        self.hechos[indices] = True
+
+    def guardar(self, fallidos: List[int]):
+        """
+        Persiste el progreso: primero los vectores, luego la máscara y el
+        estado (reemplazo atómico), así un corte nunca marca filas sin escribir.
+        """
+        self.fallidos = sorted(fallidos)
+        if self.directorio is None or self.vectores is None:
+            return
+        self.vectores.flush()
+        tmp = self.directorio / "hechos.tmp.npy"
+        np.save(tmp, self.hechos)
+        os.replace(tmp, self.directorio / "hechos.npy")
+        estado = {
+            "huella": self.huella,
+            "num_docs": self.num_docs,
+            "dimension": int(self.vectores.shape[1]),
+            "fallidos": self.fallidos,
+            "fecha": int(time.time()),
+        }
+        tmp = self.directorio / "estado.tmp.json"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(estado, f)
+        os.replace(tmp, self.directorio / "estado.json")
+
+    def matriz(self) -> Optional[np.ndarray]:
+        """
+        Copia en memoria de los embeddings. Las filas no hechas (entre ellas
+        las de `fallidos`) quedan a cero: quien la use debe excluirlas.
+        """
+        return None if self.vectores is None else np.array(self.vectores)
+
+    def limpiar(self):
+        self.vectores = None
+        if self.directorio is not None:
+            shutil.rmtree(self.directorio, ignore_errors=True)
+
+
 class EmbeddingsManager:
     def __init__(self, cache_dir: str = "data/embeddings"):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # (versión, claves, vectores mmap) de la última versión del almacén leída
+        self._almacen = None
+        # (versión, nombres, claves, vectores) de los últimos anexos leídos
+        self._anexos = None
         
     def guardar_embeddings(self, embeddings: np.ndarray, nombre: str = "embeddings") -> str:
 
@@ -49,7 +166,7 @@ class EmbeddingsManager:
             import time
             start_time = time.time()
             
-            embeddings = np.load(archivo_mas_reciente)
+            embeddings = np.load(archivo_mas_reciente, mmap_mode="r")
             
             elapsed_time = time.time() - start_time
             print(f"  Tiempo de carga del archivo {archivo_mas_reciente.name}: {elapsed_time:.3f} segundos")
@@ -87,6 +204,195 @@ class EmbeddingsManager:
 
 
 
+    # ================= ALMACÉN POR CONTENIDO =================
+    # Una fila por documento (float32, normalizada) con su clave
+    # hash(modelo, texto), en versiones inmutables
+    # almacen_embeddings/v-<ns>/{claves.npy, vectores.npy, manifiesto.json}
+    # con un fichero ACTUAL que apunta a la vigente (como el índice TF-IDF).
+    # vectores.npy se abre con mmap: las páginas las comparten los workers.
+    # Los datos derivados (vecinos, ANN, códigos compactos) se leen y se
+    # escriben en la versión de la que salió la matriz servida, que puede no
+    # ser ya la vigente si otro worker publicó una nueva.
+    # Los documentos ingestados después se añaden a la versión en anexos
+    # (v-<ns>/anexos/<ns>-{claves,vectores}.npy) sin reescribirla; la
+    # siguiente versión completa los incorpora.
+
+    @staticmethod
+    def clave_documento(texto: str, modelo: str) -> str:
+        return hashlib.sha256(f"{modelo}\0{texto or ''}".encode("utf-8")).hexdigest()
+
+    def claves_corpus(self, documentos: Sequence[str], modelo: str) -> List[str]:
+        return [self.clave_documento(texto, modelo) for texto in documentos]
+
+    @property
+    def dir_almacen(self) -> Path:
+        return self.cache_dir / "almacen_embeddings"
+
+    def cargar_almacen(self):
+        """
+        Devuelve (manifiesto, claves, vectores mmap) de la versión vigente o None.
+        Las claves (bytes, S64) y los vectores se leen una vez por versión; el
+        manifiesto, cada vez (se le añaden datos derivados).
+        """
+        try:
+            nombre = (self.dir_almacen / "ACTUAL").read_text(encoding="utf-8").strip()
+            manifiesto = self._leer_manifiesto(nombre)
+            if self._almacen is None or self._almacen[0] != nombre:
+                ruta = self.dir_almacen / nombre
+                self._almacen = (nombre, np.load(ruta / "claves.npy"), np.load(ruta / "vectores.npy", mmap_mode="r"))
+            return manifiesto, self._almacen[1], self._almacen[2]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠ Almacén de embeddings ilegible: {e}")
+            return None
+
+    def _leer_manifiesto(self, version: str) -> dict:
+        with open(self.dir_almacen / version / "manifiesto.json", encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        manifiesto["version"] = version
+        return manifiesto
+
+    def alinear_con_corpus(self, claves: Sequence[str], modelo: str):
+        """
+        Embeddings (normalizados, float32) del almacén en el orden del corpus actual.
+        Si el corpus no cambió desde la última versión se devuelve el propio
+        memmap, sin copias. Si solo se le añadieron documentos al final (como
+        mucho MAX_FRACCION_ANEXOS de sus filas), también: el memmap de ese
+        prefijo, y los añadidos se sirven como en una ingesta. Si no, una
+        matriz nueva con las filas encontradas (en la versión o sus anexos).
+        Devuelve (matriz o None si no hay almacén, índices sin embedding o
+        añadidos al final, versión del almacén si la matriz es exactamente
+        la suya o su prefijo, o None).
+        """
+        almacen = self.cargar_almacen()
+        if almacen is None or almacen[0].get("modelo") != modelo:
+            return None, np.arange(len(claves)), None
+
+        manifiesto, guardadas, vectores = almacen
+        version = manifiesto["version"]
+        normalizado = manifiesto.get("normalizado", False)
+        claves = np.asarray(claves, dtype="S64")
+        num_guardadas = len(guardadas)
+        if normalizado and num_guardadas == len(claves) and np.array_equal(guardadas, claves):
+            return vectores, np.arange(0), version
+        if (normalizado and 0 < num_guardadas < len(claves)
+                and len(claves) - num_guardadas <= MAX_FRACCION_ANEXOS * num_guardadas
+                and np.array_equal(guardadas, claves[:num_guardadas])):
+            return vectores, np.arange(num_guardadas, len(claves)), version
+
+        posicion = {}
+        for i, clave in enumerate(guardadas.tolist()):
+            if clave:
+                posicion.setdefault(clave, i)
+        filas = np.fromiter((posicion.get(c, -1) for c in claves.tolist()), dtype=np.int64, count=len(claves))
+        presentes = filas >= 0
+
+        matriz = np.zeros((len(claves), vectores.shape[1]), dtype=np.float32)
+        matriz[presentes] = vectores[filas[presentes]]
+        if not normalizado:
+            matriz = self.preparar_embeddings(matriz)
+
+        claves_anexos, vectores_anexos = self.cargar_anexos(version)
+        if len(claves_anexos):
+            posicion = {clave: i for i, clave in enumerate(claves_anexos.tolist())}
+            faltan = np.flatnonzero(~presentes)
+            filas = np.fromiter((posicion.get(c, -1) for c in claves[faltan].tolist()),
+                                dtype=np.int64, count=len(faltan))
+            matriz[faltan[filas >= 0]] = vectores_anexos[filas[filas >= 0]]
+            presentes[faltan[filas >= 0]] = True
+        return matriz, np.flatnonzero(~presentes), None
+
+    def cargar_anexos(self, version: str):
+        """
+        (claves S64, vectores normalizados) añadidos a la versión `version`
+        con anexar_almacen, en el orden en que se escribieron. Se vuelven a
+        leer solo si otro worker añadió alguno.
+        """
+        ruta = self.dir_almacen / version / "anexos"
+        nombres = sorted(p.name[:-len("-claves.npy")] for p in ruta.glob("*-claves.npy"))
+        if self._anexos is not None and self._anexos[:2] == (version, nombres):
+            return self._anexos[2], self._anexos[3]
+        claves, vectores = [np.zeros(0, dtype="S64")], []
+        try:
+            for nombre in nombres:
+                claves.append(np.load(ruta / f"{nombre}-claves.npy"))
+                vectores.append(np.load(ruta / f"{nombre}-vectores.npy"))
+        except FileNotFoundError:
+            # Versión recolectada mientras se leía
+            return np.zeros(0, dtype="S64"), None
+        except (OSError, ValueError) as e:
+            print(f"⚠ Anexos del almacén de embeddings ilegibles: {e}")
+            return np.zeros(0, dtype="S64"), None
+        self._anexos = (version, nombres, np.concatenate(claves),
+                        np.concatenate(vectores) if vectores else None)
+        return self._anexos[2], self._anexos[3]
+
+    def anexar_almacen(self, version: str, claves: Sequence[str], vectores: np.ndarray) -> bool:
+        """
+        Añade filas (claves + vectores de preparar_embeddings) a la versión
+        `version` sin reescribirla: los vectores se escriben antes que las
+        claves, que son las que anuncian el anexo. False si la versión ya
+        se recolectó.
+        """
+        ruta = self.dir_almacen / version / "anexos"
+        nombre = f"{time.time_ns()}-{os.getpid()}"
+        try:
+            ruta.mkdir(exist_ok=True)
+            for sufijo, datos in (("vectores", np.ascontiguousarray(vectores, dtype=np.float32)),
+                                  ("claves", np.asarray(claves, dtype="S64"))):
+                tmp = ruta / f"{nombre}-{sufijo}.tmp.npy"
+                np.save(tmp, datos)
+                os.replace(tmp, ruta / f"{nombre}-{sufijo}.npy")
+        except FileNotFoundError:
+            return False
+        return True
+
+    def guardar_almacen(self, claves: Sequence[str], matriz: np.ndarray, validos: np.ndarray, modelo: str):
+        """
+        Escribe una nueva versión con una fila por documento del corpus actual
+        (las no válidas quedan sin clave y se recalculan) y borra las
+        anteriores: los documentos que ya no están en el corpus se recolectan
+        aquí. `matriz` debe venir de preparar_embeddings.
+        Devuelve (matriz recién escrita abierta con mmap, versión).
+        """
+        claves = np.array([c if v else "" for c, v in zip(claves, validos)], dtype="S64")
+
+        nombre = f"v-{time.time_ns()}"
+        ruta = self.dir_almacen / nombre
+        ruta.mkdir(parents=True, exist_ok=True)
+        np.save(ruta / "claves.npy", claves)
+        np.save(ruta / "vectores.npy", np.ascontiguousarray(matriz, dtype=np.float32))
+        with open(ruta / "manifiesto.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "modelo": modelo,
+                "filas": int(len(claves)),
+                "validas": int(np.count_nonzero(validos)),
+                "dimension": int(matriz.shape[1]),
+                "dtype": "float32",
+                "normalizado": True,
+                "fecha_creacion": int(time.time()),
+            }, f)
+
+        tmp = self.dir_almacen / "ACTUAL.tmp"
+        tmp.write_text(nombre, encoding="utf-8")
+        os.replace(tmp, self.dir_almacen / "ACTUAL")
+
+        for anterior in self.dir_almacen.glob("v-*"):
+            if anterior.name != nombre:
+                shutil.rmtree(anterior, ignore_errors=True)
+
+        print(f"✓ Almacén de embeddings: {len(claves)} vectores en {ruta}")
+        vectores = np.load(ruta / "vectores.npy", mmap_mode="r")
+        self._almacen = (nombre, claves, vectores)
+        return vectores, nombre
+
+    def preparar_embeddings(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Forma en la que se guardan y se sirven: filas con norma 1 en float32.
+        """
+        return self.normalizar_embeddings(np.asarray(embeddings, dtype=np.float32))
+
     def normalizar_embeddings(self, embeddings: np.ndarray) -> np.ndarray:
         """
         Normaliza embeddings para similitud coseno
@@ -97,12 +403,122 @@ class EmbeddingsManager:
         normas = np.linalg.norm(embeddings, axis=1, keepdims=True)
         normas[normas == 0] = 1
         return embeddings / normas
-    
-    def calcular_matriz_similitud(self, embeddings_norm: np.ndarray) -> np.ndarray:
+
+    # ================= VECINOS SEMÁNTICOS =================
+    def construir_vecinos(self, embeddings_norm: np.ndarray, k: int) -> GrafoVecinos:
         """
-        Calcula matriz de similitud entre documentos
+        Top-K vecinos por coseno (producto de filas normalizadas), calculado
+        por bloques de filas: la matriz N x N nunca existe completa.
         """
-        if len(embeddings_norm) == 0:
-            return np.array([])
-            
-        return np.dot(embeddings_norm, embeddings_norm.T)
\ No newline at end of file
+        num_docs = len(embeddings_norm)
+        tam_bloque = tam_bloque_para(num_docs)
+        bloques = (
+            (inicio, embeddings_norm[inicio:inicio + tam_bloque] @ embeddings_norm.T)
+            for inicio in range(0, num_docs, tam_bloque)
+        )
+        return GrafoVecinos.desde_bloques(bloques, num_docs, k)
+
+    def cargar_vecinos(self, k: int, version: str) -> Optional[GrafoVecinos]:
+        """
+        Grafo de vecinos de la versión `version` del almacén (mmap), si se
+        construyó con el mismo K.
+        """
+        manifiesto = self._manifiesto_derivados(version)
+        if manifiesto is None or manifiesto.get("k_vecinos") != k:
+            return None
+        ruta = self.dir_almacen / version
+        try:
+            return GrafoVecinos(
+                np.load(ruta / "vecinos_ids.npy", mmap_mode="r"),
+                np.load(ruta / "vecinos_scores.npy", mmap_mode="r")
+            )
+        except (OSError, ValueError) as e:
+            print(f"⚠ Vecinos semánticos ilegibles: {e}")
+            return None
+
+    def guardar_vecinos(self, grafo: GrafoVecinos, version: str):
+        """
+        Añade el grafo a la versión `version` del almacén (sus vectores son
+        los que lo generaron).
+        """
+        def escribir(ruta):
+            for nombre, datos in (("vecinos_ids", grafo.ids), ("vecinos_scores", grafo.scores)):
+                tmp = ruta / f"{nombre}.tmp.npy"
+                np.save(tmp, datos)
+                os.replace(tmp, ruta / f"{nombre}.npy")
+        self._guardar_derivado(version, escribir, k_vecinos=grafo.k)
+
+    # ================= ÍNDICE ANN =================
+    def cargar_ann(self, embeddings: np.ndarray, version: str, nprobe: int = NPROBE) -> Optional[IndiceIVF]:
+        """
+        IVF de la versión `version` del almacén (mmap) sobre `embeddings`, o None.
+        """
+        manifiesto = self._manifiesto_derivados(version)
+        if manifiesto is None or manifiesto.get("ann", {}).get("tipo") != IndiceIVF.tipo:
+            return None
+        try:
+            return IndiceIVF.cargar(self.dir_almacen / version, embeddings, nprobe)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Índice ANN ilegible: {e}")
+            return None
+
+    def guardar_ann(self, indice: IndiceIVF, version: str):
+        self._guardar_derivado(version, indice.guardar, ann={"tipo": indice.tipo, "num_listas": indice.num_listas})
+
+    # ================= CÓDIGOS COMPACTOS =================
+    def cargar_compacto(self, embeddings: np.ndarray, version: str) -> Optional[BusquedaCompacta]:
+        """
+        Códigos compactos (int8 / PCA) de la versión `version`, si coinciden
+        con la configuración pedida (DIMENSION_COMPACTA, COMPACTO_INT8).
+        """
+        manifiesto = self._manifiesto_derivados(version)
+        descripcion = None if manifiesto is None else manifiesto.get("compacto")
+        if not descripcion:
+            return None
+        dimension = DIMENSION_COMPACTA if 0 < DIMENSION_COMPACTA < embeddings.shape[1] else embeddings.shape[1]
+        if descripcion["dimension"] != dimension or descripcion["int8"] != COMPACTO_INT8:
+            return None
+        try:
+            return BusquedaCompacta.cargar(self.dir_almacen / version, embeddings, descripcion)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Códigos compactos ilegibles: {e}")
+            return None
+
+    def guardar_compacto(self, buscador: BusquedaCompacta, version: str):
+        self._guardar_derivado(version, buscador.guardar, compacto=buscador.descripcion())
+
+    def _manifiesto_derivados(self, version: str) -> Optional[dict]:
+        """
+        Manifiesto de la versión, o None si ya se recolectó (otro worker
+        publicó una versión posterior).
+        """
+        try:
+            return self._leer_manifiesto(version)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠ Manifiesto de embeddings ilegible: {e}")
+            return None
+
+    def _guardar_derivado(self, version: str, escribir, **cambios):
+        """
+        Escribe datos derivados (vecinos, ANN) en la versión y los añade a su
+        manifiesto, que se reemplaza después de escribir sus ficheros: un corte
+        a medias nunca anuncia ficheros que no existen. Si la versión ya se
+        recolectó no se guarda nada.
+        """
+        manifiesto = self._manifiesto_derivados(version)
+        if manifiesto is None:
+            return
+        ruta = self.dir_almacen / version
+        try:
+            escribir(ruta)
+            manifiesto = {c: v for c, v in manifiesto.items() if c != "version"}
+            manifiesto.update(cambios)
+            tmp = ruta / "manifiesto.tmp.json"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifiesto, f)
+            os.replace(tmp, ruta / "manifiesto.json")
+        except FileNotFoundError:
+            # Recolectada mientras se escribía
+            pass
@@ -0,0 +1,225 @@
+"""
+Facetas del corpus (año y sesión) para filtrar las búsquedas antes de
+puntuar. Cada faceta guarda, por valor, los ids de documento que lo tienen,
+ordenados (postings CSR: valores, indptr, docs). Un filtro se resuelve en la
+lista ordenada de documentos permitidos (FiltroDocumentos), que el ranking
+TF-IDF y la búsqueda semántica usan para no puntuar el resto.
+"""
+import bisect
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+# Columnas del CSV indexadas como facetas: nombre -> valores enteros (sí/no)
+FACETA_ANIO = "year"
+FACETA_SESION = "session"
+COLUMNAS_FACETAS = {FACETA_ANIO: True, FACETA_SESION: False}
+
+# Con menos de 1/RATIO_BUSQUEDA_BINARIA documentos permitidos que postings,
+# la lista se recorre por búsqueda binaria de los permitidos
+RATIO_BUSQUEDA_BINARIA = 8
+
+
+def normalizar_valor(valor, entera: bool):
+    """
+    Clave de un valor: entero, o texto sin mayúsculas ni espacios repetidos.
+    None si falta o no es válido.
+    """
+    if valor is None:
+        return None
+    if entera:
+        try:
+            return int(float(valor))
+        except (TypeError, ValueError, OverflowError):
+            return None
+    texto = " ".join(str(valor).split()).casefold()
+    return texto or None
+
+
+class Faceta:
+    """
+    Postings de una columna:
+      - valores: distintos y ordenados (int64 o textos normalizados)
+      - indptr:  valores + 1 offsets dentro de `docs`
+      - docs:    ids de documento (int32), ascendentes dentro de cada valor
+    """
+
+    def __init__(self, valores: Sequence, indptr: np.ndarray, docs: np.ndarray, entera: bool):
+        self.valores = valores
+        self.indptr = indptr
+        self.docs = docs
+        self.entera = entera
+
+    @classmethod
+    def vacia(cls, entera: bool) -> "Faceta":
+        return ConstructorFaceta(entera).faceta()
+
+    def docs_valores(self, valores: Iterable) -> np.ndarray:
+        """
+        Documentos (ordenados) con alguno de los valores dados.
+        """
+        partes = []
+        for valor in {normalizar_valor(v, self.entera) for v in valores} - {None}:
+            i = bisect.bisect_left(self.valores, valor)
+            if i < len(self.valores) and self.valores[i] == valor:
+                partes.append(self.docs[self.indptr[i]:self.indptr[i + 1]])
+        return _union(partes)
+
+    def docs_rango(self, desde=None, hasta=None) -> np.ndarray:
+        """
+        Documentos (ordenados) con valor entre desde y hasta, ambos incluidos.
+        """
+        a = 0 if desde is None else int(np.searchsorted(self.valores, desde, side="left"))
+        b = len(self.valores) if hasta is None else int(np.searchsorted(self.valores, hasta, side="right"))
+        if a >= b:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(self.docs[self.indptr[a]:self.indptr[b]]).astype(np.int64)
+
+    def fusionar(self, otra: "Faceta") -> "Faceta":
+        """
+        Una sola faceta con los documentos de las dos (los de `otra`, todos
+        posteriores a los de esta).
+        """
+        constructor = ConstructorFaceta(self.entera)
+        for faceta in (self, otra):
+            valores = [int(v) for v in faceta.valores] if self.entera else list(faceta.valores)
+            grupos = np.repeat(np.arange(len(valores)), np.diff(faceta.indptr))
+            constructor.agregar_postings(valores, grupos, np.asarray(faceta.docs))
+        return constructor.faceta()
+
+
+class ConstructorFaceta:
+    """
+    Construye una Faceta lote a lote, como ConstructorIncidencia: los valores
+    reciben un id por orden de aparición y al final se ordenan.
+    """
+
+    def __init__(self, entera: bool):
+        self.entera = entera
+        self.grupos = {}
+        self._grupos = []
+        self._docs = []
+        # Documentos añadidos con agregar (el siguiente id)
+        self.num_docs = 0
+
+    def agregar(self, columna: Sequence):
+        """
+        Valores de los documentos siguientes, en orden (None si no tienen).
+        """
+        grupos = np.full(len(columna), -1, dtype=np.int64)
+        for n, valor in enumerate(columna):
+            clave = normalizar_valor(valor, self.entera)
+            if clave is not None:
+                grupos[n] = self.grupos.setdefault(clave, len(self.grupos))
+        con_valor = np.flatnonzero(grupos >= 0)
+        self._grupos.append(grupos[con_valor])
+        self._docs.append(con_valor + self.num_docs)
+        self.num_docs += len(columna)
+        return self
+
+    def agregar_postings(self, valores: Sequence, grupos: np.ndarray, docs: np.ndarray):
+        """
+        Postings ya agrupados (valores[grupos[i]] es el del documento docs[i]).
+        """
+        ids = np.array([self.grupos.setdefault(v, len(self.grupos)) for v in valores], dtype=np.int64)
+        self._grupos.append(ids[grupos] if len(ids) else np.zeros(0, dtype=np.int64))
+        self._docs.append(np.asarray(docs, dtype=np.int64))
+        return self
+
+    def faceta(self, inicio: int = 0) -> Faceta:
+        """
+        Faceta con los ids de documento desplazados `inicio` posiciones.
+        """
+        distintos = sorted(self.grupos)
+        rango = np.zeros(len(distintos), dtype=np.int64)
+        rango[[self.grupos[v] for v in distintos]] = np.arange(len(distintos))
+
+        grupos = rango[np.concatenate(self._grupos)] if self._grupos else np.zeros(0, dtype=np.int64)
+        docs = np.concatenate(self._docs) if self._docs else np.zeros(0, dtype=np.int64)
+        orden = np.lexsort((docs, grupos))
+        indptr = np.zeros(len(distintos) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(grupos, minlength=len(distintos)), out=indptr[1:])
+        valores = np.array(distintos, dtype=np.int64) if self.entera else distintos
+        return Faceta(valores, indptr, (docs[orden] + inicio).astype(np.int32), self.entera)
+
+
+class FiltroDocumentos:
+    """
+    Documentos permitidos por un filtro: ids ordenados (int64) de un índice
+    de num_docs documentos. La máscara booleana (bitmap) se crea al pedirla.
+    """
+
+    def __init__(self, ids: np.ndarray, num_docs: int):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.num_docs = num_docs
+        self._mascara = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def mascara(self) -> np.ndarray:
+        if self._mascara is None:
+            mascara = np.zeros(self.num_docs, dtype=bool)
+            mascara[self.ids] = True
+            self._mascara = mascara
+        return self._mascara
+
+    def contiene(self, doc: int) -> bool:
+        i = int(np.searchsorted(self.ids, doc))
+        return i < len(self.ids) and self.ids[i] == doc
+
+    def segmento(self, inicio: int, fin: int) -> "FiltroDocumentos":
+        """
+        Los permitidos en [inicio, fin), numerados desde inicio.
+        """
+        a, b = np.searchsorted(self.ids, [inicio, fin])
+        return FiltroDocumentos(self.ids[a:b] - inicio, max(0, fin - inicio))
+
+    def restringir(self, docs: np.ndarray, pesos: np.ndarray):
+        """
+        Entradas de una lista de postings (docs ascendentes) con documento
+        permitido: por búsqueda binaria si hay pocos permitidos, si no con
+        la máscara.
+        """
+        if len(self.ids) * RATIO_BUSQUEDA_BINARIA < len(docs):
+            pos = np.searchsorted(docs, self.ids)
+            dentro = pos < len(docs)
+            pos = pos[dentro]
+            pos = pos[docs[pos] == self.ids[dentro]]
+        else:
+            pos = np.flatnonzero(self.mascara[docs])
+        return docs[pos], pesos[pos]
+
+
+def filtro_documentos(facetas: Dict[str, Sequence[Faceta]], num_docs: int, anio_desde: int = None,
+                      anio_hasta: int = None, sesiones: Iterable[str] = None) -> Optional[FiltroDocumentos]:
+    """
+    Documentos con año en [anio_desde, anio_hasta] y sesión en `sesiones`
+    (cada criterio, si se da). `facetas`: nombre -> partes con documentos
+    consecutivos (el índice base y los añadidos después).
+    None si no hay ningún criterio.
+    """
+    criterios = []
+    if anio_desde is not None or anio_hasta is not None:
+        criterios.append(_union([f.docs_rango(anio_desde, anio_hasta) for f in facetas.get(FACETA_ANIO, ())]))
+    if sesiones:
+        criterios.append(_union([f.docs_valores(sesiones) for f in facetas.get(FACETA_SESION, ())]))
+    if not criterios:
+        return None
+
+    # Primero el criterio más selectivo: las intersecciones solo encogen
+    criterios.sort(key=len)
+    ids = criterios[0]
+    for otros in criterios[1:]:
+        ids = np.intersect1d(ids, otros, assume_unique=True)
+    return FiltroDocumentos(ids, num_docs)
+
+
+def _union(partes) -> np.ndarray:
+    partes = [p for p in partes if len(p)]
+    if not partes:
+        return np.zeros(0, dtype=np.int64)
+    if len(partes) == 1:
+        return np.asarray(partes[0], dtype=np.int64)
+    return np.unique(np.concatenate(partes).astype(np.int64))
@@ -2,23 +2,149 @@
 Cliente para Google Gemini API
 """
 import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+import asyncio
+import random
+import threading
 import time
 import os
-from typing import List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
 import numpy as np
 
+from .embeddings_manager import CheckpointEmbeddings, huella_textos
+
+# Límite de peticiones a la API (por proceso) y timeout de cada petición
+PETICIONES_POR_SEGUNDO = float(os.getenv("GEMINI_PETICIONES_POR_SEGUNDO", "5"))
+RAFAGA_PETICIONES = int(os.getenv("GEMINI_RAFAGA", "5"))
+TIMEOUT_PETICION = float(os.getenv("GEMINI_TIMEOUT", "10"))
+
+# Embeddings del corpus: textos por llamada (máximo de batchEmbedContents),
+# llamadas concurrentes, reintentos por lote y lotes entre checkpoints
+TAM_LOTE_EMBEDDINGS = 100
+WORKERS_EMBEDDINGS = 4
+MAX_REINTENTOS = 5
+ESPERA_MAXIMA = 30.0
+INTERVALO_CHECKPOINT = 20
+
+
+class LimitadorTasa:
+    """
+    Token bucket: `tasa` peticiones por segundo con ráfagas de hasta `capacidad`.
+    Sustituye a los sleeps fijos; solo espera quien se queda sin tokens.
+    Sirve tanto para el camino síncrono (hilos) como para el asíncrono.
+    """
+
+    def __init__(self, tasa: float, capacidad: int):
+        self.tasa = tasa
+        self.capacidad = max(1, capacidad)
+        self._tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reservar(self) -> float:
+        """
+        Reserva un token y devuelve los segundos que hay que esperar hasta que
+        esté disponible (los tokens negativos son reservas pendientes, en orden).
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            self._tokens -= 1
+            if self._tokens >= 0 or self.tasa <= 0:
+                return 0.0
+            return -self._tokens / self.tasa
+
+    def adquirir(self):
+        espera = self._reservar()
+        if espera > 0:
+            time.sleep(espera)
+
+    async def adquirir_async(self):
+        espera = self._reservar()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class LimitadorAdaptativo(LimitadorTasa):
+    """
+    Token bucket con tasa adaptativa (AIMD): cada 429 la divide entre 2 y
+    vacía la ráfaga; cada éxito la sube `incremento`, hasta la tasa inicial.
+    Con `compartido`, cada petición consume además un token de ese limitador
+    (la cuota de la clave), así nunca se supera su presupuesto aunque otras
+    peticiones lo estén usando a la vez.
+    """
+
+    def __init__(self, tasa: float, capacidad: int, tasa_minima: float = 0.1, incremento: float = 0.05,
+                 compartido: LimitadorTasa = None):
+        super().__init__(tasa, capacidad)
+        self.tasa_maxima = tasa
+        self.tasa_minima = min(tasa_minima, tasa)
+        self.incremento = incremento
+        self.compartido = compartido
+
+    def adquirir(self):
+        super().adquirir()
+        if self.compartido is not None:
+            self.compartido.adquirir()
+
+    async def adquirir_async(self):
+        await super().adquirir_async()
+        if self.compartido is not None:
+            await self.compartido.adquirir_async()
+
+    def penalizar(self):
+        with self._lock:
+            self.tasa = max(self.tasa_minima, self.tasa / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def recompensar(self):
+        with self._lock:
+            self.tasa = min(self.tasa_maxima, self.tasa + self.incremento)
+
+
+def es_limite_tasa(error: Exception) -> bool:
+    """
+    True si la API rechazó la petición por cuota (HTTP 429 / RESOURCE_EXHAUSTED).
+    """
+    return isinstance(error, (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted)) \
+        or getattr(error, "code", None) == 429
+
+
+def es_error_contenido(error: Exception) -> bool:
+    """
+    True si la API rechazó el contenido de la petición (HTTP 400 / 413):
+    repetirla no sirve, pero partir el lote puede aislar el texto culpable.
+    """
+    return isinstance(error, api_exceptions.BadRequest) or getattr(error, "code", None) in (400, 413)
+
+
+# Compartido por todos los clientes: la cuota de la API es por clave, no por instancia
+LIMITADOR_GEMINI = LimitadorTasa(PETICIONES_POR_SEGUNDO, RAFAGA_PETICIONES)
+
+
 class GeminiClient:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, limitador: LimitadorTasa = None,
+                 timeout: float = TIMEOUT_PETICION):
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY no encontrada. Configúrala en .env o pasa como parámetro")
         
-        # Configurar la API de Gemini
-        genai.configure(api_key=self.api_key)
+        # Configurar la API de Gemini. GEMINI_API_ENDPOINT apunta a otro servidor
+        # (p. ej. uno local falso para pruebas) usando el transporte REST
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        if endpoint:
+            genai.configure(api_key=self.api_key, transport="rest", client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=self.api_key)
         
         # Modelos
         self.model_embedding = "models/text-embedding-004"
         self.model_chat = "models/gemini-pro"
+
+        self.limitador = limitador or LIMITADOR_GEMINI
+        self.timeout = timeout
         
     def generar_embedding(self, texto: str, task_type: str = "RETRIEVAL_DOCUMENT") -> Optional[np.ndarray]:
         """
@@ -30,62 +156,162 @@ class GeminiClient:
                 texto = "documento vacio"
             
             # Usar la API actual de Gemini
+            self.limitador.adquirir()
             result = genai.embed_content(
                 model=self.model_embedding,
                 content=texto,
-                task_type=task_type
+                task_type=task_type,
+                request_options={"timeout": self.timeout}
             )
             
-            time.sleep(0.2)  # Rate limiting
             return np.array(result['embedding'])
             
         except Exception as e:
             print(f"Error generando embedding: {e}")
             return None
+
+    async def generar_embedding_async(self, texto: str, task_type: str = "RETRIEVAL_DOCUMENT") -> Optional[np.ndarray]:
+        """
+        Versión asíncrona de generar_embedding: la espera del limitador y de la
+        red no bloquea el event loop, así las consultas concurrentes se solapan.
+        """
+        try:
+            if not texto or len(str(texto).strip()) == 0:
+                texto = "documento vacio"
+
+            await self.limitador.adquirir_async()
+            result = await asyncio.wait_for(
+                genai.embed_content_async(
+                    model=self.model_embedding,
+                    content=texto,
+                    task_type=task_type,
+                    request_options={"timeout": self.timeout}
+                ),
+                timeout=self.timeout
+            )
+
+            return np.array(result['embedding'])
+
+        except asyncio.TimeoutError:
+            print(f"Timeout generando embedding ({self.timeout}s)")
+            return None
+        except Exception as e:
+            print(f"Error generando embedding: {e}")
+            return None
     
-    def generar_embeddings_lote(self, textos: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> Optional[np.ndarray]:
+    def generar_embeddings_lote(self, textos: List[str], task_type: str = "RETRIEVAL_DOCUMENT",
+                                tam_lote: int = TAM_LOTE_EMBEDDINGS, workers: int = WORKERS_EMBEDDINGS,
+                                dir_checkpoint: Optional[str] = None,
+                                intervalo_checkpoint: int = INTERVALO_CHECKPOINT) -> Tuple[Optional[np.ndarray], List[int]]:
         """
-        Genera embeddings para múltiples textos (en lotes)
+        Genera embeddings para múltiples textos:
+        - hasta tam_lote textos por llamada a la API
+        - `workers` llamadas concurrentes detrás de un limitador adaptativo
+          que reduce la tasa con cada 429 y consume del limitador del cliente
+        - un lote que la API rechaza por su contenido (400 / 413) se parte en
+          mitades, con sus reintentos normales, hasta aislar el texto culpable
+        - con dir_checkpoint, el progreso se guarda cada intervalo_checkpoint
+          lotes y una ejecución interrumpida continúa donde se quedó
+        Devuelve (embeddings, fallidos). Los documentos que siguen fallando tras
+        los reintentos van a `fallidos` (y al checkpoint, para reintentarlos en
+        la siguiente ejecución); su fila queda a cero.
         """
-        embeddings = []
-        
+        if not textos:
+            return None, []
+
+        textos = [t if t and len(str(t).strip()) > 0 else "documento vacio" for t in textos]
+        progreso = CheckpointEmbeddings(
+            dir_checkpoint, huella_textos(textos, self.model_embedding, task_type), len(textos)
+        )
+        pendientes = progreso.pendientes()
+        lotes = [pendientes[i:i + tam_lote] for i in range(0, len(pendientes), max(1, tam_lote))]
+        limitador = LimitadorAdaptativo(self.limitador.tasa, self.limitador.capacidad, compartido=self.limitador)
+
         # Medir tiempo total de generación
-        import time
         start_time_total = time.time()
-        
-        for i, texto in enumerate(textos):
+        fallidos = []
+        hechos = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            def enviar(lote):
+                futuros[executor.submit(
+                    self._embeber_lote, [textos[i] for i in lote], task_type, limitador
+                )] = lote
+
+            futuros = {}
+            for lote in lotes:
+                enviar(lote)
+
+            terminados = 0
+            while futuros:
+                listos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    lote = futuros.pop(futuro)
+                    vectores, rechazado = futuro.result()
+                    if vectores is not None:
+                        progreso.escribir(lote, np.array(vectores))
+                        hechos += len(lote)
+                    elif rechazado and len(lote) > 1:
+                        # Un solo texto problemático no debe tumbar el lote entero:
+                        # se parte en mitades hasta aislarlo. Los errores
+                        # transitorios (429, 5xx, timeouts) ya agotaron sus
+                        # reintentos y no se parten
+                        mitad = len(lote) // 2
+                        enviar(lote[:mitad])
+                        enviar(lote[mitad:])
+                        continue
+                    else:
+                        fallidos.extend(int(i) for i in lote)
+
+                    terminados += 1
+                    if terminados % intervalo_checkpoint == 0:
+                        progreso.guardar(fallidos)
+                        print(f"  Embeddings generados: {hechos}/{len(pendientes)} | "
+                              f"fallidos: {len(fallidos)} | tasa: {limitador.tasa:.2f} peticiones/s")
+
+        progreso.guardar(fallidos)
+
+        elapsed_total_time = time.time() - start_time_total
+        print(f"✓ Tiempo total generación de embeddings con LLM: {elapsed_total_time:.2f} segundos")
+        if pendientes.size:
+            print(f"  Promedio por documento: {elapsed_total_time/len(pendientes):.3f} segundos")
+        if fallidos:
+            print(f"⚠ {len(fallidos)} documentos sin embedding (quedan para reintentar)")
+
+        return progreso.matriz(), progreso.fallidos
+
+    def _embeber_lote(self, textos: List[str], task_type: str, limitador: LimitadorAdaptativo,
+                      reintentos: int = MAX_REINTENTOS) -> Tuple[Optional[List[List[float]]], bool]:
+        """
+        Una llamada batch a la API con reintentos y backoff exponencial.
+        Devuelve (embeddings, False) o, si falla, (None, rechazado): rechazado
+        si la API no acepta el contenido (sin más reintentos); si no, el lote
+        siguió fallando tras `reintentos` intentos.
+        """
+        espera = 1.0
+        for intento in range(1, reintentos + 1):
+            limitador.adquirir()
             try:
-                start_doc_time = time.time()
-                
-                if not texto or len(str(texto).strip()) == 0:
-                    texto = "documento vacio"
-                
                 result = genai.embed_content(
                     model=self.model_embedding,
-                    content=texto,
-                    task_type=task_type
+                    content=textos,
+                    task_type=task_type,
+                    request_options={"timeout": self.timeout}
                 )
-                
-                vector = result['embedding']
-                embeddings.append(vector)
-                
-                elapsed_doc_time = time.time() - start_doc_time
-                
-                # Rate limiting y progreso
-                time.sleep(0.3)
-                if i % 10 == 0:
-                    print(f"  Embeddings generados: {i}/{len(textos)} | Último: {elapsed_doc_time:.3f}s")
-                    
+                limitador.recompensar()
+                return result['embedding'], False
             except Exception as e:
-                print(f"Error en documento {i}: {e}")
-                # Vector cero como fallback (dimensión de embeddings de Gemini)
-                embeddings.append(np.zeros(768).tolist())
-        
-        elapsed_total_time = time.time() - start_time_total
-        print(f"✓ Tiempo total generación de embeddings con LLM: {elapsed_total_time:.2f} segundos")
-        print(f"  Promedio por documento: {elapsed_total_time/len(textos):.3f} segundos")
-        
-        return np.array(embeddings) if embeddings else None
+                if es_limite_tasa(e):
+                    limitador.penalizar()
+                elif es_error_contenido(e):
+                    print(f"Lote de {len(textos)} textos rechazado: {e}")
+                    return None, True
+                else:
+                    print(f"Error en lote de {len(textos)} textos (intento {intento}/{reintentos}): {e}")
+                if intento < reintentos:
+                    time.sleep(espera * (1 + random.random()))
+                    espera = min(espera * 2, ESPERA_MAXIMA)
+        return None, False
 
 
     def consultar_chat(self, pregunta: str, contexto: str = "") -> str:
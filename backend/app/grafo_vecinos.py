@@ -0,0 +1,178 @@
+"""
+Grafo de vecinos más cercanos (top-K) entre documentos
+"""
+import numpy as np
+from typing import Iterable, Tuple
+
+# Elementos máximos por bloque de similitud (filas x N) al construir el grafo
+ELEMENTOS_POR_BLOQUE = 2 ** 24
+
+
+def tam_bloque_para(num_docs: int) -> int:
+    """
+    Número de filas por bloque para que un bloque (filas x N) no supere
+    ELEMENTOS_POR_BLOQUE.
+    """
+    return max(1, min(num_docs, ELEMENTOS_POR_BLOQUE // max(num_docs, 1)))
+
+
+def _top_k_filas(bloque: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k por fila ordenado por score descendente y, en empate, por índice
+    ascendente (mismo orden que un sort estable de la fila completa).
+    """
+    filas = np.arange(bloque.shape[0])[:, np.newaxis]
+
+    candidatos = np.argpartition(-bloque, k - 1, axis=1)[:, :k]
+    umbral = bloque[filas, candidatos].min(axis=1)
+
+    # argpartition no garantiza qué índices entran cuando hay empate en el
+    # umbral: esas filas se resuelven aparte con el desempate por índice
+    empates_fila = (bloque == umbral[:, np.newaxis]).sum(axis=1)
+    empates_elegidos = (bloque[filas, candidatos] == umbral[:, np.newaxis]).sum(axis=1)
+    for r in np.flatnonzero(empates_fila > empates_elegidos):
+        fila = bloque[r]
+        mayores = np.flatnonzero(fila > umbral[r])
+        iguales = np.flatnonzero(fila == umbral[r])[:k - len(mayores)]
+        candidatos[r] = np.concatenate([mayores, iguales])
+
+    valores = bloque[filas, candidatos]
+    orden = np.lexsort((candidatos, -valores), axis=1)
+    candidatos = np.take_along_axis(candidatos, orden, axis=1)
+    return candidatos, np.take_along_axis(valores, orden, axis=1)
+
+
+def vecinos_de_bloque(bloque: np.ndarray, inicio: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k de cada fila de un bloque de similitudes (documentos inicio,
+    inicio + 1, ... contra todos), sin el propio documento.
+    """
+    bloque = np.array(bloque, dtype=float)
+    filas = np.arange(bloque.shape[0])
+    bloque[filas, filas + inicio] = -np.inf
+    return _top_k_filas(bloque, k)
+
+
+def filas_con_nuevos(grafo, filas: dict, ultimo_score: np.ndarray, bloque: np.ndarray,
+                     primero: int, inicio: int, k: int):
+    """
+    Parchea el grafo con un bloque de documentos nuevos (primero, primero + 1,
+    ... con similitudes contra todos): añade a `filas` (doc -> (ids, scores),
+    sobre las de `grafo`) las de los nuevos y las de los anteriores a
+    `inicio` en cuyo top-k entra alguno, y pone al día `ultimo_score` (score
+    del k-ésimo vecino de cada documento).
+    """
+    top_ids, top_scores = vecinos_de_bloque(bloque, primero, k)
+    top_ids, top_scores = top_ids.astype(np.int32), top_scores.astype(np.float32)
+    for r in range(bloque.shape[0]):
+        filas[primero + r] = (top_ids[r], top_scores[r])
+        ultimo_score[primero + r] = top_scores[r, -1]
+
+    # Documentos anteriores cuyo k-ésimo vecino supera algún nuevo
+    previos = bloque[:, :inicio]
+    for doc in np.flatnonzero((previos > ultimo_score[np.newaxis, :inicio]).any(axis=0)).tolist():
+        ids, scores = filas.get(doc) or grafo.vecinos(doc)
+        entran = np.flatnonzero(previos[:, doc] > ultimo_score[doc])
+        ids = np.concatenate([ids, (primero + entran).astype(np.int32)])
+        scores = np.concatenate([scores, previos[entran, doc].astype(np.float32)])
+        orden = np.lexsort((ids, -scores))[:k]
+        filas[doc] = (ids[orden], scores[orden])
+        ultimo_score[doc] = scores[orden[-1]]
+
+
+class GrafoVecinos:
+    """
+    Para cada documento guarda sus K vecinos más similares (sin incluirse a
+    sí mismo) en dos arreglos compactos N x K:
+      - ids:    int32, índices de los vecinos ordenados por similitud
+      - scores: float32, similitud combinada de cada vecino
+    """
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.scores = scores
+
+    @property
+    def k(self) -> int:
+        return self.ids.shape[1]
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+    @classmethod
+    def desde_bloques(cls, bloques: Iterable[Tuple[int, np.ndarray]], num_docs: int, k: int) -> "GrafoVecinos":
+        """
+        Construye el grafo consumiendo bloques (inicio, similitudes filas x N)
+        uno a uno, de modo que la matriz N x N nunca existe completa.
+        """
+        k = max(0, min(k, num_docs - 1))
+        ids = np.zeros((num_docs, k), dtype=np.int32)
+        scores = np.zeros((num_docs, k), dtype=np.float32)
+
+        if k == 0:
+            return cls(ids, scores)
+
+        for inicio, bloque in bloques:
+            fin = inicio + bloque.shape[0]
+            top_ids, top_scores = vecinos_de_bloque(bloque, inicio, k)
+            ids[inicio:fin] = top_ids
+            scores[inicio:fin] = top_scores
+
+        return cls(ids, scores)
+
+    def vecinos(self, indice_doc: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vecinos de un documento y sus scores, de mayor a menor similitud.
+        """
+        return self.ids[indice_doc], self.scores[indice_doc]
+
+    def score(self, indice_doc: int, vecino: int) -> float:
+        """
+        Similitud guardada entre un documento y uno de sus vecinos
+        (0.0 si el vecino no está entre sus K más cercanos).
+        """
+        posicion = np.flatnonzero(self.ids[indice_doc] == vecino)
+        return float(self.scores[indice_doc, posicion[0]]) if len(posicion) else 0.0
+
+
+class GrafoVecinosAmpliado:
+    """
+    Grafo base (mmap, solo lectura) más filas reescritas en memoria: las de
+    los documentos añadidos y las de los documentos cuyos vecinos cambiaron.
+    Base, filas y número de documentos se sustituyen juntos (una asignación).
+    """
+
+    def __init__(self, base: GrafoVecinos):
+        self._estado = (base, {}, len(base))
+
+    @property
+    def base(self) -> GrafoVecinos:
+        return self._estado[0]
+
+    @property
+    def filas(self) -> dict:
+        return self._estado[1]
+
+    @property
+    def k(self) -> int:
+        return self._estado[0].k
+
+    def __len__(self) -> int:
+        return self._estado[2]
+
+    def vecinos(self, indice_doc: int) -> Tuple[np.ndarray, np.ndarray]:
+        base, filas, _ = self._estado
+        fila = filas.get(int(indice_doc))
+        return fila if fila is not None else base.vecinos(indice_doc)
+
+    def score(self, indice_doc: int, vecino: int) -> float:
+        ids, scores = self.vecinos(indice_doc)
+        posicion = np.flatnonzero(ids == vecino)
+        return float(scores[posicion[0]]) if len(posicion) else 0.0
+
+    def actualizar(self, filas: dict, num_docs: int):
+        base, actuales, _ = self._estado
+        self._estado = (base, {**actuales, **filas}, num_docs)
+
+    def reiniciar(self, base: GrafoVecinos):
+        self._estado = (base, {}, len(base))
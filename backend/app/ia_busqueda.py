@@ -1,31 +1,102 @@
 """
 Búsqueda semántica usando embeddings de Gemini
 """
+import asyncio
+import copy
 import numpy as np
+import os
+import shutil
+import time
 from typing import List, Dict, Any
 import re
+from pathlib import Path
 
 from .gemini_client import GeminiClient
-from .embeddings_manager import EmbeddingsManager
+from .embeddings_manager import EmbeddingsManager, MAX_FRACCION_ANEXOS
+from .facetas import FiltroDocumentos
+from .cache_embeddings import CacheEmbeddingsConsulta
+from .grafo_vecinos import GrafoVecinos, GrafoVecinosAmpliado, filas_con_nuevos, tam_bloque_para
+from .indice import bloqueo_exclusivo
+from .indice_ann import BusquedaCompacta, BusquedaExacta, FilasAmpliadas, IndiceIVF
+from .lsa import ModeloLSA
 from .procesar_texto import normalizar_y_filtrar
+from .resaltado import Resaltador, obtener_resaltador
+
+# Vecinos semánticos guardados por documento. /buscar-ia pide 3 recomendaciones
+# para cada uno de hasta 20 artículos, excluyendo los 20 del lote y lo ya
+# recomendado a los anteriores: el último excluye hasta 20 + 19 * 3 = 77. Si
+# aun así una fila se agota, se sigue con un recorrido exacto
+K_VECINOS_SEMANTICOS = 128
+
+# Similitud mínima de una recomendación semántica
+UMBRAL_RECOMENDACION = 0.1
+
+# Búsqueda de la consulta: "exacta", "ivf" (aproximada), "compacta" (int8/PCA
+# + re-puntuación exacta) o "auto" (ivf a partir de MIN_DOCS_ANN documentos)
+MODO_BUSQUEDA = os.getenv("UPSCHOLAR_BUSQUEDA_SEMANTICA", "auto")
+MIN_DOCS_ANN = 50_000
+
 
 class IABusqueda:
-    def __init__(self, gemini_api_key: str = None):
-        self.gemini_client = GeminiClient(api_key=gemini_api_key)
-        self.embeddings_manager = EmbeddingsManager()
+    def __init__(self, gemini_api_key: str = None, modelo_local: ModeloLSA = None,
+                 cache_consultas: CacheEmbeddingsConsulta = None):
+        """
+        modelo_local: motor LSA que sustituye a Gemini como proveedor de
+        embeddings (sin red). Gemini solo se usa entonces para el chat, si hay clave.
+        cache_consultas: la de la instancia anterior, que se reutiliza si es
+        del mismo modelo.
+        """
+        self.modelo_local = modelo_local
+        if modelo_local is None:
+            self.gemini_client = GeminiClient(api_key=gemini_api_key)
+            self.proveedor = self.gemini_client
+            self.embeddings_manager = EmbeddingsManager()
+        else:
+            self.gemini_client = GeminiClient(api_key=gemini_api_key) if gemini_api_key else None
+            self.proveedor = modelo_local
+            # Vectores, vecinos e ANN del motor local van junto a su base LSA
+            self.embeddings_manager = EmbeddingsManager(
+                str(modelo_local.directorio or Path("data/embeddings") / "lsa")
+            )
+
+        # Embeddings de consultas ya calculados (memoria + SQLite, sobrevive reinicios)
+        if cache_consultas is not None and cache_consultas.modelo == self.proveedor.model_embedding:
+            self.cache_consultas = cache_consultas
+        else:
+            self.cache_consultas = CacheEmbeddingsConsulta(
+                modelo=self.proveedor.model_embedding,
+                ruta_db=os.getenv("UPSCHOLAR_CACHE_CONSULTAS", "data/embeddings/consultas.sqlite")
+            )
         
         # Cargar o generar embeddings
         self.embeddings_matrix = None
         self.embeddings_norm = None
-        self.sim_docs_matrix = None
+        self.vecinos_semanticos = None
+        self.buscador = None
         self.documentos = []
         self.titulos = []
+        # Versión del almacén de la que sale la matriz (los documentos
+        # añadidos después se anexan a ella) y score del k-ésimo vecino de
+        # cada documento (para parchear el grafo al añadir)
+        self.version_almacen = None
+        self._ultimo_score = None
+        # Documentos sin embedding (fallidos: lista de reintento, ordenada).
+        # Su fila de la matriz está a cero; las búsquedas y recomendaciones
+        # los excluyen y se vuelven a pedir al escribir la siguiente versión
+        # del almacén (arranque o reconstrucción)
+        self.sin_embedding = np.zeros(0, dtype=np.int64)
         
 
     def inicializar(self, documentos: List[str], titulos: List[str]):
         """
-        Inicializa con documentos y genera/calcula embeddings
+        Inicializa con documentos y genera/calcula embeddings. Con varios
+        workers, uno genera y guarda los que faltan y los demás los abren
+        del almacén.
         """
+        with bloqueo_exclusivo(self.embeddings_manager.cache_dir / ".almacen.lock"):
+            self._inicializar(documentos, titulos)
+
+    def _inicializar(self, documentos: List[str], titulos: List[str]):
         try:
             if not documentos or not titulos:
                 print("Error: Documentos o títulos vacíos")
@@ -40,43 +111,85 @@ class IABusqueda:
             import time
             start_time = time.time()
             
-            # Intentar cargar embeddings desde cache
-            self.embeddings_matrix = self.embeddings_manager.cargar_embeddings("gemini_embeddings")
+            # Embeddings ya calculados para estos textos (almacén por contenido,
+            # normalizados en float32 y abiertos con mmap)
+            manager = self.embeddings_manager
+            modelo = self.proveedor.model_embedding
+            claves = manager.claves_corpus(documentos, modelo)
+            # version: la del almacén si la matriz servida es exactamente la
+            # suya (sus vecinos e índices se leen y guardan ahí)
+            matriz, faltantes, version = manager.alinear_con_corpus(claves, modelo)
+            desde_almacen = matriz is not None
+            # La versión tiene solo los primeros documentos: el resto se
+            # añade después, como en una ingesta (ampliada)
+            anexados = version is not None and len(matriz) < len(documentos)
+            if anexados:
+                faltantes = np.arange(0)
+            if not desde_almacen:
+                matriz, faltantes = self._migrar_embeddings_antiguos(len(documentos))
             
             # Calcular tiempo transcurrido
             elapsed_time = time.time() - start_time
             print(f"✓ Tiempo de carga de embeddings: {elapsed_time:.2f} segundos")
             
-            if self.embeddings_matrix is None:
-                print("Generando nuevos embeddings con Gemini...")
+            if len(faltantes) > 0:
+                print(f"Generando embeddings ({modelo}) para {len(faltantes)} documentos nuevos o cambiados...")
                 
                 # Medir tiempo de generación también si es necesario
                 gen_start_time = time.time()
-                self.embeddings_matrix = self.gemini_client.generar_embeddings_lote(documentos)
+                dir_checkpoint = manager.cache_dir / "gemini_embeddings_checkpoint"
+                if self.modelo_local is not None:
+                    # Columnas del índice proyectadas en la base LSA
+                    nuevos, fallidos = self.modelo_local.vectores_documentos(
+                        faltantes, [documentos[i] for i in faltantes]
+                    ), []
+                else:
+                    nuevos, fallidos = self.gemini_client.generar_embeddings_lote(
+                        [documentos[i] for i in faltantes],
+                        dir_checkpoint=str(dir_checkpoint)
+                    )
                 gen_elapsed_time = time.time() - gen_start_time
                 
                 print(f"✓ Tiempo de generación de embeddings: {gen_elapsed_time:.2f} segundos")
                 
-                if self.embeddings_matrix is not None:
-                    print(f"Embeddings generados: {self.embeddings_matrix.shape}")
-                    self.embeddings_manager.guardar_embeddings(
-                        self.embeddings_matrix, 
-                        "gemini_embeddings"
-                    )
-                else:
+                if nuevos is None:
                     print("No se pudieron generar embeddings")
-                    return
+                    if matriz is None:
+                        return
+                    self.sin_embedding = np.asarray(faltantes, dtype=np.int64)
+                else:
+                    if matriz is None:
+                        matriz = np.zeros((len(documentos), nuevos.shape[1]), dtype=np.float32)
+                    matriz[faltantes] = manager.preparar_embeddings(nuevos)
+
+                    # Los fallidos quedan fuera del almacén (fila a cero) y se
+                    # reintentan en el siguiente arranque
+                    validos = np.ones(len(documentos), dtype=bool)
+                    validos[faltantes[fallidos]] = False
+                    self.sin_embedding = np.sort(np.asarray(faltantes[fallidos], dtype=np.int64))
+                    if fallidos:
+                        print(f"⚠ Embeddings incompletos ({len(fallidos)} documentos por reintentar)")
+                    # Se sirve desde el memmap recién escrito, no desde la copia en memoria
+                    matriz, version = manager.guardar_almacen(claves, matriz, validos, modelo)
+                    shutil.rmtree(dir_checkpoint, ignore_errors=True)
+            elif version is None and matriz is not None:
+                # Todas las filas encontradas pero no son una versión (migración,
+                # corpus reordenado o con demasiados anexos): se escribe una
+                validos = np.ones(len(documentos), dtype=bool)
+                matriz, version = manager.guardar_almacen(claves, matriz, validos, modelo)
             
-            # Normalizar y calcular similitudes
-            if self.embeddings_matrix is not None:
-                self.embeddings_norm = self.embeddings_manager.normalizar_embeddings(
-                    self.embeddings_matrix
-                )
-                self.sim_docs_matrix = self.embeddings_manager.calcular_matriz_similitud(
-                    self.embeddings_norm
-                )
+            # La matriz ya está normalizada: embeddings_matrix y embeddings_norm
+            # son el mismo array (sin segunda copia)
+            if matriz is not None:
+                self.embeddings_matrix = matriz
+                self.embeddings_norm = matriz
+                self.version_almacen = version
+                self.vecinos_semanticos = self._cargar_vecinos(version)
+                self.buscador = self._crear_buscador(version)
+                if anexados:
+                    self._ampliar(documentos, titulos)
                 print(f"✓ IA Busqueda inicializada con {len(documentos)} documentos")
-                print(f"  Embeddings shape: {self.embeddings_matrix.shape}")
+                print(f"  Embeddings shape: {self.embeddings_matrix.shape} ({self.embeddings_matrix.dtype})")
             else:
                 print("✗ No se pudieron generar embeddings")
                 
@@ -85,9 +198,194 @@ class IABusqueda:
             import traceback
             traceback.print_exc()
 
-    def buscar(self, query: str, top_k: int = 10, umbral_similitud: float = 0.15) -> List[Dict[str, Any]]:
+    def _cargar_vecinos(self, version: str = None) -> GrafoVecinos:
+        """
+        Tabla top-K de vecinos semánticos: se lee (mmap) de la versión del
+        almacén o se construye por bloques y se guarda junto a sus embeddings.
+        """
+        manager = self.embeddings_manager
+        vecinos = manager.cargar_vecinos(K_VECINOS_SEMANTICOS, version) if version else None
+        if vecinos is not None:
+            return vecinos
+
+        inicio = time.time()
+        vecinos = manager.construir_vecinos(self.embeddings_norm, K_VECINOS_SEMANTICOS)
+        print(f"✓ Vecinos semánticos (K={vecinos.k}) calculados en {time.time() - inicio:.2f} segundos")
+        if version:
+            manager.guardar_vecinos(vecinos, version)
+            vecinos = manager.cargar_vecinos(K_VECINOS_SEMANTICOS, version) or vecinos
+        return vecinos
+
+    def _crear_buscador(self, version: str = None, modo: str = None):
+        """
+        Backend de búsqueda de la consulta sobre embeddings_norm: exacto, IVF o
+        compacto (leído de la versión del almacén o construido y guardado
+        junto a sus embeddings).
+        """
+        modo = modo or MODO_BUSQUEDA
+        if modo == "auto":
+            modo = IndiceIVF.tipo if len(self.embeddings_norm) >= MIN_DOCS_ANN else BusquedaExacta.tipo
+        manager = self.embeddings_manager
+        if modo == BusquedaCompacta.tipo:
+            buscador = manager.cargar_compacto(self.embeddings_norm, version) if version else None
+            if buscador is None:
+                buscador = BusquedaCompacta.construir(self.embeddings_norm)
+                if version:
+                    manager.guardar_compacto(buscador, version)
+            memoria = buscador.memoria()
+            print(f"  Búsqueda semántica: compacta {buscador.descripcion()}, "
+                  f"{memoria['reduccion_vs_float32']:.1f}x menos memoria que float32")
+            return buscador
+        if modo != IndiceIVF.tipo:
+            return BusquedaExacta(self.embeddings_norm)
+
+        indice = manager.cargar_ann(self.embeddings_norm, version) if version else None
+        if indice is None:
+            inicio = time.time()
+            indice = IndiceIVF.construir(self.embeddings_norm)
+            print(f"✓ Índice IVF ({indice.num_listas} listas) construido en {time.time() - inicio:.2f} segundos")
+            if version:
+                manager.guardar_ann(indice, version)
+                indice = manager.cargar_ann(self.embeddings_norm, version) or indice
+        print(f"  Búsqueda semántica: IVF, nprobe={indice.nprobe}")
+        return indice
+
+    def ampliada(self, documentos: List[str], titulos: List[str]) -> "IABusqueda":
         """
-        Realiza búsqueda semántica
+        Copia que sirve además los documentos añadidos al final del corpus
+        (documentos[len(self.documentos):]) sin rehacer nada: sus embeddings
+        (de los anexos del almacén o generados) se anexan a la versión, y
+        entran en el grafo de vecinos y en el buscador existentes. Comparte
+        proveedor y caché de consultas; esta instancia no cambia.
+        """
+        nueva = copy.copy(self)
+        with bloqueo_exclusivo(self.embeddings_manager.cache_dir / ".almacen.lock"):
+            nueva._ampliar(documentos, titulos)
+        return nueva
+
+    def puede_ampliarse(self, num_docs: int) -> bool:
+        """
+        Si un corpus con los documentos actuales y otros al final, num_docs
+        en total, se sirve con ampliada: los que quedan fuera de la matriz
+        base no pasan de MAX_FRACCION_ANEXOS de ella (si no, se rehace).
+        """
+        matriz = self.embeddings_norm
+        num_base = len(matriz.base if isinstance(matriz, FilasAmpliadas) else matriz)
+        return len(matriz) <= num_docs <= num_base * (1 + MAX_FRACCION_ANEXOS)
+
+    def _ampliar(self, documentos: List[str], titulos: List[str]):
+        """
+        Añade a la matriz, al grafo de vecinos y al buscador los documentos
+        posteriores a los que ya tienen fila.
+        """
+        inicio = len(self.embeddings_norm)
+        nuevos = documentos[inicio:]
+        self.documentos = documentos
+        self.titulos = titulos
+        if not nuevos:
+            return
+
+        t0 = time.time()
+        vectores, fallidos = self._vectores_nuevos(inicio, nuevos)
+        if len(fallidos):
+            self.sin_embedding = np.concatenate([self.sin_embedding, inicio + fallidos])
+        self.embeddings_matrix = self.embeddings_norm = FilasAmpliadas.ampliar(self.embeddings_norm, vectores)
+        self.vecinos_semanticos = self._ampliar_vecinos(inicio)
+        self.buscador = self.buscador.ampliado(self.embeddings_norm)
+        print(f"✓ Búsqueda semántica ampliada con {len(nuevos)} documentos en {time.time() - t0:.2f} segundos")
+
+    def _vectores_nuevos(self, inicio: int, nuevos: List[str]):
+        """
+        Embeddings normalizados de los documentos inicio, inicio + 1, ...:
+        los que otro worker ya anexó a la versión del almacén se leen de
+        ahí; el resto se genera y se anexa. Devuelve (vectores, posiciones
+        fallidas): esas filas quedan a cero, van a sin_embedding y se
+        reintentan al escribir la siguiente versión completa.
+        """
+        manager = self.embeddings_manager
+        modelo = self.proveedor.model_embedding
+        claves = np.asarray(manager.claves_corpus(nuevos, modelo), dtype="S64")
+        vectores = np.zeros((len(nuevos), self.embeddings_norm.shape[1]), dtype=np.float32)
+        hechos = np.zeros(len(nuevos), dtype=bool)
+        if self.version_almacen:
+            claves_anexos, vectores_anexos = manager.cargar_anexos(self.version_almacen)
+            posicion = {clave: i for i, clave in enumerate(claves_anexos.tolist())}
+            filas = np.fromiter((posicion.get(c, -1) for c in claves.tolist()), dtype=np.int64, count=len(claves))
+            hechos = filas >= 0
+            if hechos.any():
+                vectores[hechos] = vectores_anexos[filas[hechos]]
+
+        faltantes = np.flatnonzero(~hechos)
+        if len(faltantes) == 0:
+            return vectores, faltantes
+        print(f"Generando embeddings ({modelo}) para {len(faltantes)} documentos nuevos...")
+        textos = [nuevos[i] for i in faltantes]
+        if self.modelo_local is not None:
+            generados, fallidos = self.modelo_local.vectores_documentos(inicio + faltantes, textos), []
+        else:
+            generados, fallidos = self.gemini_client.generar_embeddings_lote(textos)
+        if generados is None:
+            print("⚠ No se pudieron generar embeddings de los documentos nuevos")
+            return vectores, faltantes
+
+        vectores[faltantes] = manager.preparar_embeddings(generados)
+        validos = np.ones(len(faltantes), dtype=bool)
+        validos[fallidos] = False
+        if fallidos:
+            print(f"⚠ Embeddings incompletos ({len(fallidos)} documentos nuevos por reintentar)")
+        if self.version_almacen and validos.any():
+            manager.anexar_almacen(self.version_almacen, claves[faltantes[validos]], vectores[faltantes[validos]])
+        return vectores, faltantes[~validos]
+
+    def _ampliar_vecinos(self, inicio: int) -> GrafoVecinosAmpliado:
+        """
+        Grafo con las filas de los documentos desde `inicio` (contra todos)
+        y las de los anteriores en cuyo top-k entran, como _vecinos_nuevos
+        del índice TF-IDF. Es un objeto nuevo: el de la instancia anterior
+        no cambia.
+        """
+        anterior = self.vecinos_semanticos
+        if isinstance(anterior, GrafoVecinosAmpliado):
+            base, filas = anterior.base, dict(anterior.filas)
+        else:
+            base, filas = anterior, {}
+        k = base.k
+        num_docs = len(self.embeddings_norm)
+        if self._ultimo_score is None:
+            self._ultimo_score = (np.array(base.scores[:, -1], dtype=np.float32)
+                                  if k else np.zeros(len(base), dtype=np.float32))
+        ultimo_score = np.concatenate([self._ultimo_score, np.zeros(num_docs - inicio, dtype=np.float32)])
+
+        if k == 0:
+            vacia = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+            filas.update({doc: vacia for doc in range(inicio, num_docs)})
+        else:
+            tam_bloque = tam_bloque_para(num_docs)
+            for a in range(inicio, num_docs, tam_bloque):
+                b = min(a + tam_bloque, num_docs)
+                bloque = (self.embeddings_norm @ self.embeddings_norm[a:b].T).T
+                filas_con_nuevos(base, filas, ultimo_score, bloque, a, inicio, k)
+
+        grafo = GrafoVecinosAmpliado(base)
+        grafo.actualizar(filas, num_docs)
+        self._ultimo_score = ultimo_score
+        return grafo
+
+    def _migrar_embeddings_antiguos(self, num_docs: int):
+        """
+        Adopta la matriz gemini_embeddings_*.npy anterior al almacén si tiene
+        una fila por documento; sus filas a cero (errores antiguos) se regeneran.
+        """
+        antiguos = self.embeddings_manager.cargar_embeddings("gemini_embeddings")
+        if antiguos is None or len(antiguos) != num_docs:
+            return None, np.arange(num_docs)
+        print("✓ Migrando embeddings antiguos al almacén por contenido")
+        return self.embeddings_manager.preparar_embeddings(antiguos), np.flatnonzero(~np.any(antiguos, axis=1))
+
+    def buscar(self, query: str, top_k: int = 10, umbral_similitud: float = 0.15,
+               filtro: FiltroDocumentos = None) -> List[Dict[str, Any]]:
+        """
+        Realiza búsqueda semántica (solo entre los documentos de `filtro`, si se da)
         """
         if not query.strip():
             return []
@@ -95,154 +393,217 @@ class IABusqueda:
         print(f"Buscando con IA: '{query}'")
         
         try:
-            # Generar embedding para la consulta
-            query_embedding = self.gemini_client.generar_embedding(
-                query, 
-                task_type="RETRIEVAL_QUERY"
+            # Generar embedding para la consulta (o reutilizar el de la caché)
+            query_embedding = self.cache_consultas.obtener_o_calcular(
+                query,
+                lambda texto: self.proveedor.generar_embedding(texto, task_type="RETRIEVAL_QUERY")
             )
-            
-            if query_embedding is None:
-                return []
-            
-            # Normalizar query
-            norma_q = np.linalg.norm(query_embedding)
-            if norma_q > 0:
-                query_embedding = query_embedding / norma_q
-            
-            # Calcular similitudes
-            scores = np.dot(self.embeddings_norm, query_embedding)
-            
-            # Obtener mejores resultados
-            top_indices = np.argsort(scores)[-top_k:][::-1]
-            
-            resultados = []
-            for idx in top_indices:
-                score = float(scores[idx])
-                
-                if score < umbral_similitud:
-                    continue
-                
-                # Generar snippet resaltado
-                snippet = self._generar_snippet_resaltado(
-                    self.documentos[idx], 
-                    query
-                )
-                
-                resultados.append({
-                    "indice": int(idx),
-                    "titulo": self.titulos[idx] if idx < len(self.titulos) else "Sin título",
-                    "similitud": score,
-                    "snippet": snippet,
-                    "abstract": self.documentos[idx][:200] + "..." if len(self.documentos[idx]) > 200 else self.documentos[idx],
-                    "tipo_busqueda": "semantica_ia"
-                })
-            
-            return resultados
+            return self._resultados_consulta(query, query_embedding, top_k, umbral_similitud, filtro)
             
         except Exception as e:
             print(f"Error en búsqueda IA: {e}")
             return []
-    
 
+    async def buscar_async(self, query: str, top_k: int = 10, umbral_similitud: float = 0.15,
+                           filtro: FiltroDocumentos = None) -> List[Dict[str, Any]]:
+        """
+        Búsqueda semántica sin bloquear el event loop (mismos resultados que
+        buscar): en el loop solo se espera el embedding de la consulta; el
+        ranking y los snippets se calculan en un hilo
+        """
+        if not query.strip():
+            return []
 
-    # En ia_busqueda.py, modifica el método obtener_recomendaciones:
+        print(f"Buscando con IA: '{query}'")
 
-    def obtener_recomendaciones(self, indice_doc: int, top_k: int = 3,
-                                excluir: List[int] = None) -> List[Dict[str, Any]]:
+        try:
+            query_embedding = await self.cache_consultas.obtener_o_calcular_async(
+                query,
+                lambda texto: self.proveedor.generar_embedding_async(texto, task_type="RETRIEVAL_QUERY")
+            )
+            return await asyncio.to_thread(
+                self._resultados_consulta, query, query_embedding, top_k, umbral_similitud, filtro
+            )
+
+        except Exception as e:
+            print(f"Error en búsqueda IA: {e}")
+            return []
+
+    def _resultados_consulta(self, query: str, query_embedding, top_k: int,
+                             umbral_similitud: float, filtro: FiltroDocumentos = None) -> List[Dict[str, Any]]:
         """
-        Obtiene documentos similares usando embeddings semánticos
-        CON MEJOR MANEJO DE DUPLICADOS
+        Ranking de documentos para el embedding de la consulta, con snippets
         """
-        if excluir is None:
-            excluir = []
-        
-        if self.sim_docs_matrix is None or indice_doc >= len(self.sim_docs_matrix):
+        if query_embedding is None:
+            return []
+
+        # Documentos permitidos que ya tienen embedding (los recién ingestados
+        # entran al actualizarse la búsqueda semántica; los fallidos, al
+        # reintentarse)
+        permitidos = None
+        if filtro is not None:
+            permitidos = filtro.ids[:np.searchsorted(filtro.ids, len(self.embeddings_norm))]
+        if len(self.sin_embedding):
+            if permitidos is None:
+                permitidos = np.arange(len(self.embeddings_norm))
+            permitidos = np.setdiff1d(permitidos, self.sin_embedding, assume_unique=True)
+        if permitidos is not None and len(permitidos) == 0:
             return []
         
-        # Obtener similitudes para el documento
-        similitudes = self.sim_docs_matrix[indice_doc]
-        
-        # Ordenar por similitud (mayor a menor)
-        indices_ordenados = np.argsort(similitudes)[::-1]
+        # Normalizar query
+        norma_q = np.linalg.norm(query_embedding)
+        if norma_q > 0:
+            query_embedding = query_embedding / norma_q
         
-        recomendaciones = []
-        indices_vistos = set(excluir + [indice_doc])
+        # Mejores resultados según el backend (exacto o IVF), en el dtype de la matriz
+        top_indices, top_scores = self.buscador.buscar(
+            query_embedding.astype(self.embeddings_norm.dtype), top_k, permitidos=permitidos
+        )
         
-        for idx in indices_ordenados:
-            # Saltar si ya está en la lista de excluidos o es el documento mismo
-            if idx in indices_vistos:
+        resultados = []
+        resaltador = obtener_resaltador(normalizar_y_filtrar(query))
+        for idx, score in zip(top_indices.tolist(), top_scores.tolist()):
+            if score < umbral_similitud:
                 continue
-                
-            # Limitar número de recomendaciones
-            if len(recomendaciones) >= top_k:
-                break
             
-            # Añadir a lista de vistos para evitar duplicados futuros
-            indices_vistos.add(idx)
+            # Generar snippet resaltado
+            snippet = self._generar_snippet_resaltado(
+                self.documentos[idx], 
+                query,
+                resaltador=resaltador
+            )
             
-            # Solo incluir si tiene similitud significativa
-            if similitudes[idx] < 0.1:  # Umbral mínimo de similitud
-                continue
-                
-            recomendaciones.append({
+            resultados.append({
                 "indice": int(idx),
                 "titulo": self.titulos[idx] if idx < len(self.titulos) else "Sin título",
-                "similitud": float(similitudes[idx]),
-                "abstract": self.documentos[idx][:150] + "..." if len(self.documentos[idx]) > 150 else self.documentos[idx]
+                "similitud": score,
+                "snippet": snippet,
+                "abstract": self.documentos[idx][:200] + "..." if len(self.documentos[idx]) > 200 else self.documentos[idx],
+                "tipo_busqueda": "semantica_ia"
             })
         
-        return recomendaciones    
-    def _generar_snippet_resaltado(self, texto: str, query: str, max_longitud: int = 300) -> str:
+        return resultados
+    
+
+
+    # En ia_busqueda.py, modifica el método obtener_recomendaciones:
+
+    def obtener_recomendaciones(self, indice_doc: int, top_k: int = 3,
+                                excluir: List[int] = None) -> List[Dict[str, Any]]:
         """
-        Genera snippet con palabras de la query resaltadas
+        Obtiene documentos similares usando embeddings semánticos
+        CON MEJOR MANEJO DE DUPLICADOS
         """
-        if not texto:
-            return "Sin contenido disponible"
-        
-        tokens = normalizar_y_filtrar(query)
-        texto_lower = texto.lower()
-        snippets = []
-        
-        # Buscar ocurrencias de cada token
-        for token in tokens:
-            if len(token) > 2:
-                pattern = re.compile(re.escape(token), re.IGNORECASE)
-                matches = list(pattern.finditer(texto))
-                
-                for match in matches[:2]:  # Máximo 2 por token
-                    start = max(0, match.start() - 50)
-                    end = min(len(texto), match.end() + 50)
-                    
-                    snippet = texto[start:end]
-                    # Resaltar
-                    snippet = pattern.sub(lambda m: f"<b>{m.group(0)}</b>", snippet)
-                    
-                    if start > 0:
-                        snippet = "..." + snippet
-                    if end < len(texto):
-                        snippet = snippet + "..."
-                    
-                    snippets.append(snippet)
-        
-        # Si no hay coincidencias, tomar inicio
-        if not snippets:
-            snippet = texto[:max_longitud]
-            if len(texto) > max_longitud:
-                snippet = snippet + "..."
-            return snippet
-        
-        # Unir snippets únicos
-        snippets_unicos = []
-        for s in snippets:
-            if s not in snippets_unicos and len(s) > 10:
-                snippets_unicos.append(s)
-        
-        resultado = " ... ".join(snippets_unicos[:2])
-        
-        if len(resultado) > max_longitud:
-            resultado = resultado[:max_longitud] + "..."
-        
-        return resultado
+        return self.obtener_recomendaciones_lote([indice_doc], top_k, excluir)[0]
+
+    def obtener_recomendaciones_lote(self, indices_docs: List[int], top_k: int = 3,
+                                     excluir: List[int] = None,
+                                     filtro: FiltroDocumentos = None) -> List[List[Dict[str, Any]]]:
+        """
+        Recomendaciones para varios documentos de una vez, sin duplicados entre
+        ellos: igual que llamar a obtener_recomendaciones para cada uno en orden
+        excluyendo los documentos del lote y lo ya recomendado a los anteriores.
+        Con `filtro`, solo se recomiendan documentos permitidos.
+        """
+        recomendaciones = [[] for _ in indices_docs]
+        if self.vecinos_semanticos is None or top_k <= 0:
+            return recomendaciones
+
+        posiciones = [p for p, indice in enumerate(indices_docs)
+                      if 0 <= indice < len(self.vecinos_semanticos)]
+        if not posiciones:
+            return recomendaciones
+
+        indices_vistos = set(excluir or [])
+        indices_vistos.update(indices_docs)
+        # Los documentos sin embedding (fila a cero) no se recomiendan
+        indices_vistos.update(self.sin_embedding.tolist())
+
+        # Las filas del grafo ya vienen ordenadas por similitud, así que los
+        # vecinos que superan el umbral mínimo son un prefijo de cada fila
+        filas = [indices_docs[p] for p in posiciones]
+        vecinos = [self.vecinos_semanticos.vecinos(indice) for indice in filas]
+        similitudes = np.asarray([scores for _, scores in vecinos])
+        validos = np.count_nonzero(similitudes >= UMBRAL_RECOMENDACION, axis=1).tolist()
+        ids = np.asarray([ids for ids, _ in vecinos]).tolist()
+        similitudes = similitudes.tolist()
+        # Una fila sin ningún vecino bajo el umbral puede tener más candidatos
+        # fuera de las K guardadas
+        k = self.vecinos_semanticos.k
+        incompleta = k < len(self.embeddings_norm) - 1
+
+        # Una pasada en orden: lo recomendado a un documento ya no se repite en los siguientes
+        for fila, posicion in enumerate(posiciones):
+            elegidas = recomendaciones[posicion]
+            self._elegir_recomendaciones(
+                elegidas, zip(ids[fila][:validos[fila]], similitudes[fila][:validos[fila]]),
+                top_k, indices_vistos, filtro
+            )
+            if len(elegidas) < top_k and incompleta and validos[fila] == k:
+                # Fila agotada: el resto, por similitud exacta con todos los
+                # documentos (o solo con los permitidos por el filtro)
+                self._elegir_recomendaciones(
+                    elegidas, zip(*self._vecinos_exactos(filas[fila], filtro)),
+                    top_k, indices_vistos, filtro
+                )
+
+        return recomendaciones
+
+    def _elegir_recomendaciones(self, elegidas: List[Dict[str, Any]], candidatos, top_k: int,
+                                indices_vistos: set, filtro: FiltroDocumentos = None):
+        """
+        Añade a `elegidas` los candidatos (idx, similitud), en orden, hasta
+        tener top_k, saltando los ya vistos y los no permitidos por `filtro`.
+        """
+        for idx, similitud in candidatos:
+            if len(elegidas) >= top_k:
+                break
+            if idx in indices_vistos or (filtro is not None and not filtro.contiene(idx)):
+                continue
+            indices_vistos.add(idx)
+            elegidas.append(self._recomendacion(idx, similitud))
+
+    def _vecinos_exactos(self, indice_doc: int, filtro: FiltroDocumentos = None):
+        """
+        Vecinos de un documento con similitud >= UMBRAL_RECOMENDACION, por
+        producto con todas las filas (o solo las de `filtro`), en el orden de
+        una fila del grafo (similitud descendente, índice ascendente en empate).
+        """
+        num_docs = len(self.embeddings_norm)
+        if filtro is None:
+            candidatos = np.arange(num_docs)
+            similitudes = self.embeddings_norm @ self.embeddings_norm[indice_doc]
+        else:
+            candidatos = filtro.ids[:np.searchsorted(filtro.ids, num_docs)]
+            similitudes = self.embeddings_norm[candidatos] @ self.embeddings_norm[indice_doc]
+        similitudes = np.asarray(similitudes, dtype=np.float32)
+        elegidos = (similitudes >= UMBRAL_RECOMENDACION) & (candidatos != indice_doc)
+        if len(self.sin_embedding):
+            elegidos &= ~np.isin(candidatos, self.sin_embedding)
+        ids, similitudes = candidatos[elegidos], similitudes[elegidos]
+        orden = np.lexsort((ids, -similitudes))
+        return ids[orden].tolist(), similitudes[orden].tolist()
+
+    def _recomendacion(self, idx: int, similitud: float) -> Dict[str, Any]:
+        return {
+            "indice": int(idx),
+            "titulo": self.titulos[idx] if idx < len(self.titulos) else "Sin título",
+            "similitud": float(similitud),
+            "abstract": self.documentos[idx][:150] + "..." if len(self.documentos[idx]) > 150 else self.documentos[idx]
+        }
+
+    def _generar_snippet_resaltado(self, texto: str, query: str, max_longitud: int = 300,
+                                   resaltador: Resaltador = None) -> str:
+        """
+        Genera snippet con palabras de la query resaltadas.
+        resaltador: el de la consulta ya compilado (si no se pasa se obtiene de la query)
+        """
+        if resaltador is None:
+            resaltador = obtener_resaltador(normalizar_y_filtrar(query))
+        return resaltador.snippet(
+            texto, contexto=50, max_por_token=2, max_zonas=2,
+            max_longitud=max_longitud, sin_texto="Sin contenido disponible"
+        )
     
     def buscar_con_respuesta_ia(self, query: str, top_k: int = 5) -> Dict[str, Any]:
         """
@@ -258,10 +619,13 @@ class IABusqueda:
             contexto += f"   Resumen: {res['abstract'][:150]}...\n\n"
         
         # Generar respuesta de la IA
-        respuesta_ia = self.gemini_client.consultar_chat(
-            pregunta=query,
-            contexto=contexto
-        )
+        if self.gemini_client is None:
+            respuesta_ia = "Respuesta con IA no disponible: configura GOOGLE_API_KEY"
+        else:
+            respuesta_ia = self.gemini_client.consultar_chat(
+                pregunta=query,
+                contexto=contexto
+            )
         
         return {
             "query": query,
@@ -0,0 +1,212 @@
+"""
+Construcción del modelo vectorial (TF-IDF + grafo de vecinos) a partir del CSV.
+No tiene efectos al importarse: lo usan modelo_vectores y el CLI build_index.
+"""
+import polars as pl
+import numpy as np
+import scipy.sparse as sp
+import time
+
+from .preprocesamiento import preprocesar_corpus, reportar_etapa, TAM_FRAGMENTO
+from .motor_similitud import ConstructorIncidencia, similitud_jaccard_bloques
+from .grafo_vecinos import GrafoVecinos, tam_bloque_para
+from .indice import IndiceVectorial
+from .facetas import ConstructorFaceta, COLUMNAS_FACETAS
+
+# Combinar con pesos optimizados
+w_title = 0.2      # Títulos: 15%
+w_keywords = 0.3   # Keywords: 35%
+w_abstract = 0.5   # Abstract: 50%
+
+# Vecinos guardados por documento. recomendacion_completa recorre como mucho
+# top_principal * (adicionales_por_item + 1) + adicionales_por_item vecinos
+K_VECINOS = 64
+
+
+# ================= CARGA CSV =================
+def leer_documentos(ruta_csv):
+    """
+    Lee el CSV del corpus y devuelve (titulos, keywords, abstracts) como listas.
+    """
+    df = pl.read_csv(ruta_csv, encoding="latin1")
+    return (
+        [t or "" for t in df["title"].to_list()],
+        [t or "" for t in df["keywords"].to_list()],
+        [t or "" for t in df["abstract"].to_list()],
+    )
+
+def leer_facetas(ruta_csv) -> dict:
+    """
+    Columnas de facetas (año, sesión) del CSV como listas; las que no tenga
+    el CSV no se devuelven.
+    """
+    columnas = pl.read_csv(ruta_csv, encoding="latin1", n_rows=0).columns
+    presentes = [c for c in COLUMNAS_FACETAS if c in columnas]
+    if not presentes:
+        return {}
+    df = pl.read_csv(ruta_csv, encoding="latin1", columns=presentes)
+    return {c: df[c].to_list() for c in presentes}
+
+# ================= TF =================
+def matriz_tf(lista_textos):
+    """
+    Construye la matriz término-documento de frecuencias como CSR dispersa
+    (términos x documentos). Devuelve también el vocabulario ordenado y el
+    índice invertido con posiciones.
+    """
+    inverted_index = {}
+
+    for n_doc, texto in enumerate(lista_textos):
+        for pos, token in enumerate(texto, start=1):
+            inverted_index.setdefault(token, {})
+            inverted_index[token].setdefault(n_doc, [])
+            inverted_index[token][n_doc].append(pos)
+
+    terminos = sorted(inverted_index.keys())
+    num_docs = len(lista_textos)
+
+    # Solo se guardan las celdas no nulas: (término, documento) -> frecuencia
+    indptr = [0]
+    indices = []
+    datos = []
+    for termino in terminos:
+        postings = inverted_index[termino]
+        for doc_id in sorted(postings):
+            indices.append(doc_id)
+            datos.append(len(postings[doc_id]))
+        indptr.append(len(indices))
+
+    matriz = sp.csr_matrix(
+        (np.array(datos, dtype=np.int64), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(terminos), num_docs)
+    )
+    return terminos, matriz, inverted_index
+
+# ================= WTF =================
+def wtf_funcion(m):
+    if sp.issparse(m):
+        w = m.astype(float)
+        w.data = 1 + np.log10(w.data)
+        return w
+    w = np.zeros_like(m, dtype=float)
+    mask = m > 0
+    w[mask] = 1 + np.log10(m[mask])
+    return w
+
+# ================= IDF =================
+def df_funcion(m):
+    return np.asarray((m > 0).sum(axis=1)).ravel()
+
+def idf_funcion(df_vec, num_docs):
+    return np.log10(num_docs / df_vec)
+
+# ================= TF-IDF =================
+def tf_idf_funcion(wtf, idf):
+    if sp.issparse(wtf):
+        return sp.diags(idf) @ wtf
+    return wtf * idf[:, np.newaxis]
+
+# ================= NORMALIZACIÓN =================
+def normalizar_vectores(m):
+    """
+    Normaliza cada columna (documento) a norma L2 unitaria.
+    Con matrices dispersas devuelve CSC y solo toca los valores no nulos.
+    """
+    if sp.issparse(m):
+        m = sp.csc_matrix(m, dtype=float, copy=True)
+        normas = np.sqrt(np.asarray(m.multiply(m).sum(axis=0)).ravel())
+        normas[normas == 0] = 1
+        m.data /= np.repeat(normas, np.diff(m.indptr))
+        return m
+    normas = np.linalg.norm(m, axis=0, keepdims=True)
+    normas[normas == 0] = 1
+    return m / normas
+
+# ================= SIMILITUD COMBINADA (JACCARD + COSENO) =================
+def similitud_combinada_bloques(u, incidencia_titulos, incidencia_keywords, tam_bloque, u_docs=None):
+    """
+    Genera la similitud combinada (Jaccard títulos + Jaccard keywords +
+    coseno abstracts) por bloques de filas, sin materializar la matriz N x N.
+    u_docs es u traspuesta en CSR (documentos x términos); si no se pasa se calcula.
+    """
+    bloques_titulos = similitud_jaccard_bloques(incidencia_titulos, tam_bloque)
+    bloques_keywords = similitud_jaccard_bloques(incidencia_keywords, tam_bloque)
+    if u_docs is None:
+        u_docs = u.T.tocsr()
+
+    for (inicio, jac_titulos), (_, jac_keywords) in zip(bloques_titulos, bloques_keywords):
+        fin = inicio + jac_titulos.shape[0]
+        cos_abstract = (u_docs[inicio:fin] @ u).toarray()
+        yield inicio, (
+            w_title * jac_titulos +
+            w_keywords * jac_keywords +
+            w_abstract * cos_abstract
+        )
+
+# ================= MODELO COMPLETO =================
+def construir_indice(ruta_csv="data/documentos.csv", k_vecinos=K_VECINOS,
+                     workers=1, tam_fragmento=TAM_FRAGMENTO):
+    """
+    Ejecuta todo el pipeline sobre el CSV y devuelve un IndiceVectorial en memoria.
+    workers > 1 reparte la tokenización y el stemming entre procesos.
+    """
+    inicio = time.perf_counter()
+
+    t_lectura = time.perf_counter()
+    d0, d1, d2 = leer_documentos(ruta_csv)
+    columnas_facetas = leer_facetas(ruta_csv)
+    num_docs = len(d0)
+    etapas = [reportar_etapa("Lectura CSV", num_docs, time.perf_counter() - t_lectura)]
+
+    # Normalización + stemming por fragmentos (en paralelo si workers > 1)
+    terminos, matriz, titulos_stem, keywords_stem = preprocesar_corpus(
+        d0, d1, d2, workers=workers, tam_fragmento=tam_fragmento, estadisticas=etapas
+    )
+
+    # TF-IDF
+    t_tfidf = time.perf_counter()
+    wtf = wtf_funcion(matriz)
+    df_vec = df_funcion(matriz)
+    idf = idf_funcion(df_vec, matriz.shape[1])
+    u = normalizar_vectores(tf_idf_funcion(wtf, idf))
+
+    # Incidencias binarias para Jaccard
+    incidencia_titulos = ConstructorIncidencia().agregar(titulos_stem).incidencia()
+    incidencia_keywords = ConstructorIncidencia().agregar(keywords_stem).incidencia()
+    facetas = {
+        nombre: ConstructorFaceta(COLUMNAS_FACETAS[nombre]).agregar(columna).faceta()
+        for nombre, columna in columnas_facetas.items()
+    }
+    etapas.append(reportar_etapa("TF-IDF + incidencias", num_docs, time.perf_counter() - t_tfidf))
+
+    print(">>> Calculando similitud combinada (Jaccard + Coseno)...")
+    sim_inicio = time.perf_counter()
+
+    # Grafo top-K de vecinos (ids int32 + scores float32), construido por bloques
+    print(">>> Construyendo grafo de vecinos (Jaccard + Coseno)...")
+    grafo_vecinos = GrafoVecinos.desde_bloques(
+        similitud_combinada_bloques(u, incidencia_titulos.matriz, incidencia_keywords.matriz, tam_bloque_para(num_docs)),
+        num_docs,
+        k_vecinos
+    )
+
+    sim_fin = time.perf_counter()
+    etapas.append(reportar_etapa("Grafo de vecinos", num_docs, sim_fin - sim_inicio))
+    print(f">>> Documentos procesados: {num_docs}")
+    print(f">>> Pesos: Títulos={w_title}, Keywords={w_keywords}, Abstracts={w_abstract}")
+    print(f">>> Vecinos por documento: {grafo_vecinos.k}")
+
+    fin = time.perf_counter()
+    print(f">>> Modelo construido en {fin - inicio:.4f} segundos.")
+
+    return IndiceVectorial(
+        vocabulario=list(terminos),
+        idf=idf,
+        u=u,
+        titulos=d0,
+        abstracts=d2,
+        grafo_vecinos=grafo_vecinos,
+        incidencia_titulos=incidencia_titulos,
+        incidencia_keywords=incidencia_keywords,
+        facetas=facetas
+    )
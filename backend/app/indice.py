@@ -0,0 +1,478 @@
+"""
+Artefacto en disco del índice vectorial: guardado versionado y carga con mmap
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin cerrojos entre procesos
+    fcntl = None
+
+import numpy as np
+import scipy.sparse as sp
+
+from .facetas import Faceta, COLUMNAS_FACETAS
+from .grafo_vecinos import GrafoVecinos
+from .indice_invertido import IndiceInvertido
+from .motor_similitud import IncidenciaTerminos
+
+# Se incrementa cuando cambia el contenido o el formato de los archivos
+FORMATO_INDICE = 5
+
+MANIFIESTO = "manifest.json"
+PUNTERO_ACTUAL = "ACTUAL"
+
+
+class ListaTextos(Sequence):
+    """
+    Lista de textos de solo lectura sobre un buffer UTF-8 concatenado y sus
+    offsets, ambos .npy mapeados en memoria: cada texto se decodifica al pedirlo.
+    """
+
+    def __init__(self, datos: np.ndarray, offsets: np.ndarray):
+        # Vistas ndarray del mismo mapeo: indexar un np.memmap directamente es
+        # varias veces más lento y aquí se indexa una vez por texto servido
+        self.datos = np.asarray(datos)
+        self.offsets = np.asarray(offsets)
+
+    @classmethod
+    def desde_lista(cls, textos: List[str]) -> "ListaTextos":
+        codificados = [str(t).encode("utf-8") for t in textos]
+        offsets = np.zeros(len(codificados) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in codificados], out=offsets[1:])
+        datos = np.frombuffer(b"".join(codificados), dtype=np.uint8)
+        return cls(datos, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("índice fuera de rango")
+        inicio, fin = self.offsets[i:i + 2].tolist()
+        return self.datos[inicio:fin].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def ampliar(self, textos: List[str]) -> "ListaTextos":
+        """
+        Nueva lista con `textos` al final (concatena los buffers, sin decodificar).
+        """
+        extra = ListaTextos.desde_lista(textos)
+        return ListaTextos(
+            np.concatenate([self.datos, extra.datos]),
+            np.concatenate([self.offsets, extra.offsets[1:] + self.offsets[-1]])
+        )
+
+
+class TextosAmpliados(Sequence):
+    """
+    Textos del índice base más los añadidos después, en memoria. Base y
+    añadidos se sustituyen juntos (una asignación), nunca se modifican.
+    """
+
+    def __init__(self, base: Sequence[str]):
+        self._partes = (base, [])
+
+    def __len__(self) -> int:
+        base, nuevos = self._partes
+        return len(base) + len(nuevos)
+
+    def __getitem__(self, i):
+        base, nuevos = self._partes
+        total = len(base) + len(nuevos)
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(total))]
+        i = int(i)
+        if i < 0:
+            i += total
+        if not 0 <= i < total:
+            raise IndexError("índice fuera de rango")
+        return base[i] if i < len(base) else nuevos[i - len(base)]
+
+    def __iter__(self) -> Iterator[str]:
+        base, nuevos = self._partes
+        yield from base
+        yield from nuevos
+
+    def agregar(self, textos: List[str]):
+        base, nuevos = self._partes
+        self._partes = (base, nuevos + list(textos))
+
+    def reiniciar(self, base: Sequence[str]):
+        self._partes = (base, [])
+
+
+class VocabularioHash(Mapping):
+    """
+    término -> id sin diccionario por proceso: hashes de 64 bits de los
+    términos, ordenados, con el id de cada uno (dos .npy con mmap, compartidos
+    entre workers). Cada búsqueda se verifica contra el término guardado.
+    Los términos ya consultados se recuerdan en una caché acotada.
+    """
+
+    MAX_CACHE = 65536
+
+    def __init__(self, terminos: Sequence[str], hashes: np.ndarray, ids: np.ndarray):
+        self.terminos = terminos
+        self.hashes = np.asarray(hashes)
+        self.ids = np.asarray(ids)
+        self._cache = {}
+
+    @staticmethod
+    def hash_termino(termino: str) -> int:
+        return int.from_bytes(hashlib.blake2b(termino.encode("utf-8"), digest_size=8).digest(), "little")
+
+    @classmethod
+    def tablas(cls, terminos: Sequence[str]):
+        """
+        (hashes ordenados uint64, id de cada uno int32) de un vocabulario.
+        """
+        hashes = np.fromiter((cls.hash_termino(t) for t in terminos), dtype=np.uint64, count=len(terminos))
+        orden = np.argsort(hashes, kind="stable")
+        return hashes[orden], orden.astype(np.int32)
+
+    def get(self, termino, defecto=None):
+        id_termino = self._cache.get(termino)
+        if id_termino is not None:
+            return id_termino
+
+        h = np.uint64(self.hash_termino(termino))
+        i = int(np.searchsorted(self.hashes, h))
+        while i < len(self.hashes) and self.hashes[i] == h:
+            candidato = int(self.ids[i])
+            if self.terminos[candidato] == termino:
+                if len(self._cache) >= self.MAX_CACHE:
+                    self._cache.clear()
+                self._cache[termino] = candidato
+                return candidato
+            i += 1
+        return defecto
+
+    def __getitem__(self, termino):
+        id_termino = self.get(termino)
+        if id_termino is None:
+            raise KeyError(termino)
+        return id_termino
+
+    def __contains__(self, termino) -> bool:
+        return self.get(termino) is not None
+
+    def __len__(self) -> int:
+        return len(self.terminos)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terminos)
+
+
+class IndiceVectorial:
+    """
+    Todo lo que necesita la búsqueda TF-IDF: vocabulario, idf, vectores
+    normalizados de documentos (términos x documentos, CSR: cada fila es la
+    lista de postings de un término), grafo de vecinos y metadatos de los
+    documentos. Las incidencias de títulos y keywords (Jaccard) permiten
+    calcular los vecinos de documentos añadidos después; las facetas (año,
+    sesión) filtran las búsquedas.
+    """
+
+    def __init__(self, vocabulario, idf, u, titulos, abstracts, grafo_vecinos, manifiesto=None, ruta=None, cotas=None,
+                 incidencia_titulos: IncidenciaTerminos = None, incidencia_keywords: IncidenciaTerminos = None,
+                 termino_id=None, facetas: Dict[str, Faceta] = None):
+        self.vocabulario = vocabulario
+        self.termino_id = termino_id if termino_id is not None else {t: i for i, t in enumerate(vocabulario)}
+        self.idf = idf
+        self.u = sp.csr_matrix(u)
+        self.invertido = IndiceInvertido(self.u, cotas)
+        self.titulos = titulos
+        self.abstracts = abstracts
+        self.grafo_vecinos = grafo_vecinos
+        self.incidencia_titulos = incidencia_titulos
+        self.incidencia_keywords = incidencia_keywords
+        # Sin facetas (p. ej. el CSV no tiene esas columnas): ningún documento las cumple
+        self.facetas = {nombre: Faceta.vacia(entera) for nombre, entera in COLUMNAS_FACETAS.items()}
+        self.facetas.update(facetas or {})
+        self.manifiesto = manifiesto or {}
+        self.ruta = ruta
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.titulos)
+
+
+# ================= HUELLAS =================
+def sha256_archivo(ruta) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def huella_csv(ruta_csv) -> dict:
+    estado = os.stat(ruta_csv)
+    return {
+        "ruta": str(ruta_csv),
+        "sha256": sha256_archivo(ruta_csv),
+        "tamano": estado.st_size,
+        "mtime": estado.st_mtime
+    }
+
+
+# ================= CERROJOS =================
+@contextmanager
+def bloqueo_exclusivo(ruta):
+    """
+    Cerrojo entre procesos (flock) sobre el archivo `ruta`: con varios
+    workers, uno construye y publica y los demás esperan y abren lo publicado.
+    """
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    with open(ruta, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# ================= GUARDADO =================
+def _guardar_textos(directorio: Path, nombre: str, textos) -> None:
+    lista = textos if isinstance(textos, ListaTextos) else ListaTextos.desde_lista(textos)
+    np.save(directorio / f"{nombre}_datos.npy", lista.datos)
+    np.save(directorio / f"{nombre}_offsets.npy", lista.offsets)
+
+def _guardar_incidencia(directorio: Path, nombre: str, incidencia: IncidenciaTerminos) -> list:
+    np.save(directorio / f"{nombre}_indices.npy", incidencia.matriz.indices)
+    np.save(directorio / f"{nombre}_indptr.npy", incidencia.matriz.indptr)
+    _guardar_textos(directorio, f"{nombre}_terminos", incidencia.terminos)
+    return list(incidencia.matriz.shape)
+
+def _guardar_faceta(directorio: Path, nombre: str, faceta: Faceta) -> str:
+    np.save(directorio / f"faceta_{nombre}_indptr.npy", faceta.indptr)
+    np.save(directorio / f"faceta_{nombre}_docs.npy", faceta.docs)
+    if faceta.entera:
+        np.save(directorio / f"faceta_{nombre}_valores.npy", np.asarray(faceta.valores, dtype=np.int64))
+        return "entera"
+    _guardar_textos(directorio, f"faceta_{nombre}_valores", faceta.valores)
+    return "texto"
+
+def guardar_indice(indice: IndiceVectorial, directorio_base, ruta_csv, conservar: int = 2, ingestados: int = 0,
+                   huella: Optional[dict] = None) -> Path:
+    """
+    Escribe el índice en un directorio versionado nuevo dentro de directorio_base
+    y mueve el puntero ACTUAL a él de forma atómica. Conserva las últimas
+    `conservar` versiones. `ingestados`: documentos del diario de ingesta ya
+    incluidos en este índice. `huella`: la del CSV del que procede el índice,
+    si no es el contenido actual de ruta_csv (compactación).
+    """
+    directorio_base = Path(directorio_base)
+    directorio_base.mkdir(parents=True, exist_ok=True)
+
+    huella = huella or huella_csv(ruta_csv)
+    # Nanosegundos en el nombre: dos índices guardados en el mismo segundo
+    # (compactaciones seguidas) no pueden compartir directorio
+    ahora = time.time_ns()
+    marca = time.strftime('%Y%m%d-%H%M%S', time.localtime(ahora // 1_000_000_000))
+    version = f"v{FORMATO_INDICE}-{marca}-{ahora % 1_000_000_000:09d}-{huella['sha256'][:8]}"
+    temporal = directorio_base / f".{version}.{os.getpid()}.tmp"
+    if temporal.exists():
+        shutil.rmtree(temporal)
+    temporal.mkdir()
+
+    u = indice.u
+    np.save(temporal / "idf.npy", np.asarray(indice.idf, dtype=float))
+    np.save(temporal / "u_data.npy", u.data)
+    np.save(temporal / "u_indices.npy", u.indices)
+    np.save(temporal / "u_indptr.npy", u.indptr)
+    np.save(temporal / "cotas.npy", indice.invertido.cotas)
+    np.save(temporal / "vecinos_ids.npy", indice.grafo_vecinos.ids)
+    np.save(temporal / "vecinos_scores.npy", indice.grafo_vecinos.scores)
+    _guardar_textos(temporal, "vocabulario", indice.vocabulario)
+    hashes, ids = VocabularioHash.tablas(indice.vocabulario)
+    np.save(temporal / "vocabulario_hashes.npy", hashes)
+    np.save(temporal / "vocabulario_hash_ids.npy", ids)
+    _guardar_textos(temporal, "titulos", indice.titulos)
+    _guardar_textos(temporal, "abstracts", indice.abstracts)
+    incidencias = {
+        nombre: _guardar_incidencia(temporal, nombre, incidencia)
+        for nombre, incidencia in (("jaccard_titulos", indice.incidencia_titulos),
+                                   ("jaccard_keywords", indice.incidencia_keywords))
+        if incidencia is not None
+    }
+    facetas = {nombre: _guardar_faceta(temporal, nombre, faceta) for nombre, faceta in indice.facetas.items()}
+
+    manifiesto = {
+        "formato": FORMATO_INDICE,
+        "version": version,
+        "creado": time.time(),
+        "csv": huella,
+        "num_docs": indice.num_docs,
+        "num_terminos": len(indice.vocabulario),
+        "forma_u": list(u.shape),
+        "k_vecinos": indice.grafo_vecinos.k,
+        "formas_jaccard": incidencias,
+        "facetas": facetas,
+        "ingestados": ingestados,
+        "archivos": {
+            archivo.name: sha256_archivo(archivo)
+            for archivo in sorted(temporal.glob("*.npy"))
+        }
+    }
+    with open(temporal / MANIFIESTO, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2)
+
+    destino = directorio_base / version
+    os.replace(temporal, destino)
+
+    puntero_tmp = directorio_base / f".{PUNTERO_ACTUAL}.tmp"
+    puntero_tmp.write_text(version, encoding="utf-8")
+    os.replace(puntero_tmp, directorio_base / PUNTERO_ACTUAL)
+
+    # Limpiar versiones antiguas
+    versiones = sorted(
+        (d for d in directorio_base.iterdir() if d.is_dir() and d.name.startswith("v")),
+        key=lambda d: d.name
+    )
+    for viejo in versiones[:-conservar]:
+        if viejo != destino:
+            shutil.rmtree(viejo, ignore_errors=True)
+
+    print(f">>> Índice guardado en: {destino}")
+    return destino
+
+
+# ================= CARGA =================
+def leer_manifiesto(ruta) -> dict:
+    with open(Path(ruta) / MANIFIESTO, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def ruta_actual(directorio_base) -> Optional[Path]:
+    """
+    Directorio de la versión a la que apunta ACTUAL, o None si no hay índice.
+    """
+    puntero = Path(directorio_base) / PUNTERO_ACTUAL
+    if not puntero.exists():
+        return None
+    ruta = Path(directorio_base) / puntero.read_text(encoding="utf-8").strip()
+    return ruta if (ruta / MANIFIESTO).exists() else None
+
+def indice_vigente(directorio_base, ruta_csv) -> Optional[Path]:
+    """
+    Devuelve la ruta del índice actual si existe, su formato es el esperado y
+    fue construido a partir del mismo CSV; None si falta o está desactualizado.
+    """
+    ruta = ruta_actual(directorio_base)
+    if ruta is None:
+        return None
+
+    try:
+        manifiesto = leer_manifiesto(ruta)
+    except (OSError, ValueError):
+        return None
+
+    if manifiesto.get("formato") != FORMATO_INDICE:
+        return None
+
+    if not os.path.exists(ruta_csv):
+        # Sin CSV no hay con qué comparar: el artefacto es la única fuente
+        return ruta
+
+    csv_indice = manifiesto.get("csv", {})
+    estado = os.stat(ruta_csv)
+    if csv_indice.get("tamano") != estado.st_size:
+        return None
+    if csv_indice.get("mtime") == estado.st_mtime:
+        return ruta
+    return ruta if csv_indice.get("sha256") == sha256_archivo(ruta_csv) else None
+
+def verificar_indice(ruta) -> List[str]:
+    """
+    Recalcula el checksum de cada archivo del índice. Devuelve los que no coinciden.
+    """
+    manifiesto = leer_manifiesto(ruta)
+    return [
+        nombre for nombre, esperado in manifiesto["archivos"].items()
+        if not (Path(ruta) / nombre).exists() or sha256_archivo(Path(ruta) / nombre) != esperado
+    ]
+
+def _cargar_textos(ruta: Path, nombre: str) -> ListaTextos:
+    return ListaTextos(
+        np.load(ruta / f"{nombre}_datos.npy", mmap_mode="r"),
+        np.load(ruta / f"{nombre}_offsets.npy", mmap_mode="r")
+    )
+
+def _cargar_incidencia(ruta: Path, nombre: str, forma) -> IncidenciaTerminos:
+    indices = np.load(ruta / f"{nombre}_indices.npy", mmap_mode="r")
+    matriz = sp.csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, np.load(ruta / f"{nombre}_indptr.npy", mmap_mode="r")),
+        shape=tuple(forma),
+        copy=False
+    )
+    return IncidenciaTerminos(matriz, _cargar_textos(ruta, f"{nombre}_terminos"))
+
+def _cargar_faceta(ruta: Path, nombre: str, tipo: str) -> Faceta:
+    entera = tipo == "entera"
+    valores = (np.load(ruta / f"faceta_{nombre}_valores.npy", mmap_mode="r") if entera
+               else _cargar_textos(ruta, f"faceta_{nombre}_valores"))
+    return Faceta(
+        valores,
+        np.load(ruta / f"faceta_{nombre}_indptr.npy", mmap_mode="r"),
+        np.load(ruta / f"faceta_{nombre}_docs.npy", mmap_mode="r"),
+        entera
+    )
+
+def cargar_indice(ruta) -> IndiceVectorial:
+    """
+    Abre un índice guardado con mmap: no se copia nada a memoria hasta que se usa.
+    """
+    ruta = Path(ruta)
+    manifiesto = leer_manifiesto(ruta)
+
+    def cargar(nombre):
+        return np.load(ruta / nombre, mmap_mode="r")
+
+    u = sp.csr_matrix(
+        (cargar("u_data.npy"), cargar("u_indices.npy"), cargar("u_indptr.npy")),
+        shape=tuple(manifiesto["forma_u"]),
+        copy=False
+    )
+    grafo_vecinos = GrafoVecinos(cargar("vecinos_ids.npy"), cargar("vecinos_scores.npy"))
+    incidencias = {
+        nombre: _cargar_incidencia(ruta, nombre, forma)
+        for nombre, forma in manifiesto.get("formas_jaccard", {}).items()
+    }
+
+    # Todo con mmap, también el vocabulario: varios workers sobre el mismo
+    # índice comparten las páginas en lugar de tener cada uno su copia
+    vocabulario = _cargar_textos(ruta, "vocabulario")
+    return IndiceVectorial(
+        vocabulario=vocabulario,
+        termino_id=VocabularioHash(vocabulario, cargar("vocabulario_hashes.npy"), cargar("vocabulario_hash_ids.npy")),
+        idf=cargar("idf.npy"),
+        u=u,
+        titulos=_cargar_textos(ruta, "titulos"),
+        abstracts=_cargar_textos(ruta, "abstracts"),
+        grafo_vecinos=grafo_vecinos,
+        manifiesto=manifiesto,
+        ruta=ruta,
+        cotas=cargar("cotas.npy"),
+        incidencia_titulos=incidencias.get("jaccard_titulos"),
+        incidencia_keywords=incidencias.get("jaccard_keywords"),
+        facetas={nombre: _cargar_faceta(ruta, nombre, tipo) for nombre, tipo in manifiesto.get("facetas", {}).items()}
+    )
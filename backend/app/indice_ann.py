@@ -0,0 +1,594 @@
+"""
+Búsqueda de vecinos aproximada (ANN) sobre los embeddings normalizados.
+
+- BusquedaExacta: producto con toda la matriz (el comportamiento de siempre)
+- IndiceIVF: IVF-Flat en NumPy. k-means esférico sobre los embeddings; cada
+  documento cae en la lista de su centroide más similar y una consulta solo
+  puntúa los documentos de las `nprobe` listas más cercanas.
+- BusquedaCompacta: primera pasada sobre códigos compactos (PCA a menos
+  dimensiones y/o int8) y re-puntuación exacta de los mejores candidatos.
+
+Todos exponen buscar(consulta, top_k, permitidos=None) -> (ids, scores), así
+IABusqueda no depende del backend. `permitidos` (ids ordenados) restringe la
+búsqueda a esos documentos: solo se puntúan ellos. ampliado(embeddings)
+devuelve el mismo backend con los documentos añadidos al final de la matriz
+(FilasAmpliadas), sin reconstruirlo. Los informes de recall los comparan
+con la búsqueda exacta:
+
+    python -m app.indice_ann --recall --k 10 --nprobe 1 4 16 64
+    python -m app.indice_ann --compacto --dim 192 --recall --candidatos 2 4 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from .grafo_vecinos import ELEMENTOS_POR_BLOQUE
+
+# Listas probadas por consulta (recall vs latencia)
+NPROBE = int(os.getenv("UPSCHOLAR_NPROBE", "16"))
+# Iteraciones de k-means y puntos de entrenamiento por centroide
+ITERACIONES_KMEANS = 15
+MUESTRA_POR_LISTA = 64
+
+# Códigos compactos: dimensión PCA (0 = sin reducir), int8 sí/no y
+# candidatos re-puntuados por resultado pedido
+DIMENSION_COMPACTA = int(os.getenv("UPSCHOLAR_COMPACTO_DIM", "0"))
+COMPACTO_INT8 = os.getenv("UPSCHOLAR_COMPACTO_INT8", "1") != "0"
+CANDIDATOS_POR_RESULTADO = int(os.getenv("UPSCHOLAR_COMPACTO_CANDIDATOS", "4"))
+CANDIDATOS_MINIMOS = 64
+MUESTRA_PCA = 50_000
+
+
+def _mejores(ids: np.ndarray, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Los top_k de (ids, scores), por score descendente.
+    """
+    k = min(top_k, len(ids))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=scores.dtype)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return np.asarray(ids)[top].astype(np.int64), scores[top]
+
+
+def num_listas_para(num_docs: int) -> int:
+    """
+    Número de listas por defecto: ~4·sqrt(N), al menos 1.
+    """
+    return max(1, min(num_docs, int(4 * np.sqrt(num_docs))))
+
+
+def _mas_similar(vectores: np.ndarray, centroides: np.ndarray) -> np.ndarray:
+    """
+    Índice del centroide con mayor producto interno para cada vector, por
+    bloques de filas para no materializar la matriz N x C completa.
+    """
+    asignacion = np.empty(len(vectores), dtype=np.int32)
+    tam_bloque = max(1, ELEMENTOS_POR_BLOQUE // max(len(centroides), 1))
+    for inicio in range(0, len(vectores), tam_bloque):
+        bloque = np.asarray(vectores[inicio:inicio + tam_bloque], dtype=np.float32)
+        asignacion[inicio:inicio + len(bloque)] = np.argmax(bloque @ centroides.T, axis=1)
+    return asignacion
+
+
+def kmeans_esferico(vectores: np.ndarray, num_listas: int, iteraciones: int = ITERACIONES_KMEANS,
+                    semilla: int = 0) -> np.ndarray:
+    """
+    k-means con similitud coseno: centroides = media de su grupo normalizada.
+    Los grupos vacíos se reinician con un vector al azar.
+    """
+    rng = np.random.default_rng(semilla)
+    vectores = np.asarray(vectores, dtype=np.float32)
+    centroides = vectores[rng.choice(len(vectores), size=num_listas, replace=False)].copy()
+
+    for _ in range(iteraciones):
+        asignacion = _mas_similar(vectores, centroides)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignacion, vectores)
+        normas = np.linalg.norm(sumas, axis=1)
+        vacios = normas == 0
+        centroides[~vacios] = sumas[~vacios] / normas[~vacios, np.newaxis]
+        if vacios.any():
+            centroides[vacios] = vectores[rng.choice(len(vectores), size=int(vacios.sum()), replace=False)]
+    return centroides
+
+
+class FilasAmpliadas:
+    """
+    Matriz base (mmap, solo lectura) más filas añadidas al final en memoria,
+    vistas como una sola para lo que usan las búsquedas: len, shape, filas
+    por índice, rango o lista y producto con un vector. Nunca se modifica:
+    ampliar devuelve otra.
+    """
+
+    def __init__(self, base: np.ndarray, nuevas: np.ndarray):
+        self.base = base
+        self.nuevas = nuevas
+
+    @classmethod
+    def ampliar(cls, matriz, nuevas: np.ndarray) -> "FilasAmpliadas":
+        """
+        `matriz` (ndarray o FilasAmpliadas) con `nuevas` al final; solo se
+        copian las filas añadidas.
+        """
+        if isinstance(matriz, cls):
+            return cls(matriz.base, np.concatenate([matriz.nuevas, np.asarray(nuevas, dtype=matriz.dtype)]))
+        return cls(matriz, np.asarray(nuevas, dtype=matriz.dtype))
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.nuevas)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self), self.base.shape[1]
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.base.nbytes + self.nuevas.nbytes
+
+    def __getitem__(self, filas):
+        num_base = len(self.base)
+        if isinstance(filas, (int, np.integer)):
+            fila = int(filas) + (len(self) if filas < 0 else 0)
+            return self.base[fila] if fila < num_base else self.nuevas[fila - num_base]
+        if isinstance(filas, slice) and filas.step in (None, 1):
+            inicio, fin, _ = filas.indices(len(self))
+            if fin <= num_base:
+                return self.base[inicio:fin]
+            if inicio >= num_base:
+                return self.nuevas[inicio - num_base:fin - num_base]
+            return np.concatenate([self.base[inicio:], self.nuevas[:fin - num_base]])
+        if isinstance(filas, slice):
+            filas = np.arange(*filas.indices(len(self)))
+        filas = np.asarray(filas)
+        if filas.dtype == bool:
+            filas = np.flatnonzero(filas)
+        resultado = np.empty((len(filas), self.shape[1]), dtype=self.dtype)
+        en_base = filas < num_base
+        resultado[en_base] = self.base[filas[en_base]]
+        resultado[~en_base] = self.nuevas[filas[~en_base] - num_base]
+        return resultado
+
+    def __matmul__(self, otro):
+        return np.concatenate([self.base @ otro, self.nuevas @ otro])
+
+    def __array__(self, dtype=None, copy=None):
+        matriz = np.concatenate([self.base, self.nuevas])
+        return matriz if dtype is None else matriz.astype(dtype)
+
+
+class BusquedaExacta:
+    """
+    Puntúa todos los documentos; mismo ranking que np.argsort(scores)[-k:][::-1].
+    """
+
+    tipo = "exacta"
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    def buscar(self, consulta: np.ndarray, top_k: int, permitidos: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        if permitidos is not None:
+            return _mejores(permitidos, self.embeddings[permitidos] @ consulta, top_k)
+        scores = self.embeddings @ consulta
+        top = np.argsort(scores)[-top_k:][::-1]
+        return top, scores[top]
+
+    def ampliado(self, embeddings) -> "BusquedaExacta":
+        return BusquedaExacta(embeddings)
+
+
+class IndiceIVF:
+    """
+    IVF-Flat sobre una matriz de embeddings normalizados (que no se copia):
+      - centroides: C x D float32
+      - orden:      ids de documento agrupados por lista (int32)
+      - inicios:    C + 1 offsets de cada lista dentro de `orden`
+    """
+
+    tipo = "ivf"
+
+    def __init__(self, embeddings: np.ndarray, centroides: np.ndarray, orden: np.ndarray,
+                 inicios: np.ndarray, nprobe: int = NPROBE):
+        self.embeddings = embeddings
+        self.centroides = centroides
+        self.orden = orden
+        self.inicios = inicios
+        self.nprobe = nprobe
+
+    @property
+    def num_listas(self) -> int:
+        return len(self.centroides)
+
+    @classmethod
+    def construir(cls, embeddings: np.ndarray, num_listas: int = None, nprobe: int = NPROBE,
+                  iteraciones: int = ITERACIONES_KMEANS, semilla: int = 0) -> "IndiceIVF":
+        """
+        Entrena los centroides con una muestra (MUESTRA_POR_LISTA puntos por
+        lista) y asigna después todos los documentos.
+        """
+        num_docs = len(embeddings)
+        num_listas = min(num_listas or num_listas_para(num_docs), num_docs)
+        rng = np.random.default_rng(semilla)
+
+        tam_muestra = min(num_docs, num_listas * MUESTRA_POR_LISTA)
+        muestra = np.sort(rng.choice(num_docs, size=tam_muestra, replace=False))
+        centroides = kmeans_esferico(embeddings[muestra], num_listas, iteraciones, semilla)
+
+        asignacion = _mas_similar(embeddings, centroides)
+        orden = np.argsort(asignacion, kind="stable").astype(np.int32)
+        inicios = np.zeros(num_listas + 1, dtype=np.int64)
+        np.cumsum(np.bincount(asignacion, minlength=num_listas), out=inicios[1:])
+        return cls(embeddings, centroides, orden, inicios, nprobe)
+
+    def ampliado(self, embeddings) -> "IndiceIVF":
+        """
+        IVF sobre `embeddings`, que añade filas al final de las indexadas:
+        cada documento nuevo entra en la lista de su centroide más similar,
+        sin reentrenar los centroides. Las listas existentes no se recalculan.
+        """
+        inicio = len(self.orden)
+        asignacion = np.concatenate([
+            np.repeat(np.arange(self.num_listas, dtype=np.int32), np.diff(self.inicios)),
+            _mas_similar(embeddings[inicio:], self.centroides)
+        ])
+        ids = np.concatenate([np.asarray(self.orden), np.arange(inicio, len(embeddings), dtype=np.int32)])
+        # Estable: cada lista conserva su orden y los nuevos van al final
+        orden = ids[np.argsort(asignacion, kind="stable")].astype(np.int32)
+        inicios = np.zeros(self.num_listas + 1, dtype=np.int64)
+        np.cumsum(np.bincount(asignacion, minlength=self.num_listas), out=inicios[1:])
+        return IndiceIVF(embeddings, self.centroides, orden, inicios, self.nprobe)
+
+    def buscar(self, consulta: np.ndarray, top_k: int, nprobe: int = None,
+               permitidos: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Con `permitidos` se prueban más listas (las necesarias para tener
+        tantos candidatos permitidos como sin filtro) y solo se puntúan los
+        candidatos permitidos; si aun así son más candidatos que permitidos,
+        o quedan menos de top_k, se puntúan todos los permitidos (exacto).
+        """
+        nprobe = max(1, min(nprobe or self.nprobe, self.num_listas))
+        if permitidos is not None:
+            if len(permitidos) == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            nprobe = min(self.num_listas, int(np.ceil(nprobe * len(self.embeddings) / len(permitidos))))
+        sim_centroides = self.centroides @ consulta
+        listas = np.argpartition(-sim_centroides, nprobe - 1)[:nprobe]
+
+        candidatos = np.sort(np.concatenate(
+            [self.orden[self.inicios[l]:self.inicios[l + 1]] for l in listas]
+        ))
+        if permitidos is not None:
+            if len(permitidos) <= len(candidatos):
+                return _mejores(permitidos, self.embeddings[permitidos] @ consulta, top_k)
+            candidatos = np.intersect1d(candidatos, permitidos, assume_unique=True)
+            if len(candidatos) < top_k:
+                return _mejores(permitidos, self.embeddings[permitidos] @ consulta, top_k)
+        if candidatos.size == 0:
+            return candidatos.astype(np.int64), np.zeros(0, dtype=np.float32)
+
+        return _mejores(candidatos, self.embeddings[candidatos] @ consulta, top_k)
+
+    # ---------- persistencia ----------
+    def guardar(self, directorio: Path):
+        """
+        Escribe centroides/orden/inicios en el directorio (reemplazo atómico de cada fichero).
+        """
+        directorio = Path(directorio)
+        for nombre, datos in (("ann_centroides", self.centroides), ("ann_orden", self.orden),
+                              ("ann_inicios", self.inicios)):
+            tmp = directorio / f"{nombre}.tmp.npy"
+            np.save(tmp, datos)
+            os.replace(tmp, directorio / f"{nombre}.npy")
+
+    @classmethod
+    def cargar(cls, directorio: Path, embeddings: np.ndarray, nprobe: int = NPROBE) -> "IndiceIVF":
+        directorio = Path(directorio)
+        return cls(
+            embeddings,
+            np.load(directorio / "ann_centroides.npy", mmap_mode="r"),
+            np.load(directorio / "ann_orden.npy", mmap_mode="r"),
+            np.load(directorio / "ann_inicios.npy", mmap_mode="r"),
+            nprobe
+        )
+
+
+class BusquedaCompacta:
+    """
+    Búsqueda en dos pasadas:
+      1. scores aproximados con los códigos compactos (proyección PCA opcional
+         + cuantización int8 por dimensión opcional), por bloques de filas
+      2. los top_k * candidatos mejores se re-puntúan con los embeddings
+         completos (solo se leen esas filas del memmap)
+    """
+
+    tipo = "compacta"
+
+    def __init__(self, embeddings: np.ndarray, codigos: np.ndarray, escala: np.ndarray = None,
+                 proyeccion: np.ndarray = None, candidatos: int = CANDIDATOS_POR_RESULTADO):
+        self.embeddings = embeddings
+        self.codigos = codigos
+        self.escala = escala
+        self.proyeccion = proyeccion
+        self.candidatos = candidatos
+
+    @property
+    def dimension(self) -> int:
+        return self.codigos.shape[1]
+
+    @classmethod
+    def construir(cls, embeddings: np.ndarray, dimension: int = DIMENSION_COMPACTA, int8: bool = COMPACTO_INT8,
+                  candidatos: int = CANDIDATOS_POR_RESULTADO, semilla: int = 0) -> "BusquedaCompacta":
+        """
+        dimension: 0 (o >= D) para no reducir; la proyección son las primeras
+        componentes de la SVD sin centrar de una muestra, que es la que mejor
+        conserva los productos internos.
+        """
+        num_docs, dim_original = embeddings.shape
+        proyeccion = None
+        if 0 < dimension < dim_original:
+            rng = np.random.default_rng(semilla)
+            muestra = np.sort(rng.choice(num_docs, size=min(num_docs, MUESTRA_PCA), replace=False))
+            _, _, vt = np.linalg.svd(np.asarray(embeddings[muestra], dtype=np.float32), full_matrices=False)
+            proyeccion = np.ascontiguousarray(vt[:dimension].T, dtype=np.float32)
+
+        dim = proyeccion.shape[1] if proyeccion is not None else dim_original
+        codigos = np.empty((num_docs, dim), dtype=np.int8 if int8 else np.float32)
+        escala = None
+        if int8:
+            maximos = np.zeros(dim, dtype=np.float32)
+            for inicio, bloque in cls._bloques(embeddings, proyeccion, dim_original):
+                np.maximum(maximos, np.abs(bloque).max(axis=0), out=maximos)
+            escala = np.where(maximos > 0, maximos / 127, 1).astype(np.float32)
+
+        for inicio, bloque in cls._bloques(embeddings, proyeccion, dim_original):
+            if int8:
+                bloque = np.clip(np.rint(bloque / escala), -127, 127)
+            codigos[inicio:inicio + len(bloque)] = bloque
+        return cls(embeddings, codigos, escala, proyeccion, candidatos)
+
+    @staticmethod
+    def _bloques(embeddings, proyeccion, dim):
+        tam_bloque = max(1, ELEMENTOS_POR_BLOQUE // dim)
+        for inicio in range(0, len(embeddings), tam_bloque):
+            bloque = np.asarray(embeddings[inicio:inicio + tam_bloque], dtype=np.float32)
+            yield inicio, (bloque @ proyeccion if proyeccion is not None else bloque)
+
+    def ampliado(self, embeddings) -> "BusquedaCompacta":
+        """
+        Búsqueda sobre `embeddings`, que añade filas al final de las
+        codificadas: los nuevos se codifican con la misma proyección y escala
+        (recortados a ±127) y sus códigos van aparte de los guardados.
+        """
+        nuevos = np.asarray(embeddings[len(self.codigos):], dtype=np.float32)
+        if self.proyeccion is not None:
+            nuevos = nuevos @ self.proyeccion
+        if self.escala is not None:
+            nuevos = np.clip(np.rint(nuevos / self.escala), -127, 127)
+        codigos = FilasAmpliadas.ampliar(self.codigos, nuevos)
+        return BusquedaCompacta(embeddings, codigos, self.escala, self.proyeccion, self.candidatos)
+
+    def scores_aproximados(self, consulta: np.ndarray, filas: np.ndarray = None) -> np.ndarray:
+        """
+        Scores aproximados de todos los documentos o solo de `filas`.
+        """
+        q = consulta @ self.proyeccion if self.proyeccion is not None else consulta
+        if self.escala is not None:
+            q = q * self.escala
+        q = q.astype(np.float32)
+
+        total = len(self.codigos) if filas is None else len(filas)
+        scores = np.empty(total, dtype=np.float32)
+        tam_bloque = max(1, ELEMENTOS_POR_BLOQUE // self.dimension)
+        for inicio in range(0, total, tam_bloque):
+            bloque = (self.codigos[inicio:inicio + tam_bloque] if filas is None
+                      else self.codigos[filas[inicio:inicio + tam_bloque]])
+            scores[inicio:inicio + len(bloque)] = bloque.astype(np.float32) @ q
+        return scores
+
+    def buscar(self, consulta: np.ndarray, top_k: int, candidatos: int = None,
+               permitidos: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        aproximados = self.scores_aproximados(consulta, permitidos)
+        if len(aproximados) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        num = min(len(aproximados), max(top_k * (candidatos or self.candidatos), CANDIDATOS_MINIMOS, top_k))
+        elegidos = np.sort(np.argpartition(-aproximados, num - 1)[:num])
+        if permitidos is not None:
+            elegidos = np.asarray(permitidos)[elegidos]
+
+        return _mejores(elegidos, self.embeddings[elegidos] @ consulta, top_k)
+
+    def memoria(self) -> dict:
+        """
+        Bytes residentes de la primera pasada frente a la matriz completa.
+        """
+        compacto = self.codigos.nbytes
+        compacto += 0 if self.escala is None else self.escala.nbytes
+        compacto += 0 if self.proyeccion is None else self.proyeccion.nbytes
+        num_docs, dim = self.embeddings.shape
+        return {
+            "bytes_compacto": int(compacto),
+            "bytes_float32": int(num_docs * dim * 4),
+            "bytes_float64": int(num_docs * dim * 8),
+            "reduccion_vs_float32": num_docs * dim * 4 / compacto,
+            "reduccion_vs_float64": num_docs * dim * 8 / compacto,
+        }
+
+    # ---------- persistencia ----------
+    def descripcion(self) -> dict:
+        return {"tipo": self.tipo, "dimension": self.dimension, "int8": self.escala is not None}
+
+    def guardar(self, directorio: Path):
+        directorio = Path(directorio)
+        partes = [("compacto_codigos", self.codigos)]
+        if self.escala is not None:
+            partes.append(("compacto_escala", self.escala))
+        if self.proyeccion is not None:
+            partes.append(("compacto_proyeccion", self.proyeccion))
+        for nombre, datos in partes:
+            tmp = directorio / f"{nombre}.tmp.npy"
+            np.save(tmp, datos)
+            os.replace(tmp, directorio / f"{nombre}.npy")
+
+    @classmethod
+    def cargar(cls, directorio: Path, embeddings: np.ndarray, descripcion: dict,
+               candidatos: int = CANDIDATOS_POR_RESULTADO) -> "BusquedaCompacta":
+        directorio = Path(directorio)
+        reducida = descripcion["dimension"] < embeddings.shape[1]
+        return cls(
+            embeddings,
+            np.load(directorio / "compacto_codigos.npy", mmap_mode="r"),
+            np.load(directorio / "compacto_escala.npy") if descripcion["int8"] else None,
+            np.load(directorio / "compacto_proyeccion.npy") if reducida else None,
+            candidatos
+        )
+
+
+def _consultas_prueba(embeddings: np.ndarray, num_consultas: int, ruido: float, semilla: int) -> np.ndarray:
+    """
+    Documentos al azar + ruido gaussiano, renormalizados.
+    """
+    rng = np.random.default_rng(semilla)
+    elegidos = rng.choice(len(embeddings), size=min(num_consultas, len(embeddings)), replace=False)
+    consultas = np.asarray(embeddings[np.sort(elegidos)], dtype=np.float32)
+    consultas = consultas + ruido * rng.standard_normal(consultas.shape).astype(np.float32) / np.sqrt(consultas.shape[1])
+    consultas /= np.linalg.norm(consultas, axis=1, keepdims=True)
+    return consultas
+
+
+def _verdad_exacta(embeddings: np.ndarray, consultas: np.ndarray, k: int):
+    exacta = BusquedaExacta(embeddings)
+    t0 = time.perf_counter()
+    verdad = [set(exacta.buscar(q, k)[0].tolist()) for q in consultas]
+    return verdad, 1000 * (time.perf_counter() - t0) / len(consultas)
+
+
+def _medir(buscar, consultas: np.ndarray, verdad, k: int) -> Tuple[float, float]:
+    """
+    (recall@k, ms por consulta) de buscar(q) -> ids frente a la verdad exacta.
+    """
+    t0 = time.perf_counter()
+    aciertos = 0
+    for q, esperados in zip(consultas, verdad):
+        aciertos += len(esperados.intersection(buscar(q).tolist()))
+    return aciertos / (k * len(consultas)), 1000 * (time.perf_counter() - t0) / len(consultas)
+
+
+def reporte_recall(embeddings: np.ndarray, indice: IndiceIVF, k: int = 10,
+                   nprobes: Iterable[int] = (1, 4, 16, 64), num_consultas: int = 200,
+                   ruido: float = 0.05, semilla: int = 0) -> List[dict]:
+    """
+    recall@k del IVF frente a la búsqueda exacta para varios nprobe, con
+    consultas = documentos al azar + ruido gaussiano (renormalizados).
+    """
+    consultas = _consultas_prueba(embeddings, num_consultas, ruido, semilla)
+    verdad, ms_exacta = _verdad_exacta(embeddings, consultas, k)
+
+    filas = []
+    for nprobe in nprobes:
+        recall, ms = _medir(lambda q: indice.buscar(q, k, nprobe)[0], consultas, verdad, k)
+        filas.append({
+            "nprobe": min(nprobe, indice.num_listas),
+            "recall": recall,
+            "ms_por_consulta": ms,
+            "ms_exacta": ms_exacta,
+        })
+    return filas
+
+
+def reporte_recall_compacto(embeddings: np.ndarray, buscador: BusquedaCompacta, k: int = 10,
+                            candidatos: Iterable[int] = (1, 2, 4, 8), num_consultas: int = 200,
+                            ruido: float = 0.05, semilla: int = 0) -> List[dict]:
+    """
+    recall@k de la búsqueda compacta (con re-puntuación) para varios números
+    de candidatos por resultado, más la memoria que ocupa la primera pasada.
+    """
+    consultas = _consultas_prueba(embeddings, num_consultas, ruido, semilla)
+    verdad, ms_exacta = _verdad_exacta(embeddings, consultas, k)
+
+    filas = []
+    for factor in candidatos:
+        recall, ms = _medir(lambda q: buscador.buscar(q, k, factor)[0], consultas, verdad, k)
+        filas.append({
+            "candidatos": factor,
+            "recall": recall,
+            "ms_por_consulta": ms,
+            "ms_exacta": ms_exacta,
+            **buscador.memoria(),
+        })
+    return filas
+
+
+def main(argv=None):
+    from .embeddings_manager import EmbeddingsManager
+
+    parser = argparse.ArgumentParser(description="Índices de búsqueda semántica (IVF / compacto) de UPSCHOLAR")
+    parser.add_argument("--embeddings", default="data/embeddings", help="Directorio de embeddings")
+    parser.add_argument("--listas", type=int, default=None, help="Número de listas (por defecto ~4·sqrt(N))")
+    parser.add_argument("--compacto", action="store_true", help="Códigos compactos en lugar de IVF")
+    parser.add_argument("--dim", type=int, default=DIMENSION_COMPACTA, help="Dimensión PCA (0 = sin reducir)")
+    parser.add_argument("--sin-int8", action="store_true", help="Códigos float32 en lugar de int8")
+    parser.add_argument("--recall", action="store_true", help="Medir recall@k frente a la búsqueda exacta")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--candidatos", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Candidatos re-puntuados por resultado (--compacto)")
+    parser.add_argument("--consultas", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    manager = EmbeddingsManager(args.embeddings)
+    almacen = manager.cargar_almacen()
+    if almacen is None:
+        print(f"No hay almacén de embeddings en {args.embeddings}")
+        return 1
+    manifiesto, _, embeddings = almacen
+    version = manifiesto["version"]
+
+    if args.compacto:
+        inicio = time.perf_counter()
+        buscador = BusquedaCompacta.construir(embeddings, dimension=args.dim, int8=not args.sin_int8)
+        manager.guardar_compacto(buscador, version)
+        print(f"✓ Códigos compactos {buscador.descripcion()} construidos en {time.perf_counter() - inicio:.2f} segundos")
+        if args.recall:
+            filas = reporte_recall_compacto(embeddings, buscador, k=args.k, candidatos=args.candidatos,
+                                            num_consultas=args.consultas)
+            memoria = buscador.memoria()
+            print(f"recall@{args.k} ({len(embeddings)} docs, {buscador.descripcion()})")
+            print(f"  memoria primera pasada: {memoria['bytes_compacto'] / 2**20:.1f} MiB "
+                  f"({memoria['reduccion_vs_float32']:.1f}x menos que float32, "
+                  f"{memoria['reduccion_vs_float64']:.1f}x menos que float64)")
+            for fila in filas:
+                print(f"  candidatos={fila['candidatos']:>3}x  recall={fila['recall']:.3f}  "
+                      f"{fila['ms_por_consulta']:.2f} ms/consulta (exacta {fila['ms_exacta']:.2f} ms)")
+            print(json.dumps(filas))
+        return 0
+
+    indice = manager.cargar_ann(embeddings, version) if args.listas is None else None
+    if indice is None:
+        inicio = time.perf_counter()
+        indice = IndiceIVF.construir(embeddings, num_listas=args.listas)
+        manager.guardar_ann(indice, version)
+        print(f"✓ IVF con {indice.num_listas} listas construido en {time.perf_counter() - inicio:.2f} segundos")
+
+    if args.recall:
+        filas = reporte_recall(embeddings, indice, k=args.k, nprobes=args.nprobe, num_consultas=args.consultas)
+        print(f"recall@{args.k} ({len(embeddings)} docs, {indice.num_listas} listas)")
+        for fila in filas:
+            print(f"  nprobe={fila['nprobe']:>5}  recall={fila['recall']:.3f}  "
+                  f"{fila['ms_por_consulta']:.2f} ms/consulta (exacta {fila['ms_exacta']:.2f} ms)")
+        print(json.dumps(filas))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
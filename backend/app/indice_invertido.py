@@ -0,0 +1,178 @@
+"""
+Motor de consultas sobre índice invertido con poda dinámica (MaxScore)
+"""
+import numpy as np
+import scipy.sparse as sp
+from typing import List, Tuple
+
+# Margen para no podar por diferencias de redondeo entre el orden de suma
+# de la poda y el del score exacto
+EPSILON_PODA = 1e-9
+
+# Consultas por bloque en la búsqueda por lotes (acota la matriz de scores)
+CONSULTAS_POR_BLOQUE = 256
+
+
+def cotas_terminos(postings: sp.csr_matrix) -> np.ndarray:
+    """
+    Peso máximo de cada término en su lista de postings (cota superior de su
+    aporte al score de cualquier documento).
+    """
+    cotas = np.zeros(postings.shape[0], dtype=float)
+    no_vacias = np.diff(postings.indptr) > 0
+    if postings.nnz:
+        cotas[no_vacias] = np.maximum.reduceat(postings.data, postings.indptr[:-1][no_vacias])
+    return cotas
+
+
+class IndiceInvertido:
+    """
+    Postings compactos término -> (ids de documento, peso tf-idf normalizado),
+    guardados como las filas de una matriz CSR términos x documentos, más la
+    cota superior de cada término para la poda MaxScore.
+    """
+
+    def __init__(self, postings: sp.csr_matrix, cotas: np.ndarray = None):
+        self.postings = postings
+        self.cotas = cotas_terminos(postings) if cotas is None else cotas
+        self.num_docs = postings.shape[1]
+
+    def lista(self, termino_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Documentos (ordenados) y pesos de la lista de postings de un término.
+        """
+        a, b = self.postings.indptr[termino_id], self.postings.indptr[termino_id + 1]
+        return self.postings.indices[a:b], self.postings.data[a:b]
+
+    def buscar(self, terminos: np.ndarray, pesos: np.ndarray, top_k: int = 10,
+               filtro=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k documentos para una consulta dada como ids de término
+        (ascendentes) y sus pesos tf-idf normalizados. Con `filtro`
+        (FiltroDocumentos) solo se puntúan los documentos permitidos: cada
+        lista de postings se recorta antes de acumular.
+
+        Los términos se recorren de mayor a menor aporte máximo. En cuanto la
+        suma de cotas de los términos restantes no alcanza el k-ésimo mejor
+        score, ya no se admiten documentos nuevos y se descartan los
+        candidatos que no pueden entrar en el top-k (MaxScore). Los
+        supervivientes se puntúan de nuevo sumando en orden de término, igual
+        que el producto disperso, así que los scores son idénticos.
+        Empates: por índice de documento descendente, como argsort(...)[::-1].
+        """
+        top_k = min(top_k, self.num_docs if filtro is None else len(filtro))
+        if top_k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=float)
+
+        candidatos = np.array([], dtype=np.int64)
+        parciales = np.array([], dtype=float)
+
+        if len(terminos):
+            cotas = pesos * self.cotas[terminos]
+            orden = np.argsort(-cotas, kind="stable")
+            restante = np.append(np.cumsum(cotas[orden][::-1])[::-1], 0.0)
+            admitir = True
+
+            for paso, i in enumerate(orden):
+                docs, w = self.lista(terminos[i])
+                if filtro is not None:
+                    docs, w = filtro.restringir(docs, w)
+                aporte = pesos[i] * w
+
+                if admitir:
+                    todos, inverso = np.unique(np.concatenate([candidatos, docs]), return_inverse=True)
+                    parciales = np.bincount(inverso, weights=np.concatenate([parciales, aporte]), minlength=len(todos))
+                    candidatos = todos
+                elif len(candidatos) and len(docs):
+                    pos = np.minimum(np.searchsorted(docs, candidatos), len(docs) - 1)
+                    presentes = docs[pos] == candidatos
+                    parciales[presentes] += aporte[pos[presentes]]
+
+                if len(candidatos) >= top_k:
+                    umbral = np.partition(parciales, -top_k)[-top_k]
+                    if admitir and restante[paso + 1] < umbral - EPSILON_PODA:
+                        admitir = False
+                    if not admitir:
+                        vivos = parciales + restante[paso + 1] >= umbral - EPSILON_PODA
+                        candidatos, parciales = candidatos[vivos], parciales[vivos]
+
+        # Score exacto de los supervivientes, sumando en orden de término
+        scores = np.zeros(len(candidatos), dtype=float)
+        for i, t in enumerate(terminos):
+            docs, w = self.lista(t)
+            if not len(docs) or not len(candidatos):
+                continue
+            pos = np.minimum(np.searchsorted(docs, candidatos), len(docs) - 1)
+            presentes = docs[pos] == candidatos
+            scores[presentes] += pesos[i] * w[pos[presentes]]
+
+        orden = np.lexsort((-candidatos, -scores))[:top_k]
+        top_indices, top_scores = candidatos[orden], scores[orden]
+
+        # Si hay menos coincidencias que top_k se completa con documentos
+        # (permitidos) de score 0, de mayor a menor índice. Este relleno y el
+        # desempate por índice descendente son deterministas a propósito: el
+        # ranking denso anterior (np.argsort(-scores), inestable) los dejaba
+        # en el orden de quicksort, así que ahí difieren de él
+        if len(top_indices) < top_k:
+            relleno = self._relleno(candidatos, top_k - len(top_indices), filtro)
+            top_indices = np.concatenate([top_indices, relleno])
+            top_scores = np.concatenate([top_scores, np.zeros(len(relleno))])
+
+        return top_indices, top_scores
+
+    def _relleno(self, excluidos: np.ndarray, faltan: int, filtro=None) -> np.ndarray:
+        """
+        Los `faltan` documentos de mayor índice que no están en `excluidos`.
+        """
+        if filtro is None:
+            universo = np.arange(max(0, self.num_docs - faltan - len(excluidos)), self.num_docs)
+        else:
+            universo = filtro.ids[-(faltan + len(excluidos)):]
+        return np.setdiff1d(universo, excluidos)[::-1][:faltan]
+
+    def buscar_lote(self, consultas: sp.csr_matrix, top_k: int = 10) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top-k de muchas consultas a la vez. `consultas` es la matriz dispersa
+        consultas x términos (filas como las de pesos_consulta): un producto
+        disperso por bloque de consultas y top-k por fila con argpartition
+        sobre los documentos con score. Mismo resultado que buscar() para
+        cada fila (scores, empates y relleno con score 0), ya que el índice no
+        guarda pesos nulos y el producto solo deja documentos con score > 0.
+        """
+        top_k = min(top_k, self.num_docs)
+        resultados = []
+        for inicio in range(0, consultas.shape[0], CONSULTAS_POR_BLOQUE):
+            scores = sp.csr_matrix(consultas[inicio:inicio + CONSULTAS_POR_BLOQUE] @ self.postings)
+            for fila in range(scores.shape[0]):
+                a, b = scores.indptr[fila], scores.indptr[fila + 1]
+                resultados.append(self._top_k_disperso(scores.indices[a:b], scores.data[a:b], top_k))
+        return resultados
+
+    def _top_k_disperso(self, docs: np.ndarray, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k de una fila dispersa de scores (docs con score > 0), ordenado
+        como buscar(): score descendente y, a igual score, índice descendente.
+        """
+        if top_k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=float)
+
+        docs = docs.astype(np.int64)
+        if len(docs) > top_k:
+            umbral = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+            mayores = np.flatnonzero(scores > umbral)
+            empatados = np.flatnonzero(scores == umbral)
+            # Los empatados en el umbral entran por índice de documento descendente
+            empatados = empatados[np.argsort(-docs[empatados], kind="stable")][:top_k - len(mayores)]
+            seleccion = np.concatenate([mayores, empatados])
+            docs, scores = docs[seleccion], scores[seleccion]
+
+        orden = np.lexsort((-docs, -scores))
+        top_indices, top_scores = docs[orden], scores[orden]
+
+        if len(top_indices) < top_k:
+            relleno = self._relleno(docs, top_k - len(top_indices))
+            top_indices = np.concatenate([top_indices, relleno])
+            top_scores = np.concatenate([top_scores, np.zeros(len(relleno))])
+
+        return top_indices, top_scores
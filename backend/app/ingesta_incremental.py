@@ -0,0 +1,773 @@
+"""
+Ingesta incremental: documentos añadidos al índice servido sin reconstruirlo.
+Los nuevos forman un segmento en memoria (postings, df/idf y las filas del
+grafo de vecinos que cambian) que se busca junto al índice base. Una
+compactación en segundo plano los funde con la base, re-ponderada con el idf
+actual, cuando la deriva del idf supera un umbral.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from itertools import chain
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from .grafo_vecinos import GrafoVecinos, GrafoVecinosAmpliado, filas_con_nuevos, tam_bloque_para
+from .indexador import (
+    w_title, w_keywords, w_abstract, wtf_funcion, idf_funcion, tf_idf_funcion, normalizar_vectores,
+    similitud_combinada_bloques
+)
+from .indice import (
+    IndiceVectorial, ListaTextos, TextosAmpliados, bloqueo_exclusivo, guardar_indice, cargar_indice, ruta_actual
+)
+from .indice_invertido import IndiceInvertido
+from .facetas import ConstructorFaceta, FiltroDocumentos, filtro_documentos
+from .motor_similitud import IncidenciaTerminos, pesos_consulta, similitud_jaccard_entre
+from .preprocesamiento import procesar_fragmento
+
+# Deriva relativa del idf (norma L2) a partir de la cual se compacta, y
+# segundos entre comprobaciones
+UMBRAL_DERIVA_IDF = float(os.getenv("UPSCHOLAR_DERIVA_IDF", "0.01"))
+INTERVALO_COMPACTACION = float(os.getenv("UPSCHOLAR_INTERVALO_COMPACTACION", "60"))
+
+# Diario de los documentos ingestados, junto al índice: un lote (lista JSON)
+# por línea, para reaplicarlos con los mismos lotes. Con varios procesos, el
+# orden del diario fija los índices de documento: se escribe con cerrojo
+DIARIO_INGESTADOS = "documentos_ingestados.jsonl"
+BLOQUEO_DIARIO = ".diario.lock"
+
+
+class VocabularioAmpliado(Mapping):
+    """
+    término -> id: el vocabulario del índice base y, a continuación, los
+    términos que solo aparecen en documentos añadidos.
+    """
+
+    def __init__(self, base: dict, nuevos: dict):
+        self.base = base
+        self.nuevos = nuevos
+
+    def get(self, termino, defecto=None):
+        i = self.base.get(termino)
+        return self.nuevos.get(termino, defecto) if i is None else i
+
+    def __getitem__(self, termino):
+        i = self.get(termino)
+        if i is None:
+            raise KeyError(termino)
+        return i
+
+    def __contains__(self, termino) -> bool:
+        return termino in self.base or termino in self.nuevos
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.nuevos)
+
+    def __iter__(self):
+        return chain(self.base, self.nuevos)
+
+
+class _Vista:
+    """
+    Estado que leen las búsquedas. Se sustituye entero en cada ingesta o
+    compactación, así una consulta nunca mezcla dos estados.
+    """
+
+    def __init__(self, base: IndiceVectorial, termino_id, idf, invertido_delta, num_docs: int, version: str,
+                 facetas_nuevas: dict = None, jaccard: tuple = None):
+        self.base = base
+        self.termino_id = termino_id
+        self.idf = idf
+        self.invertido_delta = invertido_delta
+        self.num_docs = num_docs
+        self.version = version
+        # Facetas por partes: la del índice base y la de los documentos añadidos
+        self.facetas = {
+            nombre: (faceta,) + ((facetas_nuevas[nombre],) if facetas_nuevas else ())
+            for nombre, faceta in base.facetas.items()
+        }
+        # Incidencias (títulos, keywords) ampliadas; sus filas y columnas
+        # añadidas solo crecen, así que las num_docs - num_base primeras filas
+        # y las columnas_jaccard primeras columnas son las de esta vista (la
+        # vista se crea con el lock de ingesta: ninguna ingesta a medias)
+        self.jaccard = jaccard
+        self.columnas_jaccard = None if jaccard is None else tuple(j.num_columnas for j in jaccard)
+
+    @property
+    def num_base(self) -> int:
+        return self.base.num_docs
+
+    @property
+    def terminos_base(self) -> int:
+        return self.base.u.shape[0]
+
+
+class _IncidenciaAmpliada:
+    """
+    Incidencia Jaccard del índice base más las filas de los documentos
+    añadidos (los tokens nuevos toman columnas a continuación).
+    """
+
+    def __init__(self, base: IncidenciaTerminos):
+        self.base = base
+        self.columnas_nuevas = {}
+        self.filas = []
+
+    def filas_de(self, lista_tokens) -> List[np.ndarray]:
+        columna, nuevas = self.base.columna, self.columnas_nuevas
+        total = self.base.matriz.shape[1]
+        filas = []
+        for tokens in lista_tokens:
+            fila = set()
+            for t in tokens:
+                c = columna.get(t)
+                if c is None:
+                    c = nuevas.setdefault(t, total + len(nuevas))
+                fila.add(c)
+            filas.append(np.array(sorted(fila), dtype=np.int32))
+        return filas
+
+    @property
+    def num_columnas(self) -> int:
+        return self.base.matriz.shape[1] + len(self.columnas_nuevas)
+
+    def _matriz(self, filas: List[np.ndarray], columnas: int) -> sp.csr_matrix:
+        indptr = np.zeros(len(filas) + 1, dtype=np.int64)
+        np.cumsum([len(f) for f in filas], out=indptr[1:])
+        indices = np.concatenate(filas + [np.array([], dtype=np.int32)])
+        return sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(filas), columnas)
+        )
+
+    def similitud(self, filas: List[np.ndarray], todas: List[np.ndarray], columnas: int = None) -> np.ndarray:
+        """
+        Jaccard de `filas` contra todos los documentos: base y luego `todas`
+        (las filas añadidas, incluidas las de `filas`). `columnas`: las de
+        la vista que se lee (por defecto, las actuales); una ingesta en
+        curso puede estar añadiendo más.
+        """
+        columnas = columnas or self.num_columnas
+        a = self._matriz(filas, columnas)
+        # La base con las columnas nuevas (vacías): los tokens que la base no
+        # tiene cuentan en la unión
+        base = self.base.matriz
+        base = sp.csr_matrix((base.data, base.indices, base.indptr), shape=(base.shape[0], columnas))
+        return np.hstack([
+            similitud_jaccard_entre(a, base),
+            similitud_jaccard_entre(a, self._matriz(todas, columnas))
+        ])
+
+    def fusionada(self) -> IncidenciaTerminos:
+        base = self.base.matriz
+        columnas = self.num_columnas
+        base = sp.csr_matrix((base.data, base.indices, base.indptr), shape=(base.shape[0], columnas))
+        return IncidenciaTerminos(
+            sp.vstack([base, self._matriz(self.filas, columnas)], format="csr"),
+            list(self.base.terminos) + list(self.columnas_nuevas)
+        )
+
+
+class IndiceIncremental:
+    """
+    Índice base (inmutable, mmap) + segmento de documentos añadidos:
+      - agregar: tokeniza el lote, añade sus postings, actualiza df/idf y
+        calcula sus vecinos y los de los documentos a los que desplazan; el
+        coste es proporcional al lote y al segmento, no al corpus
+      - buscar / buscar_lote: MaxScore sobre la base (sus términos, con el
+        idf actual) y sobre el segmento, fusionados con el mismo orden
+      - compactar: funde el segmento con la base y la guarda como una
+        versión nueva del índice
+    Cada lote queda en el diario antes de publicarse; al arrancar se
+    reaplican los que el índice guardado todavía no incluye, y con varios
+    workers cada uno aplica los lotes de los demás (sincronizar) antes de
+    ingerir o compactar.
+    """
+
+    def __init__(self, base: IndiceVectorial, directorio=None, ruta_csv=None,
+                 umbral_deriva: float = UMBRAL_DERIVA_IDF):
+        self.directorio = Path(directorio) if directorio else None
+        self.ruta_csv = ruta_csv
+        self.umbral_deriva = umbral_deriva
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._compactador = None
+        # Bytes del diario ya leídos
+        self._posicion_diario = 0
+
+        self.titulos = TextosAmpliados(base.titulos)
+        self.abstracts = TextosAmpliados(base.abstracts)
+        self.grafo_vecinos = GrafoVecinosAmpliado(base.grafo_vecinos)
+        self._cambiar_base(base)
+        # Documentos del principio del diario que ya están en el índice base
+        self._omitir = self.ingestados_base
+
+        with self._lock:
+            aplicados = self._sincronizar_diario()
+        if aplicados:
+            print(f">>> Reaplicados {aplicados} documentos ingestados del diario")
+
+    @property
+    def base(self) -> IndiceVectorial:
+        return self.vista.base
+
+    @property
+    def version(self) -> str:
+        return self.vista.version
+
+    @property
+    def num_docs(self) -> int:
+        return self.vista.num_docs
+
+    @property
+    def num_ingestados(self) -> int:
+        return len(self._docs_delta)
+
+    @property
+    def ruta_diario(self) -> Optional[Path]:
+        return self.directorio / DIARIO_INGESTADOS if self.directorio else None
+
+    def _cambiar_base(self, base: IndiceVectorial):
+        self.ingestados_base = int(base.manifiesto.get("ingestados", 0))
+        # Un índice solo en memoria no tiene versión: cada generación la suya
+        self._version_base = base.manifiesto.get("version") or f"memoria-{time.time_ns():x}"
+
+        # df por término: se calcula en la primera ingesta
+        self._df = None
+        self._terminos_nuevos = {}
+        self._docs_delta = []
+        self._facetas_delta = {nombre: [] for nombre in base.facetas}
+        self._delta_u = None
+        # Score del k-ésimo vecino de cada documento (se lee en la primera ingesta)
+        self._ultimo_score = None
+        self._jaccard = None
+        if base.incidencia_titulos is not None and base.incidencia_keywords is not None:
+            self._jaccard = (_IncidenciaAmpliada(base.incidencia_titulos), _IncidenciaAmpliada(base.incidencia_keywords))
+
+        self.titulos.reiniciar(base.titulos)
+        self.abstracts.reiniciar(base.abstracts)
+        self.grafo_vecinos.reiniciar(base.grafo_vecinos)
+        self.vista = _Vista(base, VocabularioAmpliado(base.termino_id, {}), base.idf, None,
+                            base.num_docs, self._version_base, jaccard=self._jaccard)
+
+    # ================= INGESTA =================
+    def agregar(self, documentos: List[dict]) -> List[int]:
+        """
+        Añade documentos ({"title", "keywords", "abstract"} y, si se conocen,
+        "session" y "year") y devuelve sus índices.
+        """
+        if not documentos:
+            return []
+        documentos = [
+            {"title": str(d.get("title") or ""), "keywords": str(d.get("keywords") or ""),
+             "abstract": str(d.get("abstract") or ""), "session": d.get("session"), "year": d.get("year")}
+            for d in documentos
+        ]
+        with self._lock, self._bloqueo_diario():
+            self._sincronizar_diario()
+            return self._agregar(documentos, registrar=True)
+
+    def sincronizar(self) -> int:
+        """
+        Aplica los lotes que otros procesos añadieron al diario. Devuelve
+        cuántos documentos se añadieron.
+        """
+        with self._lock:
+            return self._sincronizar_diario()
+
+    def _agregar(self, documentos: List[dict], registrar: bool) -> List[int]:
+        if self._jaccard is None:
+            raise RuntimeError("El índice no guarda incidencias de títulos/keywords: reconstrúyelo para ingerir documentos")
+        titulos = [d["title"] for d in documentos]
+        vista = self.vista
+        base = vista.base
+        inicio = vista.num_docs
+        num_docs = inicio + len(documentos)
+        fragmento = procesar_fragmento(
+            inicio, titulos, [d["keywords"] for d in documentos], [d["abstract"] for d in documentos]
+        )
+
+        # Ids globales de término: los nuevos, a continuación del vocabulario
+        terminos_nuevos = dict(self._terminos_nuevos)
+        num_terminos = len(base.termino_id) + len(terminos_nuevos)
+        ids = np.empty(len(fragmento.terminos), dtype=np.int64)
+        for j, termino in enumerate(fragmento.terminos):
+            i = vista.termino_id.get(termino)
+            if i is None:
+                i = terminos_nuevos.get(termino)
+            if i is None:
+                i = terminos_nuevos[termino] = num_terminos
+                num_terminos += 1
+            ids[j] = i
+
+        filas = ids[fragmento.filas]
+        if self._df is None:
+            # df del índice base; los términos con idf 0 (en todos los
+            # documentos) no guardan postings
+            self._df = np.diff(base.u.indptr).astype(np.int64)
+            self._df[np.asarray(base.idf) == 0] = base.num_docs
+        df = np.zeros(num_terminos, dtype=np.int64)
+        df[:len(self._df)] = self._df
+        df += np.bincount(filas, minlength=num_terminos)
+        idf = idf_funcion(df, num_docs)
+
+        docs = fragmento.docs - inicio
+        docs_delta = self._docs_delta + [
+            (filas[docs == n], fragmento.conteos[docs == n]) for n in range(len(documentos))
+        ]
+        delta_u = _matriz_segmento(docs_delta, idf)
+
+        jaccard_titulos, jaccard_keywords = self._jaccard
+        filas_titulos = jaccard_titulos.filas_de(fragmento.titulos_stem)
+        filas_keywords = jaccard_keywords.filas_de(fragmento.keywords_stem)
+        filas_grafo, ultimo_score = self._vecinos_nuevos(
+            base, inicio, delta_u, filas_titulos, filas_keywords
+        )
+        facetas_delta = {
+            nombre: valores + [d.get(nombre) for d in documentos]
+            for nombre, valores in self._facetas_delta.items()
+        }
+        facetas_nuevas = {
+            nombre: ConstructorFaceta(base.facetas[nombre].entera).agregar(valores).faceta(vista.num_base)
+            for nombre, valores in facetas_delta.items()
+        }
+
+        if registrar:
+            self._registrar(documentos)
+
+        # Publicar: primero lo que resuelve índices de documento, luego la vista
+        self._df = df
+        self._terminos_nuevos = terminos_nuevos
+        self._docs_delta = docs_delta
+        self._facetas_delta = facetas_delta
+        self._delta_u = delta_u
+        self._ultimo_score = ultimo_score
+        jaccard_titulos.filas.extend(filas_titulos)
+        jaccard_keywords.filas.extend(filas_keywords)
+        self.grafo_vecinos.actualizar(filas_grafo, num_docs)
+        self.titulos.agregar(titulos)
+        self.abstracts.agregar([d["abstract"] for d in documentos])
+        self.vista = _Vista(
+            base, VocabularioAmpliado(base.termino_id, terminos_nuevos), idf,
+            IndiceInvertido(delta_u), num_docs,
+            f"{self._version_base}+{len(docs_delta)}", facetas_nuevas, self._jaccard
+        )
+        return list(range(inicio, num_docs))
+
+    def _vecinos_nuevos(self, base: IndiceVectorial, inicio: int, delta_u: sp.csr_matrix,
+                        filas_titulos, filas_keywords) -> Tuple[dict, np.ndarray]:
+        """
+        Filas del grafo de los documentos nuevos (contra todo el corpus) y de
+        los anteriores en cuyo top-k entra alguno de ellos. La similitud es la
+        misma combinación Jaccard + coseno que al construir el índice.
+        """
+        k = self.grafo_vecinos.k
+        num_nuevos = len(filas_titulos)
+        num_docs = inicio + num_nuevos
+        if self._ultimo_score is None:
+            self._ultimo_score = (np.array(base.grafo_vecinos.scores[:, -1], dtype=np.float32)
+                                  if k else np.zeros(base.num_docs, dtype=np.float32))
+        ultimo_score = np.concatenate([self._ultimo_score, np.zeros(num_nuevos, dtype=np.float32)])
+        if k == 0:
+            vacia = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+            return {doc: vacia for doc in range(inicio, num_docs)}, ultimo_score
+
+        jaccard_titulos, jaccard_keywords = self._jaccard
+        todas_titulos = jaccard_titulos.filas + filas_titulos
+        todas_keywords = jaccard_keywords.filas + filas_keywords
+        terminos_base = base.u.shape[0]
+        vectores = delta_u[:, delta_u.shape[1] - num_nuevos:].T.tocsr()
+
+        filas = {}
+        tam_bloque = tam_bloque_para(num_docs)
+        for a in range(0, num_nuevos, tam_bloque):
+            b = min(a + tam_bloque, num_nuevos)
+            coseno = np.hstack([
+                (vectores[a:b, :terminos_base] @ base.u).toarray(),
+                (vectores[a:b] @ delta_u).toarray()
+            ])
+            bloque = (
+                w_title * jaccard_titulos.similitud(filas_titulos[a:b], todas_titulos)
+                + w_keywords * jaccard_keywords.similitud(filas_keywords[a:b], todas_keywords)
+                + w_abstract * coseno
+            )
+
+            filas_con_nuevos(self.grafo_vecinos, filas, ultimo_score, bloque, inicio + a, inicio, k)
+
+        return filas, ultimo_score
+
+    # ================= DIARIO =================
+    def _bloqueo_diario(self):
+        if self.directorio is None:
+            return contextlib.nullcontext()
+        return bloqueo_exclusivo(self.directorio / BLOQUEO_DIARIO)
+
+    def _registrar(self, documentos: List[dict]):
+        """
+        Añade el lote al diario. Se llama con el cerrojo del diario y tras
+        sincronizar, así la posición leída queda al final del archivo.
+        """
+        if self.ruta_diario is None:
+            return
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        with open(self.ruta_diario, "ab") as f:
+            f.write((json.dumps(documentos, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            self._posicion_diario = f.tell()
+
+    def _sincronizar_diario(self) -> int:
+        """
+        Aplica los lotes del diario posteriores a la última lectura (solo
+        líneas completas), saltando los que el índice base ya incluye (la
+        compactación siempre incluye lotes completos). Requiere self._lock.
+        """
+        if self.ruta_diario is None:
+            return 0
+        try:
+            with open(self.ruta_diario, "rb") as f:
+                f.seek(self._posicion_diario)
+                datos = f.read()
+        except FileNotFoundError:
+            return 0
+
+        aplicados = 0
+        fin = 0
+        while True:
+            salto = datos.find(b"\n", fin)
+            if salto < 0:
+                break
+            linea, fin = datos[fin:salto], salto + 1
+            self._posicion_diario += len(linea) + 1
+            if not linea.strip():
+                continue
+            try:
+                lote = json.loads(linea.decode("utf-8"))
+            except ValueError:
+                print(f"⚠ Lote ilegible en el diario de ingesta (byte {self._posicion_diario - len(linea) - 1}), se ignora")
+                continue
+            if self._omitir > 0:
+                self._omitir -= len(lote)
+                continue
+            self._agregar(lote, registrar=False)
+            aplicados += len(lote)
+        return aplicados
+
+    # ================= BÚSQUEDA =================
+    def filtro(self, anio_desde: int = None, anio_hasta: int = None,
+               sesiones: List[str] = None) -> Optional[FiltroDocumentos]:
+        """
+        Documentos permitidos por año y sesión (base y añadidos), o None
+        sin criterios.
+        """
+        vista = self.vista
+        return filtro_documentos(vista.facetas, vista.num_docs, anio_desde, anio_hasta, sesiones)
+
+    def buscar(self, stem_q, top_k: int = 10, filtro: FiltroDocumentos = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k para una consulta ya normalizada y stemmizada, solo entre los
+        documentos de `filtro` si se da.
+        """
+        vista = self.vista
+        terminos, pesos = pesos_consulta(stem_q, vista.termino_id, vista.idf)
+        if vista.invertido_delta is None:
+            if filtro is not None:
+                filtro = filtro.segmento(0, vista.num_base)
+            return vista.base.invertido.buscar(terminos, pesos, top_k=top_k, filtro=filtro)
+
+        filtro_base = filtro_delta = None
+        if filtro is not None:
+            filtro_base = filtro.segmento(0, vista.num_base)
+            filtro_delta = filtro.segmento(vista.num_base, vista.num_docs)
+        en_base = terminos < vista.terminos_base
+        return _fusionar(
+            vista,
+            vista.base.invertido.buscar(terminos[en_base], pesos[en_base], top_k=top_k, filtro=filtro_base),
+            vista.invertido_delta.buscar(terminos, pesos, top_k=top_k, filtro=filtro_delta),
+            top_k
+        )
+
+    def similitudes(self, doc: int) -> Optional[np.ndarray]:
+        """
+        Similitud de un documento con todos (la del grafo de vecinos: Jaccard
+        de títulos y keywords + coseno de abstracts), -inf consigo mismo.
+        None si el índice no guarda las incidencias.
+        """
+        vista = self.vista
+        if vista.jaccard is None:
+            return None
+        base, num_base = vista.base, vista.num_base
+        jaccard_titulos, jaccard_keywords = vista.jaccard
+        columnas_titulos, columnas_keywords = vista.columnas_jaccard
+        num_delta = vista.num_docs - num_base
+        delta_u = vista.invertido_delta.postings if vista.invertido_delta is not None else None
+
+        if doc < num_base:
+            vector = base.u[:, doc].T.tocsr()
+            fila_titulos = base.incidencia_titulos.matriz[doc].indices
+            fila_keywords = base.incidencia_keywords.matriz[doc].indices
+        else:
+            vector = delta_u[:, doc - num_base].T.tocsr()
+            fila_titulos = jaccard_titulos.filas[doc - num_base]
+            fila_keywords = jaccard_keywords.filas[doc - num_base]
+
+        coseno = [(vector[:, :vista.terminos_base] @ base.u).toarray()]
+        if num_delta:
+            vector = sp.csr_matrix((vector.data, vector.indices, vector.indptr), shape=(1, delta_u.shape[0]))
+            coseno.append((vector @ delta_u[:, :num_delta]).toarray())
+        similitudes = (
+            w_title * jaccard_titulos.similitud([fila_titulos], jaccard_titulos.filas[:num_delta], columnas_titulos)
+            + w_keywords * jaccard_keywords.similitud([fila_keywords], jaccard_keywords.filas[:num_delta],
+                                                      columnas_keywords)
+            + w_abstract * np.hstack(coseno)
+        )[0]
+        similitudes[doc] = -np.inf
+        return similitudes
+
+    def matriz_consultas(self, lista_stems, vista: _Vista = None) -> sp.csr_matrix:
+        """
+        Matriz dispersa consultas x términos: cada fila es el vector TF-IDF
+        normalizado de una consulta, con los mismos pesos que buscar.
+        """
+        vista = vista or self.vista
+        filas = [pesos_consulta(stem_q, vista.termino_id, vista.idf) for stem_q in lista_stems]
+        indptr = np.zeros(len(filas) + 1, dtype=np.int64)
+        np.cumsum([len(columnas) for columnas, _ in filas], out=indptr[1:])
+        columnas = np.concatenate([c for c, _ in filas] + [np.array([], dtype=np.int32)])
+        pesos = np.concatenate([p for _, p in filas] + [np.array([], dtype=float)])
+        return sp.csr_matrix((pesos, columnas, indptr), shape=(len(filas), len(vista.idf)))
+
+    def buscar_lote(self, lista_stems, top_k: int = 10) -> List[Tuple[np.ndarray, np.ndarray]]:
+        vista = self.vista
+        consultas = self.matriz_consultas(lista_stems, vista)
+        if vista.invertido_delta is None:
+            return vista.base.invertido.buscar_lote(consultas, top_k=top_k)
+
+        return [
+            _fusionar(vista, de_base, de_delta, top_k)
+            for de_base, de_delta in zip(
+                vista.base.invertido.buscar_lote(consultas[:, :vista.terminos_base], top_k=top_k),
+                vista.invertido_delta.buscar_lote(consultas, top_k=top_k)
+            )
+        ]
+
+    # ================= COMPACTACIÓN =================
+    def deriva_idf(self) -> float:
+        """
+        Cambio relativo (norma L2) del idf de los términos del índice base
+        desde que se construyó.
+        """
+        vista = self.vista
+        idf_base = np.asarray(vista.base.idf, dtype=float)
+        norma = np.linalg.norm(idf_base)
+        if vista.invertido_delta is None or norma == 0:
+            return 0.0
+        return float(np.linalg.norm(vista.idf[:len(idf_base)] - idf_base) / norma)
+
+    def compactar(self, forzar: bool = False) -> bool:
+        """
+        Si la deriva del idf supera el umbral (o con forzar), funde el
+        segmento con la base: los vectores base se re-ponderan con el idf
+        actual y se re-normalizan, el grafo de vecinos se recalcula por
+        bloques con esos vectores (como al construir: cambian los cosenos de
+        todo el corpus, no solo los de los añadidos), los textos se
+        materializan y el resultado se guarda como una versión nueva del
+        índice. El coste del grafo es el de una construcción (N x N por
+        bloques). Las búsquedas siguen sirviéndose durante la compactación;
+        las ingestas esperan a que termine.
+        """
+        with self._lock, self._bloqueo_diario():
+            self._sincronizar_diario()
+            vista = self.vista
+            if vista.invertido_delta is None:
+                return False
+            actual = ruta_actual(self.directorio) if self.directorio is not None else None
+            if actual is not None and vista.base.ruta is not None \
+                    and actual.resolve() != Path(vista.base.ruta).resolve():
+                # Otro proceso ya publicó una versión nueva: se recargará esa
+                return False
+            deriva = self.deriva_idf()
+            if not forzar and deriva < self.umbral_deriva:
+                return False
+
+            inicio = time.perf_counter()
+            base = vista.base
+            ingestados = self.ingestados_base + len(self._docs_delta)
+            u = sp.hstack([_reponderar(base, vista.idf), self._delta_u], format="csr")
+            incidencia_titulos = self._jaccard[0].fusionada()
+            incidencia_keywords = self._jaccard[1].fusionada()
+            grafo_vecinos = GrafoVecinos.desde_bloques(
+                similitud_combinada_bloques(
+                    u, incidencia_titulos.matriz, incidencia_keywords.matriz, tam_bloque_para(vista.num_docs)
+                ),
+                vista.num_docs,
+                base.grafo_vecinos.k
+            )
+            nuevo = IndiceVectorial(
+                vocabulario=list(base.vocabulario) + list(self._terminos_nuevos),
+                idf=vista.idf,
+                u=u,
+                titulos=_ampliar_textos(base.titulos, self.titulos[base.num_docs:]),
+                abstracts=_ampliar_textos(base.abstracts, self.abstracts[base.num_docs:]),
+                grafo_vecinos=grafo_vecinos,
+                manifiesto={"version": f"{self._version_base}+{len(self._docs_delta)}c", "ingestados": ingestados},
+                incidencia_titulos=incidencia_titulos,
+                incidencia_keywords=incidencia_keywords,
+                facetas={nombre: partes[0].fusionar(partes[1]) if len(partes) > 1 else partes[0]
+                         for nombre, partes in vista.facetas.items()}
+            )
+
+            huella = base.manifiesto.get("csv")
+            if self.directorio is not None and (huella or (self.ruta_csv and os.path.exists(self.ruta_csv))):
+                try:
+                    nuevo = cargar_indice(guardar_indice(
+                        nuevo, self.directorio, self.ruta_csv, ingestados=ingestados, huella=huella
+                    ))
+                except OSError as e:
+                    print(f"⚠ No se pudo guardar el índice compactado, se usa en memoria: {e}")
+
+            self._cambiar_base(nuevo)
+            print(f"✓ Índice compactado ({len(nuevo.vocabulario)} términos, {nuevo.num_docs} documentos, "
+                  f"deriva idf {deriva:.4f}) en {time.perf_counter() - inicio:.2f} segundos")
+            return True
+
+    def iniciar_compactacion(self, intervalo: float = INTERVALO_COMPACTACION):
+        """
+        Hilo en segundo plano que comprueba la deriva cada `intervalo` segundos.
+        """
+        with self._lock:
+            if self._compactador is not None or intervalo <= 0:
+                return
+            self._parar.clear()
+            self._compactador = threading.Thread(
+                target=self._bucle_compactacion, args=(intervalo,), name="compactacion-indice", daemon=True
+            )
+            self._compactador.start()
+
+    def detener_compactacion(self) -> bool:
+        """
+        Para el hilo de compactación, esperando a la que esté en curso.
+        Devuelve si estaba activo.
+        """
+        hilo = self._compactador
+        if hilo is None:
+            return False
+        self._parar.set()
+        hilo.join()
+        self._compactador = None
+        return True
+
+    def _bucle_compactacion(self, intervalo: float):
+        while not self._parar.wait(intervalo):
+            try:
+                self.compactar()
+            except Exception as e:
+                print(f"⚠ Error compactando el índice: {e}")
+
+    def estado(self) -> dict:
+        vista = self.vista
+        return {
+            "version_indice": vista.version,
+            "documentos": vista.num_docs,
+            "documentos_base": vista.num_base,
+            "documentos_ingestados": self.num_ingestados,
+            "terminos_nuevos": len(vista.termino_id.nuevos),
+            "filas_grafo_reescritas": len(self.grafo_vecinos.filas),
+            "deriva_idf": round(self.deriva_idf(), 6),
+            "umbral_deriva_idf": self.umbral_deriva,
+            "compactacion_activa": self._compactador is not None
+        }
+
+
+class TareaAgrupada:
+    """
+    Ejecuta `funcion` en un hilo aparte cada vez que se solicita; las
+    solicitudes que llegan mientras se ejecuta se agrupan en una sola
+    ejecución posterior.
+    """
+
+    def __init__(self, funcion: Callable[[], None], nombre: str):
+        self.funcion = funcion
+        self.nombre = nombre
+        self._pendiente = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def solicitar(self):
+        self._pendiente.set()
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name=self.nombre, daemon=True)
+                self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            self._pendiente.wait()
+            self._pendiente.clear()
+            try:
+                self.funcion()
+            except Exception as e:
+                print(f"⚠ Error en {self.nombre}: {e}")
+
+
+# ================= AUXILIARES =================
+def _matriz_segmento(docs_delta, idf: np.ndarray) -> sp.csr_matrix:
+    """
+    Vectores TF-IDF normalizados (términos x documentos) de los documentos
+    añadidos, con el idf actual y las mismas funciones que el indexador.
+    """
+    indptr = np.zeros(len(docs_delta) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t, _ in docs_delta], out=indptr[1:])
+    terminos = np.concatenate([t for t, _ in docs_delta]).astype(np.int32)
+    conteos = np.concatenate([c for _, c in docs_delta])
+    tf = sp.csc_matrix((conteos, terminos, indptr), shape=(len(idf), len(docs_delta)))
+    tf.sort_indices()
+
+    u = sp.csr_matrix(normalizar_vectores(tf_idf_funcion(wtf_funcion(tf), idf)))
+    u.eliminate_zeros()
+    u.sort_indices()
+    return u
+
+def _reponderar(base: IndiceVectorial, idf: np.ndarray) -> sp.csr_matrix:
+    """
+    u del índice base con el idf actual: cada peso escala por idf_nuevo /
+    idf_base y cada documento se re-normaliza. Queda con todas las filas de
+    `idf` (los términos nuevos sin postings en la base).
+    """
+    u = base.u
+    idf_base = np.asarray(base.idf, dtype=float)
+    factor = np.zeros(len(idf_base))
+    np.divide(idf[:len(idf_base)], idf_base, out=factor, where=idf_base != 0)
+
+    datos = np.asarray(u.data) * np.repeat(factor, np.diff(u.indptr))
+    indices = np.array(u.indices)
+    normas = np.sqrt(np.bincount(indices, weights=datos ** 2, minlength=base.num_docs))
+    normas[normas == 0] = 1
+    datos /= normas[indices]
+
+    indptr = np.concatenate([u.indptr, np.full(len(idf) - u.shape[0], u.indptr[-1])])
+    reponderada = sp.csr_matrix((datos, indices, indptr), shape=(len(idf), base.num_docs))
+    reponderada.eliminate_zeros()
+    return reponderada
+
+def _ampliar_textos(base: Sequence[str], nuevos: List[str]) -> ListaTextos:
+    if isinstance(base, ListaTextos):
+        return base.ampliar(nuevos)
+    return ListaTextos.desde_lista(list(base) + list(nuevos))
+
+def _fusionar(vista: _Vista, de_base, de_delta, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Une los top-k de base y segmento (índices del segmento desplazados tras
+    la base) con el orden de IndiceInvertido: score descendente, empates por
+    índice descendente.
+    """
+    indices = np.concatenate([de_base[0], np.asarray(de_delta[0]) + vista.num_base])
+    scores = np.concatenate([de_base[1], de_delta[1]])
+    orden = np.lexsort((-indices, -scores))[:min(top_k, vista.num_docs)]
+    return indices[orden], scores[orden]
@@ -0,0 +1,276 @@
+"""
+Construcción del índice fuera de memoria: el CSV se lee por lotes, cada lote
+se tokeniza y sus postings parciales se vuelcan a disco; al final se fusionan
+directamente en arreglos mapeados en memoria. La memoria usada depende del
+tamaño del lote y del vocabulario, no del tamaño del corpus.
+"""
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import polars as pl
+import scipy.sparse as sp
+
+from .grafo_vecinos import GrafoVecinos, tam_bloque_para
+from .indexador import (
+    similitud_combinada_bloques, wtf_funcion, idf_funcion, tf_idf_funcion,
+    normalizar_vectores, K_VECINOS
+)
+from .facetas import ConstructorFaceta, COLUMNAS_FACETAS
+from .indice import IndiceVectorial, ListaTextos
+from .motor_similitud import ConstructorIncidencia
+from .preprocesamiento import procesar_fragmentos, reportar_etapa, TAM_FRAGMENTO
+
+# Documentos por lote leído del CSV
+TAM_LOTE = 20000
+
+COLUMNAS_TEXTO = ["title", "keywords", "abstract"]
+
+
+# ================= LECTURA POR LOTES =================
+def _transcodificar_utf8(ruta_csv, encoding: str, destino: Path) -> Path:
+    """
+    Copia el CSV a UTF-8 por bloques (el lector por lotes de polars solo
+    admite UTF-8). newline="" conserva los saltos de línea tal cual.
+    """
+    with open(ruta_csv, "r", encoding=encoding, newline="") as origen, \
+            open(destino, "w", encoding="utf-8", newline="") as salida:
+        for bloque in iter(lambda: origen.read(1 << 20), ""):
+            salida.write(bloque)
+    return destino
+
+def leer_lotes(ruta_csv, tam_lote: int = TAM_LOTE, encoding: str = "latin1",
+               dir_trabajo=None) -> Iterator[Tuple[List[str], List[str], List[str], dict]]:
+    """
+    Genera (titulos, keywords, abstracts, facetas) por lotes de como mucho
+    tam_lote filas. `facetas`: columna -> valores, de las que tenga el CSV.
+    """
+    ruta = Path(ruta_csv)
+    tipo = {"utf8": "utf8", "utf8lossy": "utf8-lossy"}.get(encoding.lower().replace("-", ""))
+    if tipo is None:
+        ruta = _transcodificar_utf8(ruta_csv, encoding, Path(dir_trabajo or tempfile.gettempdir()) / "corpus_utf8.csv")
+        tipo = "utf8"
+
+    esquema = {c: pl.String for c in COLUMNAS_TEXTO}
+    cabecera = pl.read_csv(ruta, encoding=tipo, n_rows=0).columns
+    columnas = COLUMNAS_TEXTO + [c for c in COLUMNAS_FACETAS if c in cabecera]
+    lazy = pl.scan_csv(ruta, encoding=tipo, schema_overrides=esquema).select(columnas)
+    if hasattr(lazy, "collect_batches"):
+        lotes = lazy.collect_batches(chunk_size=tam_lote)
+    else:
+        # Versiones de polars sin collect_batches
+        lector = pl.read_csv_batched(ruta, encoding=tipo, batch_size=tam_lote, schema_overrides=esquema)
+        lotes = (
+            df.select(columnas)
+            for dfs in iter(lambda: lector.next_batches(1), None)
+            for df in dfs
+        )
+
+    for df in lotes:
+        yield tuple([t or "" for t in df[c].to_list()] for c in COLUMNAS_TEXTO) + (
+            {c: df[c].to_list() for c in columnas[len(COLUMNAS_TEXTO):]},
+        )
+
+
+# ================= ESCRITURA INCREMENTAL =================
+class EscritorTextos:
+    """
+    Escribe una lista de textos en disco (UTF-8 concatenado + offsets int64)
+    a medida que llegan; se abre luego como ListaTextos mapeada.
+    """
+
+    def __init__(self, directorio: Path, nombre: str):
+        self.ruta_datos = directorio / f"{nombre}.datos"
+        self.ruta_offsets = directorio / f"{nombre}.offsets"
+        self._datos = open(self.ruta_datos, "wb")
+        self._offsets = open(self.ruta_offsets, "wb")
+        self._posicion = 0
+        np.array([0], dtype=np.int64).tofile(self._offsets)
+
+    def agregar(self, textos: List[str]) -> None:
+        codificados = [str(t).encode("utf-8") for t in textos]
+        self._datos.write(b"".join(codificados))
+        offsets = self._posicion + np.cumsum([len(c) for c in codificados], dtype=np.int64)
+        offsets.tofile(self._offsets)
+        if len(offsets):
+            self._posicion = int(offsets[-1])
+
+    def cerrar(self) -> ListaTextos:
+        self._datos.close()
+        self._offsets.close()
+        datos = (np.memmap(self.ruta_datos, dtype=np.uint8, mode="r")
+                 if self._posicion else np.zeros(0, dtype=np.uint8))
+        return ListaTextos(datos, np.memmap(self.ruta_offsets, dtype=np.int64, mode="r"))
+
+
+def _volcar_fragmento(directorio: Path, n: int, fragmento) -> Path:
+    """
+    Guarda en disco los postings parciales de un fragmento y libera la memoria.
+    """
+    ruta = directorio / f"fragmento_{n:06d}.npz"
+    vocab = ListaTextos.desde_lista(fragmento.terminos)
+    np.savez(
+        ruta,
+        inicio=fragmento.inicio, num_docs=fragmento.num_docs,
+        vocab_datos=vocab.datos, vocab_offsets=vocab.offsets,
+        filas=fragmento.filas, docs=fragmento.docs, conteos=fragmento.conteos
+    )
+    return ruta
+
+
+# ================= CONSTRUCCIÓN =================
+def construir_indice_streaming(ruta_csv="data/documentos.csv", dir_trabajo=None,
+                               tam_lote: int = TAM_LOTE, k_vecinos: int = K_VECINOS,
+                               workers: int = 1, tam_fragmento: int = TAM_FRAGMENTO,
+                               encoding: str = "latin1") -> IndiceVectorial:
+    """
+    Igual que indexador.construir_indice pero con memoria acotada. Los
+    arreglos del índice devuelto están mapeados sobre archivos de dir_trabajo,
+    que debe seguir existiendo mientras se use (p. ej. hasta guardar_indice).
+    """
+    inicio = time.perf_counter()
+    dir_trabajo = Path(dir_trabajo or tempfile.mkdtemp(prefix="upscholar_indice_"))
+    dir_trabajo.mkdir(parents=True, exist_ok=True)
+
+    titulos = EscritorTextos(dir_trabajo, "titulos")
+    abstracts = EscritorTextos(dir_trabajo, "abstracts")
+    incidencia_titulos = ConstructorIncidencia()
+    incidencia_keywords = ConstructorIncidencia()
+    facetas = {nombre: ConstructorFaceta(entera) for nombre, entera in COLUMNAS_FACETAS.items()}
+
+    df_terminos = {}      # término -> número de documentos que lo contienen
+    volcados = []
+    num_docs = 0
+
+    # ---- Pasada 1: lotes -> tokens -> postings parciales en disco ----
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for n_lote, (lote_titulos, lote_keywords, lote_abstracts, lote_facetas) in enumerate(
+                leer_lotes(ruta_csv, tam_lote, encoding, dir_trabajo)):
+            t0 = time.perf_counter()
+
+            fragmentos = procesar_fragmentos(
+                lote_titulos, lote_keywords, lote_abstracts, num_docs, tam_fragmento, executor
+            )
+            for fragmento in fragmentos:
+                for termino, conteo in zip(fragmento.terminos, np.bincount(fragmento.filas, minlength=len(fragmento.terminos))):
+                    df_terminos[termino] = df_terminos.get(termino, 0) + int(conteo)
+                incidencia_titulos.agregar(fragmento.titulos_stem)
+                incidencia_keywords.agregar(fragmento.keywords_stem)
+                volcados.append(_volcar_fragmento(dir_trabajo, len(volcados), fragmento))
+
+            titulos.agregar(lote_titulos)
+            abstracts.agregar(lote_abstracts)
+            for nombre, constructor in facetas.items():
+                constructor.agregar(lote_facetas.get(nombre, [None] * len(lote_abstracts)))
+            num_docs += len(lote_abstracts)
+
+            reportar_etapa(f"Lote {n_lote + 1} (acumulado {num_docs} docs)", len(lote_abstracts), time.perf_counter() - t0)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # ---- Pasada 2: fusión en arreglos mapeados (términos x docs y docs x términos) ----
+    t_fusion = time.perf_counter()
+    vocabulario = sorted(df_terminos)
+    posicion = {t: i for i, t in enumerate(vocabulario)}
+    df_vec = np.array([df_terminos[t] for t in vocabulario], dtype=np.int64)
+    del df_terminos
+    idf = idf_funcion(df_vec, num_docs)
+
+    # Igual que en memoria, los pesos nulos (idf = 0) no se guardan
+    indptr = np.zeros(len(vocabulario) + 1, dtype=np.int64)
+    np.cumsum(np.where(idf != 0, df_vec, 0), out=indptr[1:])
+    nnz = int(indptr[-1])
+
+    def mapa(nombre, dtype):
+        return np.memmap(dir_trabajo / nombre, dtype=dtype, mode="w+", shape=(max(nnz, 1),))
+
+    u_data, u_indices = mapa("u.data", np.float64), mapa("u.indices", np.int32)
+    ud_data, ud_indices = mapa("u_docs.data", np.float64), mapa("u_docs.indices", np.int32)
+    indptr_docs = np.zeros(num_docs + 1, dtype=np.int64)
+    cursor = indptr[:-1].copy()
+
+    for ruta in volcados:
+        with np.load(ruta) as f:
+            locales = ListaTextos(f["vocab_datos"], f["vocab_offsets"])
+            filas = np.array([posicion[t] for t in locales], dtype=np.int64)[f["filas"]]
+            docs = f["docs"] - int(f["inicio"])
+            conteos = f["conteos"]
+            inicio_frag, docs_frag = int(f["inicio"]), int(f["num_docs"])
+
+        # Matriz del fragmento (términos x docs del fragmento) con las mismas
+        # funciones que el camino en memoria: WTF, IDF y normalización por columna
+        por_doc = np.lexsort((filas, docs))
+        indptr_frag = np.zeros(docs_frag + 1, dtype=np.int64)
+        np.cumsum(np.bincount(docs, minlength=docs_frag), out=indptr_frag[1:])
+        m = sp.csc_matrix(
+            (conteos[por_doc], filas[por_doc].astype(np.int32), indptr_frag),
+            shape=(len(vocabulario), docs_frag)
+        )
+        u_frag = sp.csc_matrix(normalizar_vectores(tf_idf_funcion(wtf_funcion(m), idf)))
+        u_frag.sort_indices()
+
+        # docs x términos: los documentos del fragmento son contiguos
+        a = indptr_docs[inicio_frag]
+        indptr_docs[inicio_frag + 1:inicio_frag + docs_frag + 1] = a + u_frag.indptr[1:]
+        ud_data[a:a + u_frag.nnz] = u_frag.data
+        ud_indices[a:a + u_frag.nnz] = u_frag.indices
+
+        # términos x docs: cada término se escribe tras lo que ya tenía
+        filas = u_frag.indices.astype(np.int64)
+        docs = np.repeat(np.arange(docs_frag), np.diff(u_frag.indptr)) + inicio_frag
+        por_termino = np.lexsort((docs, filas))
+        filas, docs, pesos = filas[por_termino], docs[por_termino], u_frag.data[por_termino]
+        inicio_grupo = np.searchsorted(filas, filas, side="left")
+        destino = cursor[filas] + (np.arange(len(filas)) - inicio_grupo)
+        u_data[destino] = pesos
+        u_indices[destino] = docs
+        terminos_frag, cuentas = np.unique(filas, return_counts=True)
+        cursor[terminos_frag] += cuentas
+
+        os.remove(ruta)
+
+    for m in (u_data, u_indices, ud_data, ud_indices):
+        m.flush()
+
+    u = sp.csr_matrix((u_data[:nnz], u_indices[:nnz], indptr), shape=(len(vocabulario), num_docs), copy=False)
+    u_docs = sp.csr_matrix((ud_data[:nnz], ud_indices[:nnz], indptr_docs), shape=(num_docs, len(vocabulario)), copy=False)
+    reportar_etapa("Fusión de postings en disco", num_docs, time.perf_counter() - t_fusion)
+
+    # ---- Grafo de vecinos por bloques ----
+    incidencia_titulos = incidencia_titulos.incidencia()
+    incidencia_keywords = incidencia_keywords.incidencia()
+    t_grafo = time.perf_counter()
+    grafo_vecinos = GrafoVecinos.desde_bloques(
+        similitud_combinada_bloques(
+            u, incidencia_titulos.matriz, incidencia_keywords.matriz,
+            tam_bloque_para(num_docs), u_docs=u_docs
+        ),
+        num_docs,
+        k_vecinos
+    )
+    reportar_etapa("Grafo de vecinos", num_docs, time.perf_counter() - t_grafo)
+
+    print(f">>> Índice (streaming) construido en {time.perf_counter() - inicio:.4f} segundos.")
+
+    return IndiceVectorial(
+        vocabulario=vocabulario,
+        idf=idf,
+        u=u,
+        titulos=titulos.cerrar(),
+        abstracts=abstracts.cerrar(),
+        grafo_vecinos=grafo_vecinos,
+        incidencia_titulos=incidencia_titulos,
+        incidencia_keywords=incidencia_keywords,
+        facetas={nombre: constructor.faceta() for nombre, constructor in facetas.items()}
+    )
+
+
+def limpiar_trabajo(dir_trabajo) -> None:
+    shutil.rmtree(dir_trabajo, ignore_errors=True)
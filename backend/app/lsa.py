@@ -0,0 +1,155 @@
+"""
+Motor semántico local (LSA): SVD truncada de la matriz TF-IDF del índice.
+Documentos y consultas se proyectan en la misma base, sin llamadas de red.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sklearn.utils.extmath import randomized_svd
+
+from .indice import bloqueo_exclusivo
+from .motor_similitud import pesos_consulta
+from .procesar_texto import normalizar_y_filtrar, aplicar_stemming
+
+# Dimensiones de la base LSA y pasadas de potencia de la SVD aleatorizada
+DIMENSION_LSA = int(os.getenv("UPSCHOLAR_LSA_DIM", "256"))
+ITERACIONES_SVD = 5
+
+DIRECTORIO_LSA = "lsa"
+
+
+class ModeloLSA:
+    """
+    Proveedor de embeddings local con la misma interfaz que GeminiClient
+    (model_embedding, generar_embedding, generar_embedding_async):
+      - base:  términos x k (float32), vectores singulares izquierdos de u
+      - un texto se vectoriza con el mismo tokenizador, stemming e idf que el
+        índice y se proyecta: x @ base
+      - un documento del corpus es su columna de u proyectada igual
+    """
+
+    def __init__(self, termino_id, idf, u, base: np.ndarray, version: str, directorio: Optional[Path] = None):
+        self.termino_id = termino_id
+        self.idf = idf
+        self.u = u
+        self.base = base
+        self.directorio = directorio
+        self.model_embedding = f"lsa-{self.dimension}-{version}"
+
+    @property
+    def dimension(self) -> int:
+        return self.base.shape[1]
+
+    @classmethod
+    def construir(cls, indice, dimension: int = DIMENSION_LSA) -> "ModeloLSA":
+        """
+        SVD truncada (aleatorizada, determinista) de la matriz términos x documentos.
+        """
+        k = max(1, min(dimension, min(indice.u.shape) - 1))
+        inicio = time.time()
+        base, _, _ = randomized_svd(indice.u, k, n_iter=ITERACIONES_SVD, random_state=0)
+        print(f"✓ Base LSA ({k} dimensiones) calculada en {time.time() - inicio:.2f} segundos")
+        return cls(indice.termino_id, indice.idf, indice.u, base.astype(np.float32), _version_indice(indice))
+
+    @classmethod
+    def cargar_o_construir(cls, indice, dimension: int = DIMENSION_LSA) -> "ModeloLSA":
+        """
+        Base LSA guardada junto al índice (mmap) o, si falta o tiene otra
+        dimensión, calculada y guardada allí. Con el índice solo en memoria no
+        se guarda nada.
+        """
+        if not indice.ruta:
+            return cls.construir(indice, dimension)
+
+        directorio = Path(indice.ruta) / DIRECTORIO_LSA
+        # Un solo worker calcula la SVD; los demás abren la que guarda
+        with bloqueo_exclusivo(Path(indice.ruta) / ".lsa.lock"):
+            modelo = cls.cargar(directorio, indice, dimension)
+            if modelo is not None:
+                return modelo
+
+            modelo = cls.construir(indice, dimension)
+            try:
+                modelo.guardar(directorio)
+            except OSError as e:
+                print(f"⚠ No se pudo guardar la base LSA, se usa en memoria: {e}")
+            return modelo
+
+    def guardar(self, directorio: Path):
+        directorio = Path(directorio)
+        directorio.mkdir(parents=True, exist_ok=True)
+        tmp = directorio / "base.tmp.npy"
+        np.save(tmp, self.base)
+        os.replace(tmp, directorio / "base.npy")
+
+        tmp = directorio / "lsa.tmp.json"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dimension": self.dimension, "num_terminos": self.base.shape[0],
+                       "modelo": self.model_embedding, "creado": time.time()}, f)
+        os.replace(tmp, directorio / "lsa.json")
+        self.directorio = directorio
+
+    @classmethod
+    def cargar(cls, directorio: Path, indice, dimension: int = DIMENSION_LSA) -> Optional["ModeloLSA"]:
+        directorio = Path(directorio)
+        k = max(1, min(dimension, min(indice.u.shape) - 1))
+        try:
+            with open(directorio / "lsa.json", "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info.get("dimension") != k or info.get("num_terminos") != indice.u.shape[0]:
+                # Otra dimensión: la base y los vectores derivados se rehacen
+                shutil.rmtree(directorio, ignore_errors=True)
+                return None
+            base = np.load(directorio / "base.npy", mmap_mode="r")
+        except (OSError, ValueError) as e:
+            if (directorio / "lsa.json").exists():
+                print(f"⚠ Base LSA ilegible, se recalcula: {e}")
+            return None
+        return cls(indice.termino_id, indice.idf, indice.u, base, _version_indice(indice), directorio)
+
+    def vectores_documentos(self, indices: np.ndarray, textos=None) -> np.ndarray:
+        """
+        Vectores LSA (sin normalizar) de los documentos `indices` del índice.
+        Los añadidos después de construir la base (índice fuera de u) se
+        proyectan desde su texto, en `textos` (mismo orden que `indices`).
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        en_base = indices < self.u.shape[1]
+        vectores = np.zeros((len(indices), self.dimension), dtype=np.float32)
+        if en_base.any():
+            vectores[en_base] = self.u[:, indices[en_base]].T @ self.base
+        for posicion in np.flatnonzero(~en_base).tolist():
+            vectores[posicion] = self.generar_embedding(textos[posicion])
+        return vectores
+
+    def generar_embedding(self, texto: str, task_type: str = None) -> Optional[np.ndarray]:
+        """
+        Vector LSA de un texto (ceros si no tiene términos del vocabulario).
+        task_type se acepta por compatibilidad con GeminiClient.
+        """
+        tokens = aplicar_stemming([normalizar_y_filtrar(texto)])[0]
+        columnas, pesos = pesos_consulta(tokens, self.termino_id, self.idf)
+        if len(columnas) == 0:
+            return np.zeros(self.dimension, dtype=np.float32)
+        return (pesos @ self.base[columnas]).astype(np.float32)
+
+    async def generar_embedding_async(self, texto: str, task_type: str = None) -> Optional[np.ndarray]:
+        # Solo CPU y microsegundos: no hay espera que solapar
+        return self.generar_embedding(texto, task_type)
+
+
+def _version_indice(indice) -> str:
+    """
+    Identifica la base LSA en claves de caché: versión del índice o, si está
+    solo en memoria, huella del idf.
+    """
+    version = indice.manifiesto.get("version")
+    if version:
+        return version
+    return hashlib.sha256(np.ascontiguousarray(indice.idf).tobytes()).hexdigest()[:12]
@@ -1,16 +1,26 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 import re
 from pydantic import BaseModel
 from typing import List, Optional
 from .ia_busqueda import IABusqueda
-# Importas tu modelo ya cargado
-from .modelo_vectores import vocabulario, idf, u, d0, d2, similitudes_por_documento
+from .lsa import ModeloLSA
+# Importas tu modelo ya cargado: cada petición usa la generación de
+# indice_servido() (una recarga la sustituye sin cortar las que están en curso)
+from .modelo_vectores import indice_servido, agregar_documentos, recargar_indice, recargando, vigilar_indice
 from .procesar_texto import normalizar_y_filtrar, aplicar_stemming
-from .modelo_vectores import buscar_top_por_consulta, recomendacion_completa
+from .modelo_vectores import recomendacion_completa_lote
+from .modelo_vectores import recomendacion_por_tokens, version_indice
+from .ingesta_incremental import TareaAgrupada
+from .cache_resultados import CacheResultados
+from .resaltado import obtener_resaltador
 
 
+import asyncio
+import hmac
 import numpy as np
+import os
 import re
+import threading
 import time
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -30,26 +40,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class Query(BaseModel):
+class FiltrosBusqueda(BaseModel):
+    # Solo documentos con año en [anio_desde, anio_hasta] y sesión en
+    # `sesiones` (mayúsculas y espacios repetidos no cuentan)
+    anio_desde: Optional[int] = None
+    anio_hasta: Optional[int] = None
+    sesiones: Optional[List[str]] = None
+
+class Query(FiltrosBusqueda):
     texto: str
     top_k: int = 10
 
-class QueryIA(BaseModel):
+class QueryIA(FiltrosBusqueda):
     texto: str
     top_k: int = 10  # Artículos principales
     recomendaciones_por_item: int = 3 
 
+class ConsultaLote(BaseModel):
+    consultas: List[str]
+    top_k: int = 10
+    snippets: bool = True  # False: solo ranking, sin generar snippets
+
+# Consultas admitidas en una petición a /buscar/lote
+MAX_CONSULTAS_LOTE = int(os.getenv("UPSCHOLAR_MAX_CONSULTAS_LOTE", "5000"))
+
+class DocumentoNuevo(BaseModel):
+    titulo: str
+    abstract: str
+    keywords: str = ""
+    sesion: Optional[str] = None
+    anio: Optional[int] = None
+
+class LoteDocumentos(BaseModel):
+    documentos: List[DocumentoNuevo]
+
+# Documentos admitidos en una petición a /documentos/lote
+MAX_DOCUMENTOS_LOTE = int(os.getenv("UPSCHOLAR_MAX_DOCUMENTOS_LOTE", "1000"))
+
+# Los endpoints /admin y la ingesta (/documentos) exigen la cabecera
+# X-Admin-Token con este valor; sin él definido quedan deshabilitados
+ADMIN_TOKEN = os.getenv("UPSCHOLAR_ADMIN_TOKEN")
+
 class RecomendacionRequest(BaseModel):
     indice_documento: int
     top_k: int = 3
     excluir_indices: Optional[List[int]] = None
     usar_ia: bool = False  # Nuevo: elegir entre TF-IDF o IA
 
-# ================= INICIALIZACIÓN DE IA =================
+# Resultados de /buscar ya calculados (se vacía al cambiar la versión del índice)
+cache_resultados = CacheResultados()
 
 # ================= INICIALIZACIÓN DE IA =================
 
 ia_busqueda = None
+# Generación del índice cuyos documentos sirve ia_busqueda
+generacion_ia = None
 
 try:
     # Leer API key de variable de entorno o archivo .env
@@ -72,21 +117,37 @@ try:
         # Verificar si hay API key hardcodeada como variable
         GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
     
-    if GOOGLE_API_KEY:
+    # Motor de embeddings: "gemini" (por defecto; sin API key /buscar-ia
+    # responde 503), "lsa" (local, sin red) o "auto" (Gemini si hay API key,
+    # si no LSA). LSA es opcional: construye una SVD al arrancar
+    MOTOR_SEMANTICO = os.getenv("UPSCHOLAR_MOTOR_SEMANTICO", "gemini")
+    usar_lsa = MOTOR_SEMANTICO == "lsa" or (MOTOR_SEMANTICO == "auto" and not GOOGLE_API_KEY)
+    
+    if usar_lsa:
+        print("Inicializando búsqueda semántica local (LSA sobre el índice TF-IDF)...")
+        ia_busqueda = IABusqueda(
+            gemini_api_key=GOOGLE_API_KEY,
+            modelo_local=ModeloLSA.cargar_o_construir(indice_servido().base)
+        )
+    elif GOOGLE_API_KEY:
         print("Inicializando búsqueda con IA...")
         print(f"API Key encontrada: {GOOGLE_API_KEY[:10]}...")
         
         ia_busqueda = IABusqueda(gemini_api_key=GOOGLE_API_KEY)
-        ia_busqueda.inicializar(d2, d0)
+    else:
+        print("⚠ Google API Key no encontrada. Búsqueda IA deshabilitada")
+        print("  Crea un archivo .env con: GOOGLE_API_KEY=tu_api_key")
+        print("  o usa el motor local con UPSCHOLAR_MOTOR_SEMANTICO=lsa")
+    
+    if ia_busqueda is not None:
+        generacion_ia = indice_servido()
+        ia_busqueda.inicializar(generacion_ia.abstracts, generacion_ia.titulos)
         
         if ia_busqueda.embeddings_matrix is not None:
             print("✓ Búsqueda con IA inicializada correctamente")
         else:
             print("⚠ IA inicializada pero sin embeddings (modo fallback)")
             ia_busqueda = None
-    else:
-        print("⚠ Google API Key no encontrada. Búsqueda IA deshabilitada")
-        print("  Crea un archivo .env con: GOOGLE_API_KEY=tu_api_key")
         
 except ImportError as e:
     print(f"⚠ Módulo IA no disponible: {e}")
@@ -98,75 +159,135 @@ except Exception as e:
     traceback.print_exc()
     ia_busqueda = None
 
+def actualizar_ia():
+    """
+    Pone la búsqueda semántica al día con la generación servida y la
+    sustituye de una vez. Documentos añadidos a la misma generación (y,
+    con LSA, misma base): solo se embeben y se añaden los nuevos
+    (IABusqueda.ampliada). Índice recargado, base LSA nueva o demasiados
+    añadidos: se rehace, con la caché de consultas de antes si el modelo
+    no cambió.
+    """
+    global ia_busqueda, generacion_ia
+    actual = ia_busqueda
+    if actual is None:
+        return
+
+    activo = indice_servido()
+    modelo_local = None
+    if actual.modelo_local is not None:
+        modelo_local = ModeloLSA.cargar_o_construir(activo.base)
+    mismo_modelo = modelo_local is None or modelo_local.model_embedding == actual.modelo_local.model_embedding
+    if activo is generacion_ia and mismo_modelo and actual.puede_ampliarse(len(activo.titulos)):
+        if len(activo.titulos) == len(actual.embeddings_norm):
+            return
+        nueva = actual.ampliada(activo.abstracts, activo.titulos)
+    else:
+        nueva = IABusqueda(gemini_api_key=GOOGLE_API_KEY, modelo_local=modelo_local,
+                           cache_consultas=actual.cache_consultas)
+        nueva.inicializar(activo.abstracts, activo.titulos)
+    if nueva.embeddings_matrix is not None:
+        ia_busqueda, generacion_ia = nueva, activo
+        if nueva.cache_consultas is not actual.cache_consultas:
+            actual.cache_consultas.cerrar()
+        print(f"✓ Búsqueda con IA actualizada: {nueva.embeddings_matrix.shape[0]} documentos")
+
+# Embeddings de los documentos ingestados, en segundo plano y agrupados
+actualizacion_ia = TareaAgrupada(actualizar_ia, "actualizacion-ia")
+
+# Recarga automática cuando build_index publica una versión nueva (UPSCHOLAR_VIGILAR_INDICE)
+vigilar_indice(al_recargar=actualizacion_ia.solicitar)
+
 # ================= FUNCIONES AUXILIARES =================
 
 def generar_snippet_mejorado(texto: str, tokens: List[str], max_longitud: int = 300) -> str:
     """
     Genera un snippet con múltiples zonas del texto donde aparecen los términos de búsqueda.
     """
-    if not texto:
-        return "Sin abstract disponible."
-    
-    texto_lower = texto.lower()
-    snippets = []
-    
-    # Para cada token, encontrar todas sus posiciones
-    for token in tokens:
-        if len(token) > 2:
-            pattern = re.compile(re.escape(token), re.IGNORECASE)
-            matches = list(pattern.finditer(texto))
-            
-            for match in matches[:3]:  # Tomar hasta 3 ocurrencias por token
-                start = max(0, match.start() - 40)
-                end = min(len(texto), match.end() + 40)
-                
-                snippet = texto[start:end]
-                # Resaltar el token encontrado
-                snippet = pattern.sub(lambda m: f"<b>{m.group(0)}</b>", snippet)
-                
-                # Agregar puntos suspensivos si es necesario
-                if start > 0:
-                    snippet = "..." + snippet
-                if end < len(texto):
-                    snippet = snippet + "..."
-                
-                snippets.append(snippet)
-    
-    # Si no se encontraron coincidencias, tomar el inicio del texto
-    if not snippets:
-        snippet = texto[:max_longitud]
-        if len(texto) > max_longitud:
-            snippet = snippet + "..."
-        return snippet
-    
-    # Eliminar duplicados y limitar el número de snippets
-    snippets_unicos = []
-    for s in snippets:
-        if s not in snippets_unicos and len(s) > 10:
-            snippets_unicos.append(s)
-    
-    # Unir los snippets con " ... "
-    resultado = " ... ".join(snippets_unicos[:3])  # Máximo 3 zonas
-    
-    # Limitar la longitud total
-    if len(resultado) > max_longitud:
-        resultado = resultado[:max_longitud] + "..."
-    
-    return resultado
+    return obtener_resaltador(tokens).snippet(
+        texto, contexto=40, max_por_token=3, max_zonas=3, max_longitud=max_longitud
+    )
+
 def resaltar_palabras(texto: str, palabras: List[str]) -> str:
     """
     Resalta las palabras encontradas en el texto con <mark>
     """
     if not texto or not palabras:
         return texto
+
+    return obtener_resaltador(palabras, longitud_minima=1, limites_palabra=True).resaltar(
+        texto, "<mark>", "</mark>"
+    )
+
+def formatear_busqueda_tfidf(texto: str, resultados_dict: dict, top_indices, con_snippets: bool = True,
+                             tokens_clean: List[str] = None, activo=None) -> dict:
+    """
+    Respuesta de /buscar (sin el tiempo) a partir de recomendacion_completa.
+    con_snippets=False deja "snippet" a None (para trabajos que solo necesitan el ranking).
+    tokens_clean: la consulta ya normalizada, si se tiene
+    activo: generación del índice con la que se calculó el ranking
+    """
+    activo = activo or indice_servido()
+    d0, d2 = activo.titulos, activo.abstracts
+    # Procesar query para snippets
+    if tokens_clean is None:
+        tokens_clean = normalizar_y_filtrar(texto) if con_snippets else []
     
-    texto_resaltado = texto
-    for palabra in palabras:
-        # Buscar la palabra ignorando mayúsculas/minúsculas y con límites de palabra
-        patron = re.compile(r'\b(' + re.escape(palabra) + r')\b', re.IGNORECASE)
-        texto_resaltado = patron.sub(r'<mark>\1</mark>', texto_resaltado)
+    # Formatear resultados
+    resultados_formateados = []
+    total_adicionales = 0
     
-    return texto_resaltado
+    for doc_idx, data in resultados_dict.items():
+        principal = data['principal']
+        adicionales = data['adicionales']
+        total_adicionales += len(adicionales)
+        
+        # 1. Artículo principal
+        item_principal = {
+            "indice": int(principal['indice']),
+            "titulo": d0[principal['indice']],
+            "similitud": float(principal['score_consulta']),
+            "snippet": generar_snippet_mejorado(d2[principal['indice']], tokens_clean) if con_snippets else None,
+            "tiene_recomendaciones": True,
+            "tipo_busqueda": "tfidf",
+            "ranking": principal['ranking']
+        }
+        
+        resultados_formateados.append(item_principal)
+        
+        # 2. Artículos adicionales
+        for adicional in adicionales:
+            abstract = d2[adicional['indice']]
+            item_adicional = {
+                "indice": int(adicional['indice']),
+                "titulo": d0[adicional['indice']],
+                "similitud": float(adicional['score_similitud']),
+                "snippet": (abstract[:150] + "..." if len(abstract) > 150 else abstract) if con_snippets else None,
+                "tiene_recomendaciones": False,
+                "tipo_busqueda": "tfidf",
+                "principal_relacionado": int(principal['indice'])
+            }
+            
+            resultados_formateados.append(item_adicional)
+    
+    return {
+        "query": texto,
+        "total_resultados": len(resultados_formateados),
+        "tipo_busqueda": "tfidf",
+        "resultados": resultados_formateados,
+        "estadisticas": {
+            "principales": len(top_indices),
+            "adicionales": total_adicionales,
+            "total_unicos": len(top_indices) + total_adicionales
+        }
+    }
+
+def clave_filtros(q: FiltrosBusqueda) -> tuple:
+    """
+    Filtros de la petición como parte de una clave de caché.
+    """
+    sesiones = tuple(sorted({" ".join(s.split()).casefold() for s in q.sesiones or []}))
+    return q.anio_desde, q.anio_hasta, sesiones
 
 # ================= ENDPOINTS =================
 
@@ -174,7 +295,7 @@ def resaltar_palabras(texto: str, palabras: List[str]) -> str:
 def read_root():
     return {
         "mensaje": "UPSCHOLAR Backend OK", 
-        "documentos": len(d0),
+        "documentos": indice_servido().num_docs,
         "ia_disponible": ia_busqueda is not None,
         "version": "2.0"
     }
@@ -186,13 +307,17 @@ def status_ia():
     """
     status = {
         "ia_disponible": ia_busqueda is not None,
-        "documentos_indexados": len(d0) if ia_busqueda else 0,
+        "documentos_indexados": indice_servido().num_docs if ia_busqueda else 0,
     }
     
     if ia_busqueda and hasattr(ia_busqueda, 'embeddings_matrix') and ia_busqueda.embeddings_matrix is not None:
         status["embedding_dimensiones"] = ia_busqueda.embeddings_matrix.shape
     else:
         status["embedding_dimensiones"] = None
+
+    if ia_busqueda is not None:
+        status["motor_semantico"] = ia_busqueda.proveedor.model_embedding
+        status["cache_consultas"] = ia_busqueda.cache_consultas.estadisticas()
         
     return status
 
@@ -210,66 +335,35 @@ def buscar(q: Query):
     t0 = time.perf_counter()
     
     try:
-        # Usar el sistema completo
-        resultados_dict, top_indices = recomendacion_completa(
-            query=q.texto,
-            top_principal=min(q.top_k, 10), 
-            adicionales_por_item=3
-        )
-        
-        # Procesar query para snippets
+        activo = indice_servido()
+        top_principal = min(q.top_k, 10)
         tokens_clean = normalizar_y_filtrar(q.texto)
+        version = version_indice(activo)
+        filtros = clave_filtros(q)
         
-        # Formatear resultados
-        resultados_formateados = []
-        total_adicionales = 0
+        # Respuesta ya formateada para la misma consulta normalizada (mayúsculas,
+        # tildes y stopwords no cuentan) y los mismos filtros: mismos snippets
+        clave_respuesta = ("respuesta", tuple(tokens_clean), top_principal, filtros)
+        respuesta = cache_resultados.obtener(clave_respuesta, version)
         
-        for doc_idx, data in resultados_dict.items():
-            principal = data['principal']
-            adicionales = data['adicionales']
-            total_adicionales += len(adicionales)
-            
-            # 1. Artículo principal
-            item_principal = {
-                "indice": int(principal['indice']),
-                "titulo": d0[principal['indice']],
-                "similitud": float(principal['score_consulta']),
-                "snippet": generar_snippet_mejorado(d2[principal['indice']], tokens_clean),
-                "tiene_recomendaciones": True,
-                "tipo_busqueda": "tfidf",
-                "ranking": principal['ranking']
-            }
-            
-            resultados_formateados.append(item_principal)
-            
-            # 2. Artículos adicionales
-            for adicional in adicionales:
-                item_adicional = {
-                    "indice": int(adicional['indice']),
-                    "titulo": d0[adicional['indice']],
-                    "similitud": float(adicional['score_similitud']),
-                    "snippet": d2[adicional['indice']][:150] + "..." if len(d2[adicional['indice']]) > 150 else d2[adicional['indice']],
-                    "tiene_recomendaciones": False,
-                    "tipo_busqueda": "tfidf",
-                    "principal_relacionado": int(principal['indice'])
-                }
-                
-                resultados_formateados.append(item_adicional)
+        if respuesta is None:
+            # El ranking solo depende de la bolsa de stems (sin orden). Los
+            # filtros se aplican antes de puntuar: solo cuentan sus documentos
+            stem_q = aplicar_stemming([tokens_clean])[0]
+            resultados_dict, top_indices = cache_resultados.obtener_o_calcular(
+                ("ranking", tuple(sorted(stem_q)), top_principal, filtros),
+                version,
+                lambda: recomendacion_por_tokens(stem_q, top_principal=top_principal, adicionales_por_item=3,
+                                                 activo=activo,
+                                                 filtro=activo.filtro(q.anio_desde, q.anio_hasta, q.sesiones))
+            )
+            respuesta = formatear_busqueda_tfidf(q.texto, resultados_dict, top_indices, tokens_clean=tokens_clean,
+                                                 activo=activo)
+            cache_resultados.guardar(clave_respuesta, version, respuesta)
         
         t1 = time.perf_counter()
         
-        return {
-            "tiempo": round(t1 - t0, 4),
-            "query": q.texto,
-            "total_resultados": len(resultados_formateados),
-            "tipo_busqueda": "tfidf",
-            "resultados": resultados_formateados,
-            "estadisticas": {
-                "principales": len(top_indices),
-                "adicionales": total_adicionales,
-                "total_unicos": len(top_indices) + total_adicionales
-            }
-        }
+        return {"tiempo": round(t1 - t0, 4), **respuesta, "query": q.texto}
         
     except Exception as e:
         print(f"❌ Error en búsqueda: {e}")
@@ -284,10 +378,58 @@ def buscar(q: Query):
         }
 
 
+@app.post("/buscar/lote")
+def buscar_lote(q: ConsultaLote):
+    """
+    Muchas búsquedas TF-IDF en una petición: el ranking de todas las
+    consultas sale de un producto disperso consultas x documentos.
+    Cada elemento de "resultados" tiene la forma de la respuesta de /buscar
+    (su "tiempo" es el medio por consulta del lote).
+    """
+    if len(q.consultas) > MAX_CONSULTAS_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {MAX_CONSULTAS_LOTE} consultas por lote"
+        )
+    
+    t0 = time.perf_counter()
+    
+    try:
+        activo = indice_servido()
+        rankings = recomendacion_completa_lote(
+            q.consultas,
+            top_principal=min(q.top_k, 10),
+            adicionales_por_item=3,
+            activo=activo
+        )
+        respuestas = [
+            formatear_busqueda_tfidf(texto, resultados_dict, top_indices, con_snippets=q.snippets, activo=activo)
+            for texto, (resultados_dict, top_indices) in zip(q.consultas, rankings)
+        ]
+        
+        t1 = time.perf_counter()
+        por_consulta = round((t1 - t0) / max(1, len(respuestas)), 4)
+        
+        return {
+            "tiempo": round(t1 - t0, 4),
+            "total_consultas": len(respuestas),
+            "resultados": [{"tiempo": por_consulta, **respuesta} for respuesta in respuestas]
+        }
+        
+    except Exception as e:
+        print(f"❌ Error en búsqueda por lote: {e}")
+        return {
+            "tiempo": 0,
+            "total_consultas": len(q.consultas),
+            "resultados": [],
+            "error": str(e)
+        }
+
+
 # En main.py, modifica SOLO el endpoint /buscar-ia:
 
 @app.post("/buscar-ia")
-def buscar_con_ia(q: QueryIA):
+async def buscar_con_ia(q: QueryIA):
     """
     Búsqueda semántica usando embeddings de Gemini
     AHORA CON SISTEMA COMPLETO:
@@ -295,19 +437,25 @@ def buscar_con_ia(q: QueryIA):
     2. Para cada principal, 3 artículos similares
     3. Sin duplicados entre principales y recomendaciones
     """
-    if ia_busqueda is None:
+    # Una sola instancia para toda la petición (actualizar_ia la puede sustituir)
+    ia = ia_busqueda
+    if ia is None:
         raise HTTPException(
             status_code=503,
-            detail="Búsqueda con IA no disponible. Configura GOOGLE_API_KEY en el archivo .env"
+            detail="Búsqueda con IA no disponible. Configura GOOGLE_API_KEY en el archivo .env o UPSCHOLAR_MOTOR_SEMANTICO=lsa"
         )
     
     t0 = time.perf_counter()
     
+    # Documentos permitidos por los filtros: la búsqueda solo puntúa esos
+    filtro = indice_servido().filtro(q.anio_desde, q.anio_hasta, q.sesiones)
+    
     try:
         # 1. Obtener artículos principales de la búsqueda
-        resultados_principales = ia_busqueda.buscar(
+        resultados_principales = await ia.buscar_async(
             query=q.texto,
-            top_k=min(q.top_k * 2, 20)  # Pedir más para filtrar
+            top_k=min(q.top_k * 2, 20),  # Pedir más para filtrar
+            filtro=filtro
         )
         
         # Limitar a exactamente top_k y eliminar duplicados
@@ -319,18 +467,20 @@ def buscar_con_ia(q: QueryIA):
                 indices_vistos.add(res["indice"])
                 principales_finales.append(res)
         
-        # 2. Para cada artículo principal, obtener recomendaciones similares
+        # 2. Recomendaciones similares de todos los principales de una vez
+        # (3 por artículo, sin repetir principales ni recomendaciones anteriores)
         resultados_completos = []
         total_recomendaciones = 0
         
-        for principal in principales_finales:
-            # Obtener recomendaciones para este artículo
-            recomendaciones = ia_busqueda.obtener_recomendaciones(
-                indice_doc=principal["indice"],
-                top_k=3,  # 3 recomendaciones por artículo
-                excluir=list(indices_vistos)  # Excluir los ya vistos
-            )
-            
+        # (en un hilo: no bloquea el event loop)
+        recomendaciones_lote = await asyncio.to_thread(
+            ia.obtener_recomendaciones_lote,
+            indices_docs=[principal["indice"] for principal in principales_finales],
+            top_k=3,
+            filtro=filtro
+        )
+        
+        for principal, recomendaciones in zip(principales_finales, recomendaciones_lote):
             # Añadir artículo principal
             principal_formateado = {
                 "indice": principal["indice"],
@@ -389,7 +539,7 @@ def buscar_con_ia(q: QueryIA):
         
         # Fallback: búsqueda simple sin recomendaciones
         try:
-            resultados_simples = ia_busqueda.buscar(q.texto, q.top_k)
+            resultados_simples = await ia.buscar_async(q.texto, q.top_k, filtro=filtro)
             t1 = time.perf_counter()
             
             return {
@@ -421,7 +571,8 @@ def obtener_documento(indice: int):
     """
     Obtiene información completa de un documento por su índice.
     """
-    if indice < 0 or indice >= len(d0):
+    activo = indice_servido()
+    if indice < 0 or indice >= len(activo.titulos):
         raise HTTPException(
             status_code=404, 
             detail="Documento no encontrado"
@@ -429,9 +580,105 @@ def obtener_documento(indice: int):
     
     return {
         "indice": indice,
-        "titulo": d0[indice],
-        "abstract": d2[indice],
-        "abstract_completo": d2[indice]
+        "titulo": activo.titulos[indice],
+        "abstract": activo.abstracts[indice],
+        "abstract_completo": activo.abstracts[indice]
+    }
+
+def ingerir_documentos(documentos: List[DocumentoNuevo]) -> dict:
+    inicio = time.time()
+    indices = agregar_documentos([
+        {"title": d.titulo, "keywords": d.keywords, "abstract": d.abstract, "session": d.sesion, "year": d.anio}
+        for d in documentos
+    ])
+    activo = indice_servido()
+    activo.iniciar_compactacion()
+    if ia_busqueda is not None:
+        actualizacion_ia.solicitar()
+
+    return {
+        "tiempo": time.time() - inicio,
+        "indices": indices,
+        "total_documentos": activo.num_docs,
+        "version_indice": version_indice(activo)
+    }
+
+@app.post("/documentos")
+def agregar_documento(doc: DocumentoNuevo, x_admin_token: Optional[str] = Header(None)):
+    """
+    Añade un documento al índice servido: se puede buscar en cuanto responde
+    (la búsqueda semántica lo incorpora en segundo plano). Exige el token de
+    administración: lo ingestado queda en el diario y persiste.
+    """
+    verificar_admin(x_admin_token)
+    return ingerir_documentos([doc])
+
+@app.post("/documentos/lote")
+def agregar_documentos_lote(lote: LoteDocumentos, x_admin_token: Optional[str] = Header(None)):
+    """
+    Añade varios documentos con una sola actualización del índice (con el
+    token de administración).
+    """
+    verificar_admin(x_admin_token)
+    if len(lote.documentos) > MAX_DOCUMENTOS_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {MAX_DOCUMENTOS_LOTE} documentos por petición"
+        )
+    return ingerir_documentos(lote.documentos)
+
+@app.get("/status-indice")
+def status_indice():
+    """
+    Estado del índice: documentos ingestados pendientes de compactar y deriva del idf
+    """
+    return {**indice_servido().estado(), "recargando": recargando()}
+
+def verificar_admin(x_admin_token: Optional[str]):
+    """
+    Rechaza la petición si no trae el token de administración (o si no hay
+    ninguno configurado: cerrado por defecto).
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Administración deshabilitada: define UPSCHOLAR_ADMIN_TOKEN")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+def _recargar_en_segundo_plano(reconstruir: bool):
+    try:
+        if recargar_indice(reconstruir=reconstruir):
+            actualizacion_ia.solicitar()
+    except Exception as e:
+        print(f"⚠ Error recargando el índice: {e}")
+
+@app.post("/admin/recargar-indice")
+def admin_recargar_indice(reconstruir: bool = False, x_admin_token: Optional[str] = Header(None)):
+    """
+    Carga en segundo plano el índice al que apunta ACTUAL (o, con
+    reconstruir=true, lo construye desde el CSV) y lo pone en servicio sin
+    cortar las búsquedas: responde en cuanto empieza.
+    """
+    verificar_admin(x_admin_token)
+    if recargando():
+        raise HTTPException(status_code=409, detail="Ya hay una recarga en curso")
+
+    threading.Thread(
+        target=_recargar_en_segundo_plano, args=(reconstruir,), name="recarga-indice", daemon=True
+    ).start()
+    return {
+        "estado": "recargando",
+        "reconstruir": reconstruir,
+        "version_indice": version_indice()
+    }
+
+@app.get("/status-cache")
+def status_cache():
+    """
+    Contadores de las cachés de búsqueda (para dimensionarlas)
+    """
+    return {
+        "resultados": cache_resultados.estadisticas(),
+        "embeddings_consultas": ia_busqueda.cache_consultas.estadisticas() if ia_busqueda else None
     }
 
 @app.get("/health")
@@ -441,7 +688,7 @@ def health_check():
     """
     return {
         "status": "healthy",
-        "documentos": len(d0),
+        "documentos": indice_servido().num_docs,
         "ia_activa": ia_busqueda is not None,
         "timestamp": time.time()
     }
\ No newline at end of file
@@ -1,202 +1,237 @@
-import polars as pl
-import numpy as np
-import pandas as pd
-import re
+import os
+import threading
 import time
-import sys
 import nltk
+import numpy as np
+from pathlib import Path
+from typing import Callable, Optional
 
-from nltk.corpus import stopwords
-from nltk.metrics import jaccard_distance
-from .procesar_texto import normalizar_y_filtrar, aplicar_stemming
+from .procesar_texto import normalizar_y_filtrar, aplicar_stemming, obtener_tokenizador
+from .indexador import construir_indice, K_VECINOS
+from .indice import indice_vigente, cargar_indice, guardar_indice, bloqueo_exclusivo
+from .ingesta_incremental import IndiceIncremental
 
 nltk.download("stopwords", quiet=True)
 
-print(">>> Cargando datos y generando modelo vectorial...")
+# Rutas configurables del corpus y del índice precalculado (python -m app.build_index)
+RUTA_CSV = os.getenv("UPSCHOLAR_CSV", "data/documentos.csv")
+DIR_INDICE = os.getenv("UPSCHOLAR_INDICE", "data/indice")
 
-inicio = time.perf_counter()
+print(">>> Cargando modelo vectorial...")
 
-# ================= CARGA CSV =================
-try:
-    df = pl.read_csv("data/documentos.csv", encoding="latin1")
-except Exception as e:
-    print(f"Error crítico al leer documentos.csv: {e}")
-    sys.exit()
-
-d0 = df["title"].to_list()
-d1 = df["keywords"].to_list()
-d2 = df["abstract"].to_list()
-
-# ================= NORMALIZACIÓN =================
-titulos = [normalizar_y_filtrar(t) for t in d0]
-keywords = [normalizar_y_filtrar(t) for t in d1]
-abstract = [normalizar_y_filtrar(t) for t in d2]
-
-# ================= STEMMING =================
-abstract_stem = aplicar_stemming(abstract)
-
-# ================= TF =================
-def matriz_tf(lista_textos):
-    inverted_index = {}
-
-    for n_doc, texto in enumerate(lista_textos):
-        for pos, token in enumerate(texto, start=1):
-            inverted_index.setdefault(token, {})
-            inverted_index[token].setdefault(n_doc, [])
-            inverted_index[token][n_doc].append(pos)
-
-    terminos = sorted(inverted_index.keys())
-    num_docs = len(lista_textos)
-
-    matriz = []
-    for termino in terminos:
-        fila = [len(inverted_index[termino].get(doc_id, [])) for doc_id in range(num_docs)]
-        matriz.append(fila)
-
-    df_tdm = pd.DataFrame(matriz, index=terminos, columns=[f"doc_{i}" for i in range(num_docs)])
-    return df_tdm, np.array(matriz), inverted_index
-
-df_tdm, matriz, inverted_index = matriz_tf(abstract_stem)
-
-# ================= WTF =================
-def wtf_funcion(m):
-    w = np.zeros_like(m, dtype=float)
-    mask = m > 0
-    w[mask] = 1 + np.log10(m[mask])
-    return w
-
-wtf = wtf_funcion(matriz)
-
-# ================= IDF =================
-def df_funcion(m):
-    return np.sum(m > 0, axis=1)
-
-df_vec = df_funcion(matriz)
-num_docs = matriz.shape[1]
-
-def idf_funcion(df_vec, num_docs):
-    return np.log10(num_docs / df_vec)
-
-idf = idf_funcion(df_vec, num_docs)
-
-# ================= TF-IDF =================
-tf_idf = wtf * idf[:, np.newaxis]
-
-# ================= NORMALIZACIÓN =================
-def normalizar_vectores(m):
-    normas = np.linalg.norm(m, axis=0, keepdims=True)
-    normas[normas == 0] = 1
-    return m / normas
-
-u = normalizar_vectores(tf_idf)
-
-# ================= SIMILITUD COMBINADA (JACCARD + COSENO) =================
-print(">>> Calculando similitud combinada (Jaccard + Coseno)...")
-sim_inicio = time.perf_counter()
-
-# Preparar datos para Jaccard
-print(">>> Aplicando stemming a títulos y keywords...")
-titulos_stem = aplicar_stemming(titulos)
-keywords_stem = aplicar_stemming(keywords)
-
-# Función optimizada para Jaccard
-def calcular_matriz_jaccard(lista_docs):
-    n = len(lista_docs)
-    matriz = np.zeros((n, n), dtype=float)
-    for i in range(n):
-        for j in range(n):
-            d = jaccard_distance(set(lista_docs[i]), set(lista_docs[j]))
-            matriz[i, j] = 1 - d
-    return matriz
-
-# Calcular similitudes Jaccard
-print(">>> Calculando similitud Jaccard para títulos...")
-mat_jaccard_titles = calcular_matriz_jaccard(titulos_stem)
-
-print(">>> Calculando similitud Jaccard para keywords...")
-mat_jaccard_keywords = calcular_matriz_jaccard(keywords_stem)
-
-# Calcular similitud coseno para abstracts
-print(">>> Calculando similitud coseno para abstracts...")
-cos_abstract = np.dot(u.T, u)
-
-# Combinar con pesos optimizados
-print(">>> Combinando similitudes...")
-w_title = 0.2      # Títulos: 15%
-w_keywords = 0.3   # Keywords: 35%
-w_abstract = 0.5   # Abstract: 50%
-
-matriz_similitudes = (
-    w_title * mat_jaccard_titles + 
-    w_keywords * mat_jaccard_keywords + 
-    w_abstract * cos_abstract
-)
-
-# Crear diccionario de similitudes ordenadas
-similitudes_por_documento = {}
-num_docs = len(d0)
-
-for i in range(num_docs):
-    similitudes = matriz_similitudes[i]
-    similitudes_lista = [(j, similitudes[j]) for j in range(num_docs) if j != i]
-    similitudes_lista.sort(key=lambda x: x[1], reverse=True)
-    similitudes_por_documento[i] = [idx for idx, _ in similitudes_lista]
-
-sim_fin = time.perf_counter()
-print(f">>> Similitud combinada calculada en {sim_fin - sim_inicio:.4f} segundos.")
-print(f">>> Documentos cargados: {num_docs}")
-print(f">>> Pesos: Títulos={w_title}, Keywords={w_keywords}, Abstracts={w_abstract}")
-print("-" * 60)
+inicio = time.perf_counter()
 
-vocabulario = list(df_tdm.index)
-matriz_similitudes_global = matriz_similitudes  # <-- ¡ESTA LÍNEA ES CLAVE!
+# Segundos entre comprobaciones del puntero ACTUAL, del CSV y del diario de
+# ingesta (0: sin vigilancia). Con varios workers (WEB_CONCURRENCY) se vigila
+# por defecto, para que cada uno vea lo que ingieren o compactan los demás
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+INTERVALO_VIGILANCIA = float(os.getenv("UPSCHOLAR_VIGILAR_INDICE", "2" if WORKERS > 1 else "0"))
+
+# Cerrojo entre procesos: un solo worker construye el índice, los demás
+# esperan y abren (mmap) la versión que publica
+BLOQUEO_CONSTRUCCION = ".construccion.lock"
+
+# ================= CARGA DEL ÍNDICE =================
+def _estado_csv():
+    try:
+        estado = os.stat(RUTA_CSV)
+    except OSError:
+        return None
+    return estado.st_size, estado.st_mtime
+
+def cargar_o_construir_indice(reconstruir: bool = False):
+    """
+    Índice vigente de DIR_INDICE (mmap) o, si falta, está desactualizado o se
+    pide reconstruir, construido desde el CSV y guardado como versión nueva.
+    Los archivos son compartidos: todos los workers mapean las mismas páginas.
+    """
+    ruta_indice = None if reconstruir else indice_vigente(DIR_INDICE, RUTA_CSV)
+    if ruta_indice is None:
+        with bloqueo_exclusivo(Path(DIR_INDICE) / BLOQUEO_CONSTRUCCION):
+            # Otro worker pudo publicarlo mientras se esperaba
+            ruta_indice = None if reconstruir else indice_vigente(DIR_INDICE, RUTA_CSV)
+            if ruta_indice is None:
+                return _construir_y_guardar()
+
+    indice = cargar_indice(ruta_indice)
+    print(f">>> Índice cargado (mmap) desde: {ruta_indice}")
+    return indice
+
+def _construir_y_guardar():
+    if not os.path.exists(RUTA_CSV):
+        raise RuntimeError(f"No hay índice en {DIR_INDICE} ni corpus en {RUTA_CSV}")
+
+    print(">>> Índice ausente o desactualizado, construyendo desde el CSV...")
+    indice = construir_indice(RUTA_CSV, k_vecinos=K_VECINOS)
+    try:
+        indice = cargar_indice(guardar_indice(indice, DIR_INDICE, RUTA_CSV))
+    except OSError as e:
+        print(f"⚠ No se pudo guardar el índice, se usa en memoria: {e}")
+    return indice
+
+_csv_servido = _estado_csv()
+
+# Índice servido (una generación): el base más los documentos ingestados
+# después (diario). Las peticiones lo leen una vez con indice_servido() y
+# una recarga lo sustituye con una sola asignación
+indice_activo = IndiceIncremental(cargar_o_construir_indice(), DIR_INDICE, RUTA_CSV)
+
+# Ingestas y cambios de generación no se solapan; una recarga a la vez
+_lock_generacion = threading.RLock()
+_lock_recarga = threading.Lock()
+_vigilante = None
 
 fin = time.perf_counter()
-print(f">>> Modelo entrenado en {fin - inicio:.4f} segundos.")
+print(f">>> Documentos cargados: {indice_activo.num_docs}")
+print(f">>> Modelo listo en {fin - inicio:.4f} segundos.")
 print("-" * 60)
 
 modelo = True
 
 
-# Al final de tu archivo, debe quedar así:
+def indice_servido() -> IndiceIncremental:
+    """
+    Generación del índice que atiende las peticiones. Cada petición la lee
+    una vez y la usa hasta el final, aunque entre en servicio otra.
+    """
+    return indice_activo
 
-def buscar_top_por_consulta(query, top_k=10):
+
+def agregar_documentos(documentos):
+    """
+    Ingesta en la generación servida (nunca en una que se está retirando).
+    """
+    with _lock_generacion:
+        return indice_activo.agregar(documentos)
+
+
+# ================= RECARGA EN CALIENTE =================
+def recargar_indice(reconstruir: bool = False) -> bool:
+    """
+    Carga el índice vigente de DIR_INDICE (o lo construye desde el CSV) y lo
+    pone en servicio de una vez. Mientras se carga se sigue sirviendo la
+    generación anterior; las peticiones en curso terminan con ella y se
+    libera cuando dejan de usarla. Los lotes ingestados entretanto están en
+    el diario y la nueva generación los reaplica.
+    Devuelve False si el índice vigente ya es el servido.
+    """
+    global indice_activo, _csv_servido
+    with _lock_recarga:
+        anterior = indice_activo
+        if not reconstruir and not indice_desactualizado():
+            return False
+
+        inicio = time.perf_counter()
+        # Sin compactaciones de la generación anterior: moverían ACTUAL
+        compactando = anterior.detener_compactacion()
+        estado_csv = _estado_csv()
+        try:
+            base = cargar_o_construir_indice(reconstruir)
+        except Exception:
+            if compactando:
+                anterior.iniciar_compactacion()
+            raise
+
+        with _lock_generacion:
+            nuevo = IndiceIncremental(base, DIR_INDICE, RUTA_CSV)
+            if compactando:
+                nuevo.iniciar_compactacion()
+            indice_activo = nuevo
+            _csv_servido = estado_csv
+
+        print(f"✓ Índice recargado: {nuevo.version} ({nuevo.num_docs} documentos) "
+              f"en {time.perf_counter() - inicio:.2f} segundos")
+        return True
+
+
+def recargando() -> bool:
+    return _lock_recarga.locked()
+
+
+def indice_desactualizado() -> bool:
+    """
+    True si ACTUAL apunta a otra versión que la servida o, sin índice
+    vigente, si el CSV cambió desde que se cargó.
+    """
+    ruta = indice_vigente(DIR_INDICE, RUTA_CSV)
+    if ruta is not None:
+        servida = indice_activo.base.ruta
+        return servida is None or Path(ruta).resolve() != Path(servida).resolve()
+    estado = _estado_csv()
+    return estado is not None and estado != _csv_servido
+
+
+def vigilar_indice(intervalo: float = INTERVALO_VIGILANCIA, al_recargar: Optional[Callable[[], None]] = None):
+    """
+    Hilo que recarga el índice cuando `python -m app.build_index` (u otro
+    worker) publica una versión nueva o cambia el CSV, y aplica los lotes que
+    otros workers añadieron al diario. `al_recargar` se llama cuando cambian
+    los documentos servidos (recarga o lotes de otros workers).
+    """
+    global _vigilante
+    if intervalo <= 0 or _vigilante is not None:
+        return
+
+    def vigilar():
+        while True:
+            time.sleep(intervalo)
+            try:
+                if indice_desactualizado():
+                    if recargar_indice() and al_recargar is not None:
+                        al_recargar()
+                else:
+                    with _lock_generacion:
+                        agregados = indice_activo.sincronizar()
+                    if agregados and al_recargar is not None:
+                        al_recargar()
+            except Exception as e:
+                print(f"⚠ Error recargando el índice: {e}")
+
+    _vigilante = threading.Thread(target=vigilar, name="vigilancia-indice", daemon=True)
+    _vigilante.start()
+
+
+# ================= BÚSQUEDA =================
+def buscar_top_por_consulta(query, top_k=10, activo=None, filtro=None):
     """
     1. Vectoriza la consulta del usuario
-    2. Calcula similitud con todos los documentos
+    2. Calcula similitud recorriendo el índice invertido
     3. Retorna los top_k más relevantes
     """
     # Procesar consulta
     tokens = normalizar_y_filtrar(query)
     stem_q = aplicar_stemming([tokens])[0]
-    
-    # Vectorizar consulta (igual que tus documentos)
-    q_vec = np.zeros(len(vocabulario))
-    for token in stem_q:
-        if token in vocabulario:
-            idx = vocabulario.index(token)
-            q_vec[idx] += 1
-    
-    # Aplicar WTF + IDF
-    mask = q_vec > 0
-    w_q = np.zeros_like(q_vec)
-    w_q[mask] = 1 + np.log10(q_vec[mask])
-    q_tfidf = w_q * idf
-    
-    # Normalizar
-    norma_q = np.linalg.norm(q_tfidf)
-    u_q = q_tfidf / norma_q if norma_q != 0 else q_tfidf
-    
-    # Calcular similitudes (producto punto con todos los docs)
-    scores = np.dot(u_q, u)
-    
-    # Obtener top_k
-    top_indices = np.argsort(scores)[::-1][:top_k]
-    
-    return top_indices, scores[top_indices]
+    return buscar_top_por_tokens(stem_q, top_k=top_k, activo=activo, filtro=filtro)
+
+
+def buscar_top_por_tokens(stem_q, top_k=10, activo=None, filtro=None):
+    """
+    Top-k para una consulta ya normalizada y stemmizada. `activo`: generación
+    del índice (por defecto, la servida). `filtro`: documentos permitidos
+    (activo.filtro(...)), los demás no se puntúan.
+    """
+    # Vectorizar consulta (igual que tus documentos) y recorrer solo sus
+    # listas de postings, con poda MaxScore
+    return (activo or indice_activo).buscar(stem_q, top_k=top_k, filtro=filtro)
+
+
+def matriz_consultas(queries, activo=None):
+    """
+    Matriz dispersa consultas x términos: cada fila es el vector TF-IDF
+    normalizado de una consulta, con los mismos pesos que buscar_top_por_consulta.
+    """
+    return (activo or indice_activo).matriz_consultas(obtener_tokenizador().procesar_lote(queries))
 
 
-def recomendacion_completa(query, top_principal=10, adicionales_por_item=3):
+def buscar_top_lote(queries, top_k=10, activo=None):
+    """
+    Top-k de muchas consultas con un solo producto disperso por bloque.
+    Devuelve (indices, scores) por consulta, igual que buscar_top_por_consulta.
+    """
+    return (activo or indice_activo).buscar_lote(obtener_tokenizador().procesar_lote(queries), top_k=top_k)
+
+
+def recomendacion_completa(query, top_principal=10, adicionales_por_item=3, activo=None, filtro=None):
     """
     Sistema completo:
     1. Top 10 artículos para la consulta
@@ -204,26 +239,67 @@ def recomendacion_completa(query, top_principal=10, adicionales_por_item=3):
     3. Sin duplicados
     """
     # Paso 1: Top 10 principales por consulta
-    top_indices, top_scores = buscar_top_por_consulta(query, top_k=top_principal)
-    
+    activo = activo or indice_activo
+    top_indices, top_scores = buscar_top_por_consulta(query, top_k=top_principal, activo=activo, filtro=filtro)
+    return completar_recomendaciones(top_indices, top_scores, adicionales_por_item, activo=activo, filtro=filtro)
+
+
+def recomendacion_por_tokens(stem_q, top_principal=10, adicionales_por_item=3, activo=None, filtro=None):
+    """
+    recomendacion_completa para una consulta ya normalizada y stemmizada.
+    """
+    activo = activo or indice_activo
+    top_indices, top_scores = buscar_top_por_tokens(stem_q, top_k=top_principal, activo=activo, filtro=filtro)
+    return completar_recomendaciones(top_indices, top_scores, adicionales_por_item, activo=activo, filtro=filtro)
+
+
+def version_indice(activo=None):
+    """
+    Versión del índice servido (etiqueta las cachés de resultados); cambia
+    con cada documento ingestado y con cada recarga.
+    """
+    return (activo or indice_activo).version
+
+
+def recomendacion_completa_lote(queries, top_principal=10, adicionales_por_item=3, activo=None):
+    """
+    recomendacion_completa para una lista de consultas, con el ranking de
+    todas calculado de una vez.
+    """
+    activo = activo or indice_activo
+    return [
+        completar_recomendaciones(top_indices, top_scores, adicionales_por_item, activo=activo)
+        for top_indices, top_scores in buscar_top_lote(queries, top_k=top_principal, activo=activo)
+    ]
+
+
+def completar_recomendaciones(top_indices, top_scores, adicionales_por_item=3, activo=None, filtro=None):
+    """
+    Añade a cada principal sus adicionales del grafo de vecinos, sin duplicados
+    (y, con `filtro`, solo entre los documentos permitidos).
+    """
+    activo = activo or indice_activo
+    grafo_vecinos, d0 = activo.grafo_vecinos, activo.titulos
+
     # Paso 2: Preparar estructura sin duplicados
     excluidos = set(top_indices)  # Los 10 principales están excluidos
     resultados = {}
     
     # Paso 3: Para cada principal, obtener adicionales únicos
     for i, doc_idx in enumerate(top_indices):
-        # Obtener lista de similares precalculada
-        similares_ordenados = similitudes_por_documento[doc_idx]
+        # Obtener vecinos precalculados (ya ordenados) y sus scores
+        vecinos_ids, vecinos_scores = grafo_vecinos.vecinos(doc_idx)
         
         # Filtrar: quitar los que ya están excluidos
         adicionales = []
-        for candidato in similares_ordenados:
-            if candidato not in excluidos:
-                adicionales.append(candidato)
-                excluidos.add(candidato)  # Evitar duplicados
-                
-                if len(adicionales) >= adicionales_por_item:
-                    break
+        _elegir_adicionales(adicionales, zip(vecinos_ids.tolist(), vecinos_scores.tolist()),
+                            adicionales_por_item, excluidos, filtro)
+
+        # Fila agotada (sobre todo con filtro): el resto, puntuando el
+        # principal contra los documentos permitidos
+        if len(adicionales) < adicionales_por_item and len(vecinos_ids) < activo.num_docs - 1:
+            _elegir_adicionales(adicionales, _vecinos_exactos(activo, doc_idx, filtro),
+                                adicionales_por_item, excluidos, filtro)
         
         # Guardar resultado
         resultados[doc_idx] = {
@@ -237,17 +313,46 @@ def recomendacion_completa(query, top_principal=10, adicionales_por_item=3):
                 {
                     'indice': int(adicional),
                     'titulo': d0[adicional],
-                    'score_similitud': float(matriz_similitudes_global[doc_idx, adicional])
+                    'score_similitud': float(score)
                 }
-                for adicional in adicionales
+                for adicional, score in adicionales
             ]
         }
     
     return resultados, top_indices
 
+def _elegir_adicionales(adicionales, candidatos, adicionales_por_item, excluidos, filtro=None):
+    """
+    Añade (candidato, score) en orden hasta tener adicionales_por_item,
+    saltando los excluidos y los que no permite `filtro`.
+    """
+    for candidato, score in candidatos:
+        if len(adicionales) >= adicionales_por_item:
+            break
+        if candidato not in excluidos and (filtro is None or filtro.contiene(candidato)):
+            adicionales.append((candidato, score))
+            excluidos.add(candidato)  # Evitar duplicados
+
+
+def _vecinos_exactos(activo, doc_idx, filtro=None):
+    """
+    Vecinos de un documento con similitud positiva entre los permitidos por
+    `filtro` (o todos), en el orden de una fila del grafo.
+    """
+    similitudes = activo.similitudes(doc_idx)
+    if similitudes is None:
+        return []
+    candidatos = filtro.ids if filtro is not None else np.arange(len(similitudes))
+    candidatos = candidatos[candidatos < len(similitudes)]
+    candidatos = candidatos[similitudes[candidatos] > 0]
+    orden = np.lexsort((candidatos, -similitudes[candidatos]))
+    return zip(candidatos[orden].tolist(), similitudes[candidatos[orden]].tolist())
+
+
 # Asegúrate de exportar la nueva variable
 __all__ = [
-    'vocabulario', 'idf', 'u', 'd0', 'd2', 'similitudes_por_documento', 
-    'matriz_similitudes_global', 'titulos_stem', 'keywords_stem',
-    'buscar_top_por_consulta', 'recomendacion_completa'  # <-- ¡CORREGIDO!
+    'indice_servido', 'agregar_documentos', 'recargar_indice', 'vigilar_indice',
+    'buscar_top_por_consulta', 'recomendacion_completa',  # <-- ¡CORREGIDO!
+    'buscar_top_lote', 'recomendacion_completa_lote',
+    'buscar_top_por_tokens', 'recomendacion_por_tokens', 'version_indice'
 ]
\ No newline at end of file
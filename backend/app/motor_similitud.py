@@ -1,11 +1,159 @@
 import numpy as np
+import scipy.sparse as sp
+from collections.abc import Mapping
+
+def pesos_consulta(tokens, vocab, idf):
+    """
+    Ids de término (ascendentes) y pesos TF-IDF normalizados de una consulta
+    ya stemmizada, con el mismo esquema WTF + IDF que los documentos.
+    vocab puede ser un dict término -> id (búsqueda O(1)) o la lista del vocabulario.
+    """
+    conteos = {}
+    es_mapa = isinstance(vocab, Mapping)
+    for token in tokens:
+        idx = vocab.get(token) if es_mapa else (vocab.index(token) if token in vocab else None)
+        if idx is not None:
+            conteos[idx] = conteos.get(idx, 0) + 1
+
+    columnas = np.array(sorted(conteos), dtype=np.int32)
+    tf = np.array([conteos[c] for c in columnas], dtype=float)
+
+    # WTF + IDF
+    pesos = (1 + np.log10(tf)) * idf[columnas] if len(columnas) else tf
+
+    # Normalizar
+    norma = np.linalg.norm(pesos)
+    if norma != 0:
+        pesos = pesos / norma
+
+    return columnas, pesos
+
+def vectorizar_consulta(tokens, vocab, idf):
+    """
+    Vector TF-IDF normalizado de una consulta como fila dispersa (1 x |V|).
+    """
+    columnas, pesos = pesos_consulta(tokens, vocab, idf)
+    return sp.csr_matrix(
+        (pesos, columnas, np.array([0, len(columnas)])),
+        shape=(1, len(vocab))
+    )
 
 def similitud_coseno(vec_query, matriz_docs):
     """
-    Calcula la similitud coseno entre un vector de query y 
+    Calcula la similitud coseno entre un vector de query y
     la matriz de vectores normalizados de documentos.
+    Acepta tanto arreglos densos como matrices dispersas (términos x documentos).
     """
     if vec_query is None or matriz_docs is None:
         return np.zeros(matriz_docs.shape[1])
 
+    if sp.issparse(vec_query) or sp.issparse(matriz_docs):
+        if not sp.issparse(vec_query):
+            vec_query = sp.csr_matrix(np.atleast_2d(vec_query))
+        return (vec_query @ matriz_docs).toarray().ravel()
+
     return np.dot(vec_query, matriz_docs)
+
+class ConstructorIncidencia:
+    """
+    Construye la matriz de incidencia binaria documentos x términos de forma
+    incremental, lote a lote (los ids de columna se asignan por orden de
+    aparición del término).
+    """
+
+    def __init__(self):
+        self.columnas = {}
+        self._indices = []
+        self._longitudes = []
+
+    def agregar(self, lista_docs):
+        columnas = self.columnas
+        indices = []
+        longitudes = []
+        for tokens in lista_docs:
+            fila = sorted({columnas.setdefault(t, len(columnas)) for t in tokens})
+            indices.extend(fila)
+            longitudes.append(len(fila))
+        self._indices.append(np.array(indices, dtype=np.int32))
+        self._longitudes.append(np.array(longitudes, dtype=np.int64))
+        return self
+
+    def incidencia(self) -> "IncidenciaTerminos":
+        """
+        La matriz junto con el término de cada columna.
+        """
+        return IncidenciaTerminos(self.matriz(), list(self.columnas))
+
+    def matriz(self):
+        longitudes = np.concatenate(self._longitudes) if self._longitudes else np.array([], dtype=np.int64)
+        indptr = np.zeros(len(longitudes) + 1, dtype=np.int64)
+        np.cumsum(longitudes, out=indptr[1:])
+        indices = np.concatenate(self._indices) if self._indices else np.array([], dtype=np.int32)
+        return sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(longitudes), len(self.columnas))
+        )
+
+class IncidenciaTerminos:
+    """
+    Matriz de incidencia documentos x términos (CSR binaria) y el término de
+    cada columna, para poder añadir documentos nuevos con las mismas columnas.
+    """
+
+    def __init__(self, matriz: sp.csr_matrix, terminos):
+        self.matriz = matriz
+        self.terminos = terminos
+        self._columna = None
+
+    @property
+    def columna(self) -> dict:
+        # Solo hace falta al añadir documentos: no se construye al cargar
+        if self._columna is None:
+            self._columna = {t: i for i, t in enumerate(self.terminos)}
+        return self._columna
+
+def matriz_incidencia(lista_docs):
+    """
+    Matriz binaria dispersa documentos x términos (CSR): 1 si el término
+    aparece en el documento. Cada fila representa el conjunto de tokens
+    del documento, que es lo que usa Jaccard.
+    """
+    return ConstructorIncidencia().agregar(lista_docs).matriz()
+
+def similitud_jaccard_bloques(incidencia, tam_bloque=1024):
+    """
+    Genera la similitud Jaccard por bloques de filas: (inicio, bloque), con
+    bloque de forma (filas_bloque x N). Intersecciones = B[i:j] @ B.T,
+    uniones = |A| + |B| - intersección. Nunca se materializa la matriz N x N.
+    Se calcula igual que 1 - nltk.jaccard_distance, así que los valores son
+    idénticos bit a bit. Dos conjuntos vacíos tienen similitud 0.
+    """
+    incidencia = sp.csr_matrix(incidencia)
+    cardinal = np.diff(incidencia.indptr).astype(np.int64)
+    traspuesta = incidencia.T.tocsc()
+    n = incidencia.shape[0]
+
+    for inicio in range(0, n, tam_bloque):
+        fin = min(inicio + tam_bloque, n)
+        interseccion = (incidencia[inicio:fin] @ traspuesta).toarray().astype(np.int64)
+        union = cardinal[inicio:fin, np.newaxis] + cardinal[np.newaxis, :] - interseccion
+
+        bloque = np.zeros(union.shape, dtype=float)
+        mask = union > 0
+        bloque[mask] = 1 - (union[mask] - interseccion[mask]) / union[mask]
+        yield inicio, bloque
+
+def similitud_jaccard_entre(a, b):
+    """
+    Jaccard entre cada fila de `a` y cada fila de `b` (incidencias binarias
+    con las mismas columnas), con la misma fórmula que similitud_jaccard_bloques.
+    """
+    a, b = sp.csr_matrix(a), sp.csr_matrix(b)
+    interseccion = (a @ b.T).toarray().astype(np.int64)
+    union = (np.diff(a.indptr).astype(np.int64)[:, np.newaxis]
+             + np.diff(b.indptr).astype(np.int64)[np.newaxis, :] - interseccion)
+
+    bloque = np.zeros(union.shape, dtype=float)
+    mask = union > 0
+    bloque[mask] = 1 - (union[mask] - interseccion[mask]) / union[mask]
+    return bloque
@@ -0,0 +1,151 @@
+"""
+Preprocesamiento del corpus por fragmentos, en paralelo entre procesos.
+Cada fragmento se tokeniza y stemmiza por separado y produce su vocabulario
+local y sus postings; la fusión es determinista e idéntica al camino serial.
+"""
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+from .procesar_texto import obtener_tokenizador
+
+# Documentos por fragmento enviado a cada worker
+TAM_FRAGMENTO = 2000
+
+
+class Fragmento:
+    """
+    Resultado de preprocesar un rango de documentos [inicio, inicio + n):
+    vocabulario local de abstracts, postings (término local, doc global,
+    frecuencia) y tokens stemmizados de títulos y keywords para Jaccard.
+    """
+
+    def __init__(self, inicio, num_docs, terminos, filas, docs, conteos, titulos_stem, keywords_stem):
+        self.inicio = inicio
+        self.num_docs = num_docs
+        self.terminos = terminos
+        self.filas = filas
+        self.docs = docs
+        self.conteos = conteos
+        self.titulos_stem = titulos_stem
+        self.keywords_stem = keywords_stem
+
+
+def procesar_fragmento(inicio, titulos, keywords, abstracts) -> Fragmento:
+    """
+    Tokeniza + stemmiza un fragmento y cuenta frecuencias de sus abstracts.
+    Se ejecuta dentro de cada worker (un Tokenizador por proceso).
+    """
+    tokenizador = obtener_tokenizador()
+
+    terminos = {}
+    filas, docs, conteos = [], [], []
+    for n, tokens in enumerate(tokenizador.procesar_lote(abstracts)):
+        for termino, conteo in Counter(tokens).items():
+            filas.append(terminos.setdefault(termino, len(terminos)))
+            docs.append(inicio + n)
+            conteos.append(conteo)
+
+    return Fragmento(
+        inicio=inicio,
+        num_docs=len(abstracts),
+        terminos=list(terminos),
+        filas=np.array(filas, dtype=np.int64),
+        docs=np.array(docs, dtype=np.int64),
+        conteos=np.array(conteos, dtype=np.int64),
+        titulos_stem=tokenizador.procesar_lote(titulos),
+        keywords_stem=tokenizador.procesar_lote(keywords)
+    )
+
+
+def _procesar_fragmento_args(args) -> Fragmento:
+    return procesar_fragmento(*args)
+
+
+def fusionar_fragmentos(fragmentos: List[Fragmento]):
+    """
+    Une los fragmentos (en orden de documento) en el vocabulario global
+    ordenado y la matriz CSR términos x documentos de frecuencias, con el
+    mismo contenido y dtypes que matriz_tf.
+    """
+    fragmentos = sorted(fragmentos, key=lambda f: f.inicio)
+    num_docs = sum(f.num_docs for f in fragmentos)
+
+    vocabulario = sorted(set().union(*(f.terminos for f in fragmentos)))
+    posicion = {t: i for i, t in enumerate(vocabulario)}
+
+    filas = np.concatenate(
+        [np.array([posicion[t] for t in f.terminos], dtype=np.int64)[f.filas] for f in fragmentos]
+        or [np.array([], dtype=np.int64)]
+    )
+    docs = np.concatenate([f.docs for f in fragmentos] or [np.array([], dtype=np.int64)])
+    conteos = np.concatenate([f.conteos for f in fragmentos] or [np.array([], dtype=np.int64)])
+
+    orden = np.lexsort((docs, filas))
+    indptr = np.zeros(len(vocabulario) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(filas, minlength=len(vocabulario)), out=indptr[1:])
+
+    matriz = sp.csr_matrix(
+        (conteos[orden], docs[orden].astype(np.int32), indptr),
+        shape=(len(vocabulario), num_docs)
+    )
+
+    titulos_stem = [tokens for f in fragmentos for tokens in f.titulos_stem]
+    keywords_stem = [tokens for f in fragmentos for tokens in f.keywords_stem]
+    return vocabulario, matriz, titulos_stem, keywords_stem
+
+
+def reportar_etapa(etapa: str, num_docs: int, segundos: float) -> dict:
+    velocidad = num_docs / segundos if segundos > 0 else float("inf")
+    print(f">>> {etapa}: {num_docs} docs en {segundos:.2f} s ({velocidad:.0f} docs/s)")
+    return {"etapa": etapa, "docs": num_docs, "segundos": segundos, "docs_por_segundo": velocidad}
+
+
+def procesar_fragmentos(titulos, keywords, abstracts, inicio: int = 0,
+                        tam_fragmento: int = TAM_FRAGMENTO, executor=None) -> List[Fragmento]:
+    """
+    Parte los documentos [inicio, inicio + n) en fragmentos y los procesa,
+    en el executor si se pasa uno (el orden de salida es el de entrada).
+    """
+    tam_fragmento = max(1, tam_fragmento)
+    tareas = [
+        (inicio + i, titulos[i:i + tam_fragmento], keywords[i:i + tam_fragmento], abstracts[i:i + tam_fragmento])
+        for i in range(0, len(abstracts), tam_fragmento)
+    ]
+    if executor is not None and len(tareas) > 1:
+        return list(executor.map(_procesar_fragmento_args, tareas))
+    return [procesar_fragmento(*t) for t in tareas]
+
+
+def preprocesar_corpus(titulos, keywords, abstracts, workers: int = 1,
+                       tam_fragmento: int = TAM_FRAGMENTO, estadisticas: Optional[list] = None):
+    """
+    Preprocesa el corpus completo. Con workers > 1 reparte los fragmentos en
+    un ProcessPoolExecutor; el resultado es idéntico al de workers=1.
+    Devuelve (vocabulario, matriz_tf, titulos_stem, keywords_stem).
+    """
+    num_docs = len(abstracts)
+
+    t0 = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fragmentos = procesar_fragmentos(titulos, keywords, abstracts, 0, tam_fragmento, executor)
+    else:
+        fragmentos = procesar_fragmentos(titulos, keywords, abstracts, 0, tam_fragmento)
+    t1 = time.perf_counter()
+
+    resultado = fusionar_fragmentos(fragmentos)
+    t2 = time.perf_counter()
+
+    etapas = [
+        reportar_etapa(f"Tokenización + stemming ({max(1, workers)} workers, {len(fragmentos)} fragmentos)", num_docs, t1 - t0),
+        reportar_etapa("Fusión de vocabularios y postings", num_docs, t2 - t1),
+    ]
+    if estadisticas is not None:
+        estadisticas.extend(etapas)
+
+    return resultado
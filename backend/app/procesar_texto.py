@@ -1,37 +1,80 @@
 import re
 from nltk.corpus import stopwords
 import nltk
-from unicodedata import normalize
+from functools import lru_cache
+from typing import Iterable, List
 import unicodedata
 nltk.download("stopwords", quiet=True)
 
-def normalizar_y_filtrar(texto):
-    if not texto:
-        return []
+# Tamaño máximo de la caché de stems (tokens distintos)
+TAM_CACHE_STEMS = 200_000
+
+class Tokenizador:
+    """
+    Pipeline de normalización, filtrado y stemming reutilizable: patrones
+    precompilados, stopwords construidas una sola vez y caché acotada de stems.
+    """
+
+    _tildes = re.compile(r'[\u0300-\u036f]')
+    # Separar números de letras en ambos sentidos (equivale a las dos
+    # sustituciones (\d+)([a-zñ]+) y ([a-zñ]+)(\d+) aplicadas en orden)
+    _numeros_letras = re.compile(r'(?<=\d)(?=[a-zñ])|(?<=[a-zñ])(?=\d)')
+    _no_alfanumerico = re.compile(r'[^a-zñ0-9\s]')
+
+    def __init__(self, idiomas=("english", "spanish"), tam_cache: int = TAM_CACHE_STEMS):
+        self.stop = frozenset(w for idioma in idiomas for w in stopwords.words(idioma))
+        self._stemmer = nltk.PorterStemmer()
+        self.stem = lru_cache(maxsize=tam_cache)(self._stemmer.stem)
+
+    def normalizar_y_filtrar(self, texto) -> List[str]:
+        if not texto:
+            return []
+
+        texto = str(texto).lower()
 
-    texto = str(texto).lower()
+        # --- Normalización para conservar ñ y eliminar tildes ---
+        texto = unicodedata.normalize('NFD', texto)
+        texto = texto.replace('ñ', '\001')                     # proteger la ñ
+        texto = self._tildes.sub('', texto)                   # eliminar tildes
+        texto = texto.replace('\001', 'ñ')                    # restaurar ñ
 
-    # --- Normalización para conservar ñ y eliminar tildes ---
-    texto = unicodedata.normalize('NFD', texto)
-    texto = texto.replace('ñ', '\001')                     # proteger la ñ
-    texto = re.sub(r'[\u0300-\u036f]', '', texto)         # eliminar tildes
-    texto = texto.replace('\001', 'ñ')                    # restaurar ñ
+        # --- Separar números de letras ---
+        texto = self._numeros_letras.sub(' ', texto)
 
-    # --- Separar números de letras ---
-    texto = re.sub(r'(\d+)([a-zñ]+)', r'\1 \2', texto)
-    texto = re.sub(r'([a-zñ]+)(\d+)', r'\1 \2', texto)
+        # --- Mantener solo letras, números y espacios ---
+        texto = self._no_alfanumerico.sub(' ', texto)
 
-    # --- Mantener solo letras, números y espacios ---
-    texto = re.sub(r'[^a-zñ0-9\s]', ' ', texto)
+        # Tokenización + stopwords español + inglés
+        stop = self.stop
+        return [t for t in texto.split() if t not in stop and len(t) > 1]
 
-    # Tokenización
-    tokens = texto.split()
+    def aplicar_stemming(self, lista_de_listas: Iterable[List[str]]) -> List[List[str]]:
+        stem = self.stem
+        return [[stem(t) for t in tokens] for tokens in lista_de_listas]
 
-    # Stopwords español + inglés
-    stop = set(stopwords.words("english")) | set(stopwords.words("spanish"))
+    def procesar_lote(self, textos: Iterable) -> List[List[str]]:
+        """
+        Normaliza, filtra y aplica stemming a una lista de textos en una sola llamada.
+        """
+        normalizar, stem = self.normalizar_y_filtrar, self.stem
+        return [[stem(t) for t in normalizar(texto)] for texto in textos]
+
+    def info_cache(self):
+        return self.stem.cache_info()
+
+_tokenizador = None
+
+def obtener_tokenizador() -> Tokenizador:
+    """
+    Tokenizador compartido del proceso (se crea en el primer uso).
+    """
+    global _tokenizador
+    if _tokenizador is None:
+        _tokenizador = Tokenizador()
+    return _tokenizador
+
+def normalizar_y_filtrar(texto):
+    return obtener_tokenizador().normalizar_y_filtrar(texto)
 
-    return [t for t in tokens if t not in stop and len(t) > 1]
-    
 def aplicar_stemming(lista_de_listas):
-    stemmer = nltk.PorterStemmer()
-    return [[stemmer.stem(t) for t in tokens] for tokens in lista_de_listas]
+    return obtener_tokenizador().aplicar_stemming(lista_de_listas)
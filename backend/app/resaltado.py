@@ -0,0 +1,159 @@
+"""
+Resaltado de términos de búsqueda compartido por todos los snippets.
+
+La consulta se compila una sola vez (un patrón de búsqueda con la
+alternativa de todos los tokens + un patrón por token para confirmar cuál
+coincide) y cada documento se recorre en una única pasada para obtener las
+posiciones de todas las coincidencias.
+"""
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+Coincidencia = Tuple[int, int]
+
+
+class Resaltador:
+    """
+    Resaltador compilado para una consulta.
+    - longitud_minima: los tokens más cortos se ignoran (los snippets usan > 2)
+    - limites_palabra: solo coincidencias de palabra completa (\\b...\\b)
+    """
+
+    def __init__(self, tokens: Sequence[str], longitud_minima: int = 3, limites_palabra: bool = False):
+        vistos = set()
+        self.tokens = []
+        for token in tokens:
+            if len(token) >= longitud_minima and token not in vistos:
+                vistos.add(token)
+                self.tokens.append(token)
+
+        plantilla = r'\b(?:{})\b' if limites_palabra else '(?:{})'
+        self._patrones = [
+            re.compile(plantilla.format(re.escape(t)), re.IGNORECASE) for t in self.tokens
+        ]
+        self._busqueda = None
+        if self.tokens:
+            alternativa = "|".join(p.pattern for p in self._patrones)
+            self._busqueda = re.compile(f"(?=(?:{alternativa}))", re.IGNORECASE)
+
+    def coincidencias(self, texto: str) -> List[List[Coincidencia]]:
+        """
+        Una pasada por el texto: para cada token, todas las posiciones
+        (inicio, fin) donde coincide, ordenadas y aunque se solapen.
+        """
+        resultado = [[] for _ in self.tokens]
+        if self._busqueda is None or not texto:
+            return resultado
+
+        patrones = self._patrones
+        for m in self._busqueda.finditer(texto):
+            p = m.start()
+            for i, patron in enumerate(patrones):
+                c = patron.match(texto, p)
+                if c:
+                    resultado[i].append((p, c.end()))
+        return resultado
+
+    @staticmethod
+    def _no_solapadas(lista: List[Coincidencia], desde: int, hasta: int, maximo: int = None) -> List[Coincidencia]:
+        """
+        Coincidencias que daría finditer sobre texto[desde:hasta]: de izquierda
+        a derecha y sin solaparse.
+        """
+        elegidas = []
+        fin = desde
+        for s, e in lista[bisect_left(lista, (desde, -1)):]:
+            if e > hasta:
+                break
+            if s >= fin:
+                elegidas.append((s, e))
+                fin = e
+                if maximo is not None and len(elegidas) >= maximo:
+                    break
+        return elegidas
+
+    @staticmethod
+    def _marcar(texto: str, desde: int, hasta: int, marcas: List[Coincidencia], apertura: str, cierre: str) -> str:
+        partes = []
+        cursor = desde
+        for s, e in marcas:
+            partes.append(texto[cursor:s])
+            partes.append(apertura)
+            partes.append(texto[s:e])
+            partes.append(cierre)
+            cursor = e
+        partes.append(texto[cursor:hasta])
+        return "".join(partes)
+
+    def resaltar(self, texto: str, apertura: str = "<b>", cierre: str = "</b>") -> str:
+        """
+        Envuelve todas las coincidencias del texto completo. Coincidencias
+        solapadas de tokens distintos se funden en una sola marca.
+        """
+        if not texto:
+            return texto
+
+        todas = sorted(c for lista in self.coincidencias(texto) for c in lista)
+        fundidas = []
+        for s, e in todas:
+            if fundidas and s < fundidas[-1][1]:
+                fundidas[-1] = (fundidas[-1][0], max(fundidas[-1][1], e))
+            else:
+                fundidas.append((s, e))
+        return self._marcar(texto, 0, len(texto), fundidas, apertura, cierre)
+
+    def snippet(self, texto: str, contexto: int = 40, max_por_token: int = 3, max_zonas: int = 3,
+                max_longitud: int = 300, apertura: str = "<b>", cierre: str = "</b>",
+                sin_texto: str = "Sin abstract disponible.") -> str:
+        """
+        Snippet con varias zonas del texto donde aparecen los tokens: para cada
+        token, hasta max_por_token ocurrencias con `contexto` caracteres a cada
+        lado, resaltando ese token dentro de la zona.
+        """
+        if not texto:
+            return sin_texto
+
+        n = len(texto)
+        zonas = []
+        vistas = set()
+        hubo_coincidencias = False
+        for lista in self.coincidencias(texto):
+            for s, e in self._no_solapadas(lista, 0, n, max_por_token):
+                hubo_coincidencias = True
+                start = max(0, s - contexto)
+                end = min(n, e + contexto)
+
+                zona = self._marcar(texto, start, end, self._no_solapadas(lista, start, end), apertura, cierre)
+                if start > 0:
+                    zona = "..." + zona
+                if end < n:
+                    zona = zona + "..."
+
+                if zona not in vistas and len(zona) > 10:
+                    vistas.add(zona)
+                    zonas.append(zona)
+
+        # Si no se encontraron coincidencias, tomar el inicio del texto
+        if not hubo_coincidencias:
+            snippet = texto[:max_longitud]
+            if n > max_longitud:
+                snippet = snippet + "..."
+            return snippet
+
+        resultado = " ... ".join(zonas[:max_zonas])
+        if len(resultado) > max_longitud:
+            resultado = resultado[:max_longitud] + "..."
+        return resultado
+
+
+@lru_cache(maxsize=256)
+def _resaltador_cacheado(tokens: Tuple[str, ...], longitud_minima: int, limites_palabra: bool) -> Resaltador:
+    return Resaltador(tokens, longitud_minima, limites_palabra)
+
+def obtener_resaltador(tokens: Sequence[str], longitud_minima: int = 3, limites_palabra: bool = False) -> Resaltador:
+    """
+    Resaltador compilado para estos tokens (se reutiliza entre documentos de la misma consulta).
+    """
+    return _resaltador_cacheado(tuple(tokens), longitud_minima, limites_palabra)
@@ -0,0 +1,88 @@
+"""
+Servidor local que imita el endpoint batchEmbedContents de Gemini, para
+probar la generación de embeddings por lotes sin red ni cuota:
+
+- responde 429 (RESOURCE_EXHAUSTED) a una fracción de las peticiones, al
+  azar, para ejercitar los reintentos y el limitador adaptativo
+- responde 400 (INVALID_ARGUMENT) a los lotes con algún texto que contenga
+  la marca `--veneno`, para ejercitar la bisección: solo ese documento debe
+  acabar en la lista de fallidos
+- el vector de cada texto es determinista: [longitud, suma de códigos % 97, 1]
+- GET / devuelve los contadores de peticiones ({"n", "429", "400"})
+
+    python -m app.servidor_embeddings_falso --puerto 8766 --tasa-429 0.3
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8766 GOOGLE_API_KEY=x python -m app.build_index ...
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def vector_falso(texto: str):
+    return [float(len(texto)), float(sum(map(ord, texto)) % 97), 1.0]
+
+
+def crear_servidor(puerto: int, tasa_429: float = 0.3, veneno: str = "VENENO", semilla: int = 0):
+    aleatorio = random.Random(semilla)
+    lock = threading.Lock()
+    contadores = {"n": 0, "429": 0, "400": 0}
+
+    class Manejador(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _responder(self, codigo: int, cuerpo: dict):
+            datos = json.dumps(cuerpo).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_POST(self):
+            cuerpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            textos = [r["content"]["parts"][0]["text"] for r in cuerpo.get("requests", [])]
+            with lock:
+                contadores["n"] += 1
+                limitada = aleatorio.random() < tasa_429
+                if limitada:
+                    contadores["429"] += 1
+                elif veneno and any(veneno in t for t in textos):
+                    contadores["400"] += 1
+            if limitada:
+                self._responder(429, {"error": {"code": 429, "message": "quota", "status": "RESOURCE_EXHAUSTED"}})
+            elif veneno and any(veneno in t for t in textos):
+                self._responder(400, {"error": {"code": 400, "message": "texto rechazado", "status": "INVALID_ARGUMENT"}})
+            else:
+                self._responder(200, {"embeddings": [{"values": vector_falso(t)} for t in textos]})
+
+        def do_GET(self):
+            with lock:
+                self._responder(200, dict(contadores))
+
+    return ThreadingHTTPServer(("127.0.0.1", puerto), Manejador)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de embeddings falso (API de Gemini) para pruebas")
+    parser.add_argument("--puerto", type=int, default=8766)
+    parser.add_argument("--tasa-429", type=float, default=0.3, help="Fracción de peticiones que reciben 429")
+    parser.add_argument("--veneno", default="VENENO", help="Marca de los textos que se rechazan con 400")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    servidor = crear_servidor(args.puerto, args.tasa_429, args.veneno, args.semilla)
+    print(f"✓ Servidor de embeddings falso en http://127.0.0.1:{args.puerto} "
+          f"(429: {args.tasa_429:.0%}, veneno: {args.veneno!r})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@ import numpy as np
 import re
 from typing import List  # Añade esta importación
 
+from .resaltado import obtener_resaltador
+
 def resaltar_texto_html(texto: str, tokens: List[str]) -> str:
     """
     Resalta todas las apariciones de los tokens en el texto con HTML.
@@ -10,16 +12,9 @@ def resaltar_texto_html(texto: str, tokens: List[str]) -> str:
     if not texto:
         return ""
     
-    texto_resaltado = texto
-    for token in tokens:
-        if len(token) > 2:
-            pattern = re.compile(re.escape(token), re.IGNORECASE)
-            texto_resaltado = pattern.sub(
-                lambda m: f'<span style="font-weight: bold; color: #0066cc;">{m.group(0)}</span>', 
-                texto_resaltado
-            )
-    
-    return texto_resaltado
+    return obtener_resaltador(tokens).resaltar(
+        texto, '<span style="font-weight: bold; color: #0066cc;">', '</span>'
+    )
 
 def formatear_titulo_azul(titulo: str) -> str:
     """